@@ -1,187 +1,3538 @@
 import os
-from flask import Flask, request, jsonify, send_from_directory
+import sys
+import io
+import csv
+import tempfile
+import multiprocessing
+import atexit
+import contextvars
+import functools
+from contextlib import contextmanager
+from flask import Flask, Blueprint, Response, request, jsonify, send_from_directory, stream_with_context
 from flask_cors import CORS
 import requests as httpRequest
 from scholarly import scholarly, ProxyGenerator
 from rank_bm25 import BM25Okapi
+import numpy as np
+from scipy.sparse import csr_matrix
 import nltk
 import logging
 from xml.etree import ElementTree as ET
 import ollama
 import random
+import json
+import time
+import hashlib
+import uuid
+import sqlite3
+import threading
+import queue
+import copy
+import heapq
+import re
+import zlib
+from collections import OrderedDict, deque
+import math
+from collections import Counter
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+import pypdf
+from concurrent.futures.process import BrokenProcessPool
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from ingest_worker import extract_image_text, extract_pdf_pages
 
 # --- Setup ---
-app = Flask(__name__,
-            static_folder='.',
-            static_url_path='',
-            template_folder='templates')
-CORS(app)
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# API routes are registered on this blueprint; create_app() builds the Flask app.
+api = Blueprint('api', __name__)
+
+def ensure_nltk_data():
+    try:
+        nltk.data.find('tokenizers/punkt')
+    except LookupError:
+        logger.info("NLTK 'punkt' tokenizer not found. Downloading...")
+        nltk.download('punkt')
+        logger.info("'punkt' downloaded.")
+
+# --- Helper Functions ---
+STOPWORDS = frozenset('''
+a about above after again against all also am an and any are as at be because been before being below
+between both but by can could did do does doing down during each et al few for from further had has have
+having he her here hers him his how however i if in into is it its itself just may me might more most must
+my no nor not now of off on once only or other our ours out over own same she should so some such than that
+the their theirs them then there these they this those through thus to too under until up upon us using
+very via was we were what when where whether which while who whom why will with within without would you your
+use used uses using include includes including introduce introduced show shows shown study studies studied
+propose proposed present presented based new paper approach results well one two first e.g i.e etc
+'''.split())
+
+def tokenize(text):
+    if not text:
+        return []
+    return nltk.word_tokenize(text.lower())
+
+# --- Metrics and Timing ---
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SERVER_TIMING_ENABLED = os.environ.get('SERVER_TIMING', '').lower() in ('1', 'true', 'yes')
+# Spans recorded while handling the current request, for the Server-Timing header.
+request_timings = contextvars.ContextVar('request_timings', default=None)
+
+class MetricsRegistry:
+    """In-process counters and latency histograms rendered in the Prometheus text format.
+
+    Collectors registered with add_collector() are called at scrape time for
+    values that already live elsewhere (cache and rate limiter counters). Each
+    gunicorn worker has its own registry, so Prometheus should scrape every
+    worker or aggregate by instance.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.collectors = []
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name, amount=1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def add_collector(self, collector):
+        """collector() returns (name, type, labels dict, value) samples"""
+        self.collectors.append(collector)
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+        return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+    def render(self):
+        families = {}
+        with self.lock:
+            for (name, labels), value in self.counters.items():
+                families.setdefault((name, 'counter'), []).append(f"{name}{self._labels(labels)} {value}")
+            for (name, labels), histogram in self.histograms.items():
+                lines = families.setdefault((name, 'histogram'), [])
+                for bound, count in zip(self.buckets, histogram):
+                    lines.append(f"{name}_bucket{self._labels(labels, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{self._labels(labels, [('le', '+Inf')])} {histogram[-1]}")
+                lines.append(f"{name}_sum{self._labels(labels)} {histogram[-2]}")
+                lines.append(f"{name}_count{self._labels(labels)} {histogram[-1]}")
+        for collector in self.collectors:
+            try:
+                for name, kind, labels, value in collector():
+                    families.setdefault((name, kind), []).append(f"{name}{self._labels(sorted(labels.items()))} {value}")
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {e}")
+        out = []
+        for (name, kind), lines in sorted(families.items()):
+            out.append(f"# TYPE {name} {kind}")
+            out.extend(lines)
+        return '\n'.join(out) + '\n'
+
+metrics = MetricsRegistry()
+
+@contextmanager
+def span(stage):
+    """Time a stage into stage_duration_seconds and the current request's Server-Timing list"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.observe('stage_duration_seconds', elapsed, stage=stage)
+        timings = request_timings.get()
+        if timings is not None:
+            timings.append((stage, elapsed))
+
+def timed(stage):
+    """Decorator form of span()"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def submit_with_context(executor, fn, *args):
+    """executor.submit that carries the caller's context, so spans in the worker reach its Server-Timing"""
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+# --- Google Scholar Proxy Rotation and Worker Pool ---
+proxies = []
+proxy_file_path = 'proxies.txt'
+
+def load_proxies():
+    """Load proxies from file if available"""
+    global proxies
+    if os.path.exists(proxy_file_path):
+        with open(proxy_file_path, 'r') as f:
+            proxies = [line.strip() for line in f if line.strip()]
+        logger.info(f"Loaded {len(proxies)} proxies from {proxy_file_path}")
+    else:
+        logger.warning(f"Proxy file not found: {proxy_file_path}. Scholarly will operate without proxies.")
+
+SCHOLAR_WORKERS = int(os.environ.get('SCHOLAR_WORKERS', 1))
+SCHOLAR_PROXY_ATTEMPTS = int(os.environ.get('SCHOLAR_PROXY_ATTEMPTS', 3))
+SCHOLAR_JOB_HISTORY = 500
+PROXY_CHECK_URL = os.environ.get('PROXY_CHECK_URL', 'https://scholar.google.com/robots.txt')
+PROXY_CHECK_TIMEOUT = float(os.environ.get('PROXY_CHECK_TIMEOUT', 8))
+PROXY_CHECK_INTERVAL = float(os.environ.get('PROXY_CHECK_INTERVAL', 60))
+PROXY_CHECK_BATCH = int(os.environ.get('PROXY_CHECK_BATCH', 32))
+PROXY_QUARANTINE_SECONDS = float(os.environ.get('PROXY_QUARANTINE_SECONDS', 600))
+PROXY_MAX_CONCURRENCY = int(os.environ.get('PROXY_MAX_CONCURRENCY', 1))
+# Latency assumed for proxies that have not been measured yet, so measured fast
+# proxies are preferred but unchecked ones still get a turn.
+PROXY_UNKNOWN_LATENCY = 5.0
+PROXY_LATENCY_ALPHA = 0.3
+
+class ProxyRotator:
+    """Score proxies by observed latency and failures, and hand out the best healthy one.
+
+    Every outcome (health check or real search) updates an exponentially weighted
+    latency and a failure count; a proxy that fails twice in a row is quarantined
+    for PROXY_QUARANTINE_SECONDS. acquire() never hands a proxy to more than
+    max_concurrency callers at once.
+    """
+
+    def __init__(self, proxy_urls=(), max_concurrency=PROXY_MAX_CONCURRENCY, quarantine_seconds=PROXY_QUARANTINE_SECONDS):
+        self.max_concurrency = max_concurrency
+        self.quarantine_seconds = quarantine_seconds
+        self.lock = threading.Lock()
+        self.states = {}
+        self.stop_event = threading.Event()
+        self.checker = None
+        self.add_proxies(proxy_urls)
+
+    def add_proxies(self, proxy_urls):
+        with self.lock:
+            for url in proxy_urls:
+                self.states.setdefault(url, {"latency": None, "successes": 0, "failures": 0, "consecutive_failures": 0,
+                                             "quarantined_until": 0.0, "in_flight": 0, "checked_at": None})
+
+    def _score(self, state):
+        latency = state["latency"] if state["latency"] is not None else PROXY_UNKNOWN_LATENCY
+        return latency * (1 + state["failures"] / (state["successes"] + 1))
+
+    def _available(self, state, now):
+        return state["quarantined_until"] <= now and state["in_flight"] < self.max_concurrency
+
+    def acquire(self, exclude=()):
+        """Reserve the best available proxy, or return None if none is available"""
+        with self.lock:
+            now = time.monotonic()
+            candidates = [(self._score(state), url) for url, state in self.states.items()
+                          if url not in exclude and self._available(state, now)]
+            if not candidates:
+                return None
+            # Spread load over the few best proxies rather than pinning one.
+            url = random.choice(heapq.nsmallest(3, candidates))[1]
+            self.states[url]["in_flight"] += 1
+            return url
+
+    def release(self, url):
+        with self.lock:
+            self.states[url]["in_flight"] -= 1
+
+    def record(self, url, ok, latency=None):
+        """Fold a success (with its latency) or a failure into the proxy's score"""
+        with self.lock:
+            state = self.states[url]
+            state["checked_at"] = time.time()
+            if ok:
+                state["successes"] += 1
+                state["consecutive_failures"] = 0
+                state["quarantined_until"] = 0.0
+                if latency is not None:
+                    previous = state["latency"]
+                    state["latency"] = latency if previous is None else (
+                        PROXY_LATENCY_ALPHA * latency + (1 - PROXY_LATENCY_ALPHA) * previous)
+            else:
+                state["failures"] += 1
+                state["consecutive_failures"] += 1
+                if state["consecutive_failures"] >= 2:
+                    state["quarantined_until"] = time.monotonic() + self.quarantine_seconds
+
+    def check(self, url):
+        """Probe one proxy with a lightweight request and record the outcome"""
+        started = time.monotonic()
+        try:
+            resp = httpRequest.get(PROXY_CHECK_URL, proxies={'http': url, 'https': url}, timeout=PROXY_CHECK_TIMEOUT)
+            resp.close()
+            ok = resp.status_code < 400
+        except Exception:
+            ok = False
+        self.record(url, ok, time.monotonic() - started)
+        return ok
+
+    def due_for_check(self, limit):
+        """Unchecked proxies first, then those whose quarantine ended, then the stalest"""
+        with self.lock:
+            now = time.monotonic()
+            idle = [(url, state) for url, state in self.states.items()
+                    if state["in_flight"] == 0 and state["quarantined_until"] <= now]
+            idle.sort(key=lambda item: (item[1]["checked_at"] is not None, item[1]["checked_at"] or 0))
+            return [url for url, _ in idle[:limit]]
+
+    def _health_loop(self, interval, batch):
+        with ThreadPoolExecutor(max_workers=min(batch, 16), thread_name_prefix="proxy-check") as checker_pool:
+            while not self.stop_event.is_set():
+                list(checker_pool.map(self.check, self.due_for_check(batch)))
+                self.stop_event.wait(interval)
+
+    def start_health_checks(self, interval=PROXY_CHECK_INTERVAL, batch=PROXY_CHECK_BATCH):
+        """Start the background health checker (once)"""
+        with self.lock:
+            if self.checker is not None or not self.states:
+                return
+            self.checker = threading.Thread(target=self._health_loop, args=(interval, batch),
+                                            name="proxy-health", daemon=True)
+        self.checker.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def summary(self, top=10):
+        with self.lock:
+            now = time.monotonic()
+            states = list(self.states.items())
+            quarantined = sum(1 for _, s in states if s["quarantined_until"] > now)
+            checked = [(url, s) for url, s in states if s["checked_at"] is not None]
+            healthy = [(url, s) for url, s in checked if s["quarantined_until"] <= now and s["successes"]]
+            best = sorted(healthy, key=lambda item: self._score(item[1]))[:top]
+            return {
+                "total": len(states),
+                "checked": len(checked),
+                "healthy": len(healthy),
+                "quarantined": quarantined,
+                "in_flight": sum(s["in_flight"] for _, s in states),
+                "best": [{"proxy": url, "latency": round(s["latency"], 3) if s["latency"] is not None else None,
+                          "successes": s["successes"], "failures": s["failures"]} for url, s in best],
+            }
+
+class ScholarWorkerPool:
+    """Run Google Scholar searches on dedicated worker threads that own the proxy setup.
+
+    scholarly keeps a single global session, so proxy configuration and the search
+    that uses it happen together under one lock, and a working proxy is kept until
+    it fails instead of being reconfigured for every request. A failed search is
+    retried through the next best proxy.
+    """
+
+    def __init__(self, rotator, workers=SCHOLAR_WORKERS):
+        self.rotator = rotator
+        self.workers = workers
+        self.jobs = queue.Queue()
+        self.scholarly_lock = threading.Lock()
+        self.start_lock = threading.Lock()
+        self.threads = []
+        self.current_proxy = None
+        self.direct_configured = False
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "proxy_switches": 0}
+
+    def start(self):
+        with self.start_lock:
+            if self.threads:
+                return
+            self.rotator.start_health_checks()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"scholar-worker-{i}", daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def submit(self, query, max_results=10, year_low=None, year_high=None):
+        """Queue a search; returns a Future resolving to the normalized papers"""
+        self.start()
+        future = Future()
+        self.stats["submitted"] += 1
+        self.jobs.put((future, (query, max_results, year_low, year_high)))
+        return future
+
+    def search(self, query, max_results=10, year_low=None, year_high=None):
+        return self.submit(query, max_results, year_low, year_high).result()
+
+    def _work(self):
+        while True:
+            future, args = self.jobs.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self._run(*args))
+                self.stats["completed"] += 1
+            except Exception as e:
+                self.stats["failed"] += 1
+                future.set_exception(e)
+
+    def _drop_proxy(self):
+        if self.current_proxy:
+            self.rotator.release(self.current_proxy)
+            self.current_proxy = None
+
+    def _configure_proxy(self, tried):
+        """Keep the current proxy if it is still healthy, otherwise switch to the best available one"""
+        if self.current_proxy:
+            return self.current_proxy
+        while len(tried) < SCHOLAR_PROXY_ATTEMPTS:
+            proxy = self.rotator.acquire(exclude=tried)
+            if proxy is None:
+                break
+            tried.add(proxy)
+            pg = ProxyGenerator()
+            started = time.monotonic()
+            try:
+                ok = pg.SingleProxy(http=proxy, https=proxy)
+            except Exception as e:
+                logger.warning(f"Could not configure proxy {proxy}: {e}")
+                ok = False
+            self.rotator.record(proxy, ok, time.monotonic() - started)
+            if ok:
+                scholarly.use_proxy(pg)
+                self.current_proxy = proxy
+                self.direct_configured = False
+                self.stats["proxy_switches"] += 1
+                logger.info(f"Scholar workers now using proxy {proxy}")
+                return proxy
+            self.rotator.release(proxy)
+        if not self.direct_configured:
+            logger.warning("No healthy proxy available. Scholarly will attempt direct connection.")
+            scholarly.use_proxy(None)
+            self.direct_configured = True
+        return None
+
+    def _run(self, query, max_results, year_low, year_high):
+        tried = set()
+        last_error = None
+        for _ in range(SCHOLAR_PROXY_ATTEMPTS):
+            with self.scholarly_lock:
+                proxy = self._configure_proxy(tried)
+                started = time.monotonic()
+                try:
+                    with span('scholar.search'):
+                        results = search_google_scholar(query, max_results, year_low, year_high)
+                except Exception as e:
+                    last_error = e
+                    if proxy is None:
+                        raise
+                    logger.warning(f"Scholar search via {proxy} failed: {e}")
+                    self.rotator.record(proxy, False)
+                    self._drop_proxy()
+                    continue
+            if proxy:
+                self.rotator.record(proxy, True, time.monotonic() - started)
+            return results
+        raise last_error
+
+    def summary(self):
+        return {"workers": self.workers, "queued": self.jobs.qsize(),
+                "current_proxy": self.current_proxy, **self.stats}
+
+# Filled from proxies.txt by start_runtime().
+proxy_rotator = ProxyRotator()
+scholar_pool = ScholarWorkerPool(proxy_rotator)
+# Finished and pending async Scholar jobs by id, oldest first.
+scholar_jobs = OrderedDict()
+scholar_jobs_lock = threading.Lock()
+
+# --- Rate Limiting and Request Coalescing ---
+
+class TokenBucket:
+    """Thread-safe token bucket; acquire() blocks until a token is available"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "delayed": 0, "delay_seconds": 0.0}
+
+    def acquire(self):
+        """Take one token, sleeping if the bucket is empty. Returns the seconds waited."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Reserve the token now (possibly going negative) so waiters queue in order.
+            self.tokens -= 1
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            self.stats["requests"] += 1
+            if delay:
+                self.stats["delayed"] += 1
+                self.stats["delay_seconds"] += delay
+        if delay:
+            time.sleep(delay)
+        return delay
+
+class SharedTokenBucket(TokenBucket):
+    """Token bucket whose tokens live in SQLite, so every gunicorn worker draws from one budget.
+
+    Each acquire is one short write transaction; stats stay per process.
+    """
+
+    def __init__(self, rate, capacity, path, name):
+        super().__init__(rate, capacity)
+        self.name = name
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+
+    def acquire(self):
+        """Take one token, sleeping if the bucket is empty. Returns the seconds waited."""
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (self.name,)).fetchone()
+                # Wall-clock time, since monotonic clocks are not comparable across processes.
+                now = time.time()
+                tokens = self.capacity if row is None else min(self.capacity, row[0] + max(now - row[1], 0.0) * self.rate)
+                tokens -= 1
+                self.conn.execute("INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)", (self.name, tokens, now))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+            delay = -tokens / self.rate if tokens < 0 else 0.0
+            self.stats["requests"] += 1
+            if delay:
+                self.stats["delayed"] += 1
+                self.stats["delay_seconds"] += delay
+        if delay:
+            time.sleep(delay)
+        return delay
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into one execution.
+
+    The first caller runs the function; callers arriving while it is in flight
+    wait for it and receive a copy of its result (or its exception).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.stats = {}
+
+    def _count(self, namespace, counter):
+        counters = self.stats.setdefault(namespace, {"executed": 0, "coalesced": 0})
+        counters[counter] += 1
+
+    def do(self, namespace, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = {"event": threading.Event(), "result": None, "error": None}
+            self._count(namespace, "executed" if leader else "coalesced")
+
+        if not leader:
+            call["event"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return copy.deepcopy(call["result"])
+
+        try:
+            call["result"] = fn()
+            return call["result"]
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call["event"].set()
+
+# Published or conservative request rates per source as (requests per second, burst).
+# arXiv asks for one request every three seconds; NCBI allows 3/s without an API key.
+SOURCE_RATE_LIMITS = {
+    'pubmed': (3, 3),
+    'scholar': (0.5, 2),
+    'arxiv': (1 / 3, 1),
+    'semantic': (1, 1),
+    'crossref': (5, 5),
+}
+UPSTREAM_HOST_SOURCES = {
+    'eutils.ncbi.nlm.nih.gov': 'pubmed',
+    'export.arxiv.org': 'arxiv',
+    'api.semanticscholar.org': 'semantic',
+    'api.crossref.org': 'crossref',
+}
+RATE_LIMIT_DB_PATH = os.environ.get('RATE_LIMIT_DB_PATH', os.path.join('cache', 'rate_limits.sqlite3'))
+# Shared across worker processes so running several workers does not multiply the upstream budgets.
+rate_limiters = {source: SharedTokenBucket(rate, burst, RATE_LIMIT_DB_PATH, source) for source, (rate, burst) in SOURCE_RATE_LIMITS.items()}
+search_flights = SingleFlight()
+
+def throttle_source(source):
+    """Wait for the source's rate limiter, logging when the request had to be delayed"""
+    delay = rate_limiters[source].acquire()
+    if delay:
+        logger.info(f"Rate limiter delayed {source} request by {delay:.2f}s")
+
+# --- HTTP Client ---
+# One pooled keep-alive session per upstream host, a per-host concurrency cap
+# and retries with exponential backoff on throttling and transient errors.
+
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', 10))
+HTTP_MAX_RETRIES = int(os.environ.get('HTTP_MAX_RETRIES', 3))
+HTTP_BACKOFF_BASE = float(os.environ.get('HTTP_BACKOFF_BASE', 0.5))
+HTTP_RETRY_MAX_DELAY = float(os.environ.get('HTTP_RETRY_MAX_DELAY', 10))
+HTTP_RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Maximum simultaneous requests per host; NCBI allows 3 requests/second without an API key.
+HTTP_DEFAULT_HOST_CONCURRENCY = int(os.environ.get('HTTP_HOST_CONCURRENCY', 8))
+HTTP_HOST_CONCURRENCY = {
+    'eutils.ncbi.nlm.nih.gov': 3,
+    'export.arxiv.org': 4,
+    'api.semanticscholar.org': 4,
+}
+
+http_sessions = {}
+http_semaphores = {}
+http_clients_lock = threading.Lock()
+
+def get_http_session(host):
+    """Return the shared session and concurrency semaphore for a host, creating them on first use"""
+    with http_clients_lock:
+        if host not in http_sessions:
+            session = httpRequest.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE, max_retries=0)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            http_sessions[host] = session
+            http_semaphores[host] = threading.BoundedSemaphore(HTTP_HOST_CONCURRENCY.get(host, HTTP_DEFAULT_HOST_CONCURRENCY))
+        return http_sessions[host], http_semaphores[host]
+
+def retry_delay(response, attempt):
+    """Seconds to wait before the next attempt, preferring the server's Retry-After"""
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+            except (TypeError, ValueError):
+                delay = None
+        if delay is not None:
+            return min(max(delay, 0), HTTP_RETRY_MAX_DELAY)
+    return min(HTTP_BACKOFF_BASE * (2 ** attempt) * (1 + random.random()), HTTP_RETRY_MAX_DELAY)
+
+def record_upstream(source, status, elapsed):
+    """Count one upstream attempt; streamed responses are timed until their headers arrive"""
+    metrics.inc('upstream_requests_total', source=source, status=status)
+    metrics.observe('upstream_request_duration_seconds', elapsed, source=source)
+
+def release_on_close(response, semaphore):
+    """Release a slot of semaphore when the streamed response is closed (once, however often close is called)"""
+    close, held = response.close, [True]
+
+    def close_and_release():
+        try:
+            close()
+        finally:
+            if held:
+                held.pop()
+                semaphore.release()
+    response.close = close_and_release
+
+def http_request(method, url, **kwargs):
+    """Send a request through the host's pooled session, retrying 429/5xx and connection errors"""
+    host = urlparse(url).netloc
+    session, semaphore = get_http_session(host)
+    source = UPSTREAM_HOST_SOURCES.get(host)
+    for attempt in range(HTTP_MAX_RETRIES + 1):
+        response = None
+        if source:
+            throttle_source(source)
+        started = time.perf_counter()
+        try:
+            semaphore.acquire()
+            try:
+                response = session.request(method, url, **kwargs)
+            except BaseException:
+                semaphore.release()
+                raise
+            if kwargs.get('stream'):
+                # The body is still to be downloaded; keep the host slot until the response is closed.
+                release_on_close(response, semaphore)
+            else:
+                semaphore.release()
+            record_upstream(source or host, response.status_code, time.perf_counter() - started)
+            if response.status_code not in HTTP_RETRY_STATUSES or attempt == HTTP_MAX_RETRIES:
+                return response
+        except (httpRequest.exceptions.ConnectionError, httpRequest.exceptions.Timeout) as e:
+            record_upstream(source or host, 'error', time.perf_counter() - started)
+            if attempt == HTTP_MAX_RETRIES:
+                raise
+            logger.warning(f"{method} {host} failed ({e}); retrying")
+        delay = retry_delay(response, attempt)
+        if response is not None:
+            logger.warning(f"{method} {host} returned {response.status_code}; retrying in {delay:.1f}s")
+            response.close()
+        time.sleep(delay)
+
+def http_get(url, **kwargs):
+    return http_request('GET', url, **kwargs)
+
+def http_post(url, **kwargs):
+    return http_request('POST', url, **kwargs)
+
+# --- Source Search Functions ---
+# Each function queries one upstream source and returns a list of normalized
+# paper dicts. Errors propagate to the caller, which decides how to report them.
+
+# Direct-child paths within a PubmedArticle; avoiding './/' keeps lookups from
+# scanning whole subtrees and from matching reference-list ArticleIds.
+PUBMED_PMID_PATH = 'MedlineCitation/PMID'
+PUBMED_ARTICLE_PATH = 'MedlineCitation/Article'
+PUBMED_ABSTRACT_PATH = 'Abstract/AbstractText'
+PUBMED_AUTHOR_PATH = 'AuthorList/Author'
+PUBMED_JOURNAL_DATE_PATH = 'Journal/JournalIssue/PubDate'
+PUBMED_DOI_PATH = 'PubmedData/ArticleIdList/ArticleId[@IdType="doi"]'
+PUBMED_MONTHS = {"jan": "01", "feb": "02", "mar": "03", "apr": "04", "may": "05", "jun": "06", "jul": "07", "aug": "08", "sep": "09", "oct": "10", "nov": "11", "dec": "12"}
+
+def child_text(node, path):
+    child = node.find(path)
+    return child.text if child is not None and child.text else ""
+
+def parse_pubmed_article(article_et):
+    """Normalize one <PubmedArticle> element into a paper dict"""
+    pmid_node = article_et.find(PUBMED_PMID_PATH)
+    pmid = pmid_node.text if pmid_node is not None else None
+    article_node = article_et.find(PUBMED_ARTICLE_PATH)
+    if article_node is None:
+        article_node = ET.Element('Article')
+    article_title_node = article_node.find('ArticleTitle')
+    title_parts = [text_part for text_part in article_title_node.itertext()] if article_title_node is not None else []
+    title = "".join(title_parts).strip() if title_parts else 'N/A'
+
+    abstract_parts = []
+    for node in article_node.findall(PUBMED_ABSTRACT_PATH):
+        node_text = "".join(node.itertext()).strip()
+        if node_text:
+            label = node.get('Label')
+            abstract_parts.append(f"{label}: {node_text}" if label else node_text)
+    abstract = "\n".join(abstract_parts) if abstract_parts else "No abstract available."
+
+    authors = []
+    for author_node in article_node.findall(PUBMED_AUTHOR_PATH):
+        last_name = child_text(author_node, 'LastName')
+        fore_name = child_text(author_node, 'ForeName')
+        initials = child_text(author_node, 'Initials')
+        author_name = ""
+        if fore_name and last_name: author_name = f"{fore_name} {last_name}"
+        elif last_name and initials: author_name = f"{initials} {last_name}"
+        elif last_name: author_name = last_name
+        elif fore_name: author_name = fore_name
+        if author_name: authors.append(author_name.strip())
+
+    pub_date_node = article_node.find('ArticleDate')
+    if pub_date_node is None:
+        pub_date_node = article_node.find(PUBMED_JOURNAL_DATE_PATH)
+    year_val, pub_date_str = None, "N/A"
+    if pub_date_node is not None:
+        year_text = child_text(pub_date_node, 'Year')
+        if year_text:
+            try:
+                year_val = int(year_text)
+                month_str = child_text(pub_date_node, 'Month') or "01"
+                try: month_val = int(month_str)
+                except ValueError:
+                    month_val = PUBMED_MONTHS.get(month_str.lower()[:3], "01")
+                day_str = child_text(pub_date_node, 'Day') or "01"
+                pub_date_str = f"{year_val}-{str(month_val).zfill(2)}-{day_str.zfill(2)}"
+            except ValueError:
+                logger.warning(f"Could not parse year for PMID {pmid}: {year_text}")
+                pub_date_str = year_text
+
+    doi_node = article_et.find(PUBMED_DOI_PATH)
+    doi = doi_node.text if doi_node is not None else None
+    return {
+        "id": f"pubmed_{pmid}", "title": title, "authors": authors, "abstract": abstract,
+        "publishedDate": pub_date_str, "year": year_val,
+        "url": f"https://pubmed.ncbi.nlm.nih.gov/{pmid}/" if pmid else (f"https://doi.org/{doi}" if doi else None),
+        "pdfUrl": f"https://doi.org/{doi}" if doi else None, "source": "PubMed", "citations": None, "doi": doi,
+        "relevanceScore": 0.6
+    }
+
+def iter_xml_records(stream, record_tag, parse_record):
+    """Incrementally parse an XML stream, yielding parse_record(element) for each record_tag.
+
+    Finished records are cleared from the tree so memory stays flat regardless
+    of response size.
+    """
+    root = None
+    for event, elem in ET.iterparse(stream, events=('start', 'end')):
+        if root is None:
+            root = elem
+        if event == 'end' and elem.tag == record_tag:
+            yield parse_record(elem)
+            root.clear()
+
+def iter_response_records(response, record_tag, parse_record):
+    """Stream records out of an HTTP response body as it downloads; the response is closed however iteration ends"""
+    try:
+        response.raise_for_status()
+        response.raw.decode_content = True
+        yield from iter_xml_records(response.raw, record_tag, parse_record)
+    finally:
+        response.close()
+
+# Search filters shared by every source: yearStart/yearEnd, subject (an arXiv
+# archive such as 'cs' or a category such as 'math.NT') and paperType
+# (research, review, survey or conference). Empty or 'all' means unfiltered.
+# Each source pushes down whatever its API can filter on.
+
+def filter_value(filters, key):
+    value = (filters or {}).get(key)
+    return None if value in (None, '', 'all') else str(value).strip()
+
+def filter_years(filters):
+    """(year_start, year_end) as ints, either None when unset"""
+    year_start, year_end = filter_value(filters, 'yearStart'), filter_value(filters, 'yearEnd')
+    return int(year_start) if year_start else None, int(year_end) if year_end else None
+
+EUTILS_BASE = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/'
+PUBMED_PAPER_TYPES = {'review': 'review[Publication Type]', 'survey': 'review[Publication Type]',
+                      'conference': 'congress[Publication Type]'}
+
+def pubmed_term(query, filters=None):
+    """ESearch term for query with the year range and paper type filters applied"""
+    filters = filters or {}
+    term = query
+    year_start_filter = filters.get('yearStart')
+    year_end_filter = filters.get('yearEnd')
+    date_filter_string = ""
+    if year_start_filter or year_end_filter:
+        start_date_pubmed = str(year_start_filter) if year_start_filter else "1000"
+        end_date_pubmed = str(year_end_filter) if year_end_filter else "3000"
+        date_filter_string = f" AND ({start_date_pubmed}[Date - Publication]:{end_date_pubmed}[Date - Publication])"
+    paper_type = PUBMED_PAPER_TYPES.get(filter_value(filters, 'paperType'))
+    if paper_type:
+        date_filter_string += f" AND {paper_type}"
+    return term + date_filter_string
+
+def pubmed_esearch(query, max_results, filters=None):
+    """Run ESearch with the history server enabled and return its 'esearchresult'"""
+    search_params = {'db': 'pubmed', 'term': pubmed_term(query, filters), 'retmax': max_results, 'usehistory': 'y', 'retmode': 'json', 'sort': 'relevance'}
+    logger.info(f"PubMed ESearch params: {search_params}")
+    with span('pubmed.esearch'):
+        search_resp = http_get(f"{EUTILS_BASE}esearch.fcgi", params=search_params, timeout=30)
+        search_resp.raise_for_status()
+        search_data = search_resp.json()
+    logger.debug(f"PubMed ESearch response data: {search_data}")
+    return search_data.get("esearchresult", {})
+
+def stream_pubmed(query, max_results=10, filters=None):
+    """Search PubMed via ESearch + EFetch, yielding normalized papers as EFetch streams in"""
+    id_list = pubmed_esearch(query, max_results, filters).get("idlist")
+    if not id_list:
+        logger.info("No PubMed IDs found for the query.")
+        return
+
+    fetch_params = {'db': 'pubmed', 'id': ','.join(id_list), 'retmode': 'xml'}
+    logger.info(f"PubMed EFetch params: {fetch_params}")
+    # EFetch is parsed while it downloads, so this span covers both.
+    with span('pubmed.efetch'):
+        fetch_resp = http_post(f"{EUTILS_BASE}efetch.fcgi", data=fetch_params, timeout=45, stream=True)
+        yield from iter_response_records(fetch_resp, 'PubmedArticle', parse_pubmed_article)
+
+def fetch_pubmed_history_page(webenv, query_key, retstart, retmax):
+    """EFetch one page of a search stored on the PubMed history server"""
+    fetch_params = {'db': 'pubmed', 'WebEnv': webenv, 'query_key': query_key, 'retstart': retstart, 'retmax': retmax, 'retmode': 'xml'}
+    logger.info(f"PubMed EFetch history page: retstart={retstart}, retmax={retmax}")
+    with span('pubmed.efetch'):
+        fetch_resp = http_post(f"{EUTILS_BASE}efetch.fcgi", data=fetch_params, timeout=90, stream=True)
+        return list(iter_response_records(fetch_resp, 'PubmedArticle', parse_pubmed_article))
+
+def search_pubmed(query, max_results=10, filters=None):
+    """Search PubMed via ESearch + EFetch and return normalized papers"""
+    papers = list(stream_pubmed(query, max_results, filters))
+    logger.info(f"PubMed search successful, processed {len(papers)} articles.")
+    return papers
+
+
+def search_google_scholar(query, max_results=10, year_low=None, year_high=None):
+    """Search Google Scholar via scholarly and return normalized papers"""
+    results = []
+    throttle_source('scholar')
+
+    search_args = {'query': query}
+    if year_low is not None: search_args['year_low'] = int(year_low)
+    if year_high is not None: search_args['year_high'] = int(year_high)
+    
+    logger.info(f"Calling scholarly.search_pubs with args: {search_args}")
+    search_results_gen = scholarly.search_pubs(**search_args)
+    
+    count = 0
+    for item in search_results_gen:
+        if count >= max_results: break
+        
+        bib = item.get('bib', {})
+        abstract_text = bib.get('abstract', 'N/A')
+        pub_year = bib.get('pub_year')
+        try:
+            year_int = int(pub_year) if pub_year else None
+        except (ValueError, TypeError):
+            year_int = None
+
+        authors_data = bib.get('author')
+        authors_list = []
+        if isinstance(authors_data, str):
+            authors_list = authors_data.split(' and ')
+        elif isinstance(authors_data, list):
+            authors_list = authors_data
+        else:
+            authors_list = []
+
+        results.append({
+            "id": f"scholar_{item.get('id_scholarcitedby', bib.get('title', f'untitled_{count}'))}",
+            "title": bib.get('title', 'N/A'),
+            "authors": authors_list,
+            "abstract": abstract_text,
+            "venue": bib.get('venue', None),
+            "year": year_int,
+            "publishedDate": f"{year_int}-01-01" if year_int else None,
+            "url": item.get('pub_url', item.get('eprint_url', None)),
+            "pdfUrl": item.get('eprint_url') if item.get('eprint_url') and "pdf" in item.get('eprint_url', "").lower() else None,
+            "citations": bib.get('num_citations', 0),
+            "source": "Google Scholar",
+            "relevanceScore": 0.7
+        })
+        count += 1
+    logger.info(f"Google Scholar search successful, found {len(results)} results.")
+    return results
+
+
+ATOM_NS = '{http://www.w3.org/2005/Atom}'
+ARXIV_NS = '{http://arxiv.org/schemas/atom}'
+ATOM_ENTRY_TAG = f'{ATOM_NS}entry'
+
+def parse_arxiv_entry(entry):
+    """Normalize one Atom <entry> element from the arXiv API into a paper dict"""
+    title_elem = entry.find(f'{ATOM_NS}title')
+    title = title_elem.text.strip() if title_elem is not None else 'N/A'
+
+    summary_elem = entry.find(f'{ATOM_NS}summary')
+    abstract = summary_elem.text.strip() if summary_elem is not None else 'No abstract available.'
+
+    # Get authors
+    authors = []
+    for author in entry.findall(f'{ATOM_NS}author'):
+        name_elem = author.find(f'{ATOM_NS}name')
+        if name_elem is not None:
+            authors.append(name_elem.text.strip())
+
+    # Get publication date
+    published_elem = entry.find(f'{ATOM_NS}published')
+    published_date = published_elem.text[:10] if published_elem is not None else 'N/A'
+    year_val = None
+    if published_date != 'N/A':
+        try:
+            year_val = int(published_date.split('-')[0])
+        except:
+            pass
+
+    # Get arXiv ID and URLs
+    id_elem = entry.find(f'{ATOM_NS}id')
+    arxiv_url = id_elem.text if id_elem is not None else None
+    arxiv_id = arxiv_url.split('/abs/')[-1] if arxiv_url else None
+    pdf_url = f'http://arxiv.org/pdf/{arxiv_id}.pdf' if arxiv_id else None
+
+    # Get DOI if available
+    doi = None
+    doi_elem = entry.find(f'{ARXIV_NS}doi')
+    if doi_elem is not None:
+        doi = doi_elem.text
+
+    return {
+        "id": f"arxiv_{arxiv_id}",
+        "title": title,
+        "authors": authors,
+        "abstract": abstract,
+        "publishedDate": published_date,
+        "year": year_val,
+        "url": arxiv_url,
+        "pdfUrl": pdf_url,
+        "source": "arXiv",
+        "citations": None,
+        "doi": doi,
+        "relevanceScore": 0.7
+    }
+
+ARXIV_FIELDED_QUERY = re.compile(r'^\s*\(?\s*(all|ti|abs|au|cat|co|jr|rn|id):')
+# Subjects whose papers span several arXiv archives; others map to '<subject>.*'.
+ARXIV_SUBJECT_CATEGORIES = {
+    'physics': ('physics.*', 'astro-ph*', 'cond-mat*', 'gr-qc', 'hep-*', 'nucl-*', 'quant-ph', 'math-ph', 'nlin.*'),
+}
+
+def arxiv_search_query(query, filters=None):
+    """search_query for the arXiv API with the subject and submission year filters ANDed on"""
+    # Queries that already use field prefixes (e.g. from the local query builder) pass through.
+    search_query = query if ARXIV_FIELDED_QUERY.match(query) else f'all:{query}'
+    clauses = []
+    subject = filter_value(filters, 'subject')
+    if subject:
+        categories = ARXIV_SUBJECT_CATEGORIES.get(subject) or ((subject,) if '.' in subject else (f'{subject}.*',))
+        clauses.append('(' + ' OR '.join(f'cat:{category}' for category in categories) + ')')
+    year_start, year_end = filter_years(filters)
+    if year_start or year_end:
+        clauses.append(f"submittedDate:[{year_start or 1991}01010000 TO {year_end or 9999}12312359]")
+    if not clauses:
+        return search_query
+    return ' AND '.join([f'({search_query})'] + clauses)
+
+def stream_arxiv(query, max_results=10, filters=None, start=0):
+    """Search the arXiv Atom API, yielding normalized papers as the feed streams in"""
+    # arXiv API endpoint
+    arxiv_base = 'http://export.arxiv.org/api/query'
+    
+    params = {
+        'search_query': arxiv_search_query(query, filters),
+        'start': start,
+        'max_results': max_results,
+        'sortBy': 'relevance',
+        'sortOrder': 'descending'
+    }
+    
+    logger.info(f"arXiv search params: {params}")
+    # The feed is parsed while it downloads, so this span covers both.
+    with span('arxiv.fetch'):
+        response = http_get(arxiv_base, params=params, timeout=30, stream=True)
+        yield from iter_response_records(response, ATOM_ENTRY_TAG, parse_arxiv_entry)
+
+def search_arxiv(query, max_results=10, filters=None):
+    """Search the arXiv Atom API and return normalized papers"""
+    papers = list(stream_arxiv(query, max_results, filters))
+    logger.info(f"arXiv search successful, processed {len(papers)} articles.")
+    return papers
+
+
+SEMANTIC_SCHOLAR_FIELDS = 'paperId,title,abstract,authors,year,publicationDate,url,citationCount,openAccessPdf'
+# Subject (arXiv archive) -> Semantic Scholar fieldsOfStudy, and paperType -> publicationTypes.
+SEMANTIC_SCHOLAR_FIELDS_OF_STUDY = {'math': 'Mathematics', 'cs': 'Computer Science', 'physics': 'Physics', 'stat': 'Mathematics',
+                                    'econ': 'Economics', 'q-bio': 'Biology', 'q-fin': 'Economics'}
+SEMANTIC_SCHOLAR_PUBLICATION_TYPES = {'research': 'JournalArticle', 'review': 'Review', 'survey': 'Review', 'conference': 'Conference'}
+
+def parse_semantic_scholar_paper(paper):
+    """Normalize one Semantic Scholar Graph API paper into a paper dict"""
+    paper_id = paper.get('paperId')
+    title = paper.get('title', 'N/A')
+    abstract = paper.get('abstract', 'No abstract available.')
+    
+    # Get authors
+    authors = []
+    for author in paper.get('authors', []):
+        authors.append(author.get('name', ''))
+    
+    year_val = paper.get('year')
+    pub_date = paper.get('publicationDate', 'N/A')
+    
+    url = paper.get('url') or f'https://www.semanticscholar.org/paper/{paper_id}'
+    
+    # Get PDF URL if available
+    pdf_url = None
+    open_access = paper.get('openAccessPdf')
+    if open_access:
+        pdf_url = open_access.get('url')
+    
+    citations = paper.get('citationCount', 0)
+    
+    return {
+        "id": f"semantic_{paper_id}",
+        "title": title,
+        "authors": authors,
+        "abstract": abstract,
+        "publishedDate": pub_date,
+        "year": year_val,
+        "url": url,
+        "pdfUrl": pdf_url,
+        "source": "Semantic Scholar",
+        "citations": citations,
+        "doi": None,
+        "relevanceScore": 0.75
+    }
+
+def search_semantic_scholar(query, max_results=10, filters=None, offset=0):
+    """Search the Semantic Scholar Graph API and return normalized papers"""
+    # Semantic Scholar API endpoint
+    ss_base = 'https://api.semanticscholar.org/graph/v1/paper/search'
+    
+    params = {
+        'query': query,
+        'limit': min(max_results, 100),  # API limit is 100
+        'fields': SEMANTIC_SCHOLAR_FIELDS
+    }
+    if offset:
+        params['offset'] = offset
+    year_start, year_end = filter_years(filters)
+    if year_start or year_end:
+        params['year'] = f"{year_start or ''}-{year_end or ''}"
+    subject = filter_value(filters, 'subject')
+    if subject and subject.split('.')[0] in SEMANTIC_SCHOLAR_FIELDS_OF_STUDY:
+        params['fieldsOfStudy'] = SEMANTIC_SCHOLAR_FIELDS_OF_STUDY[subject.split('.')[0]]
+    if filter_value(filters, 'paperType') in SEMANTIC_SCHOLAR_PUBLICATION_TYPES:
+        params['publicationTypes'] = SEMANTIC_SCHOLAR_PUBLICATION_TYPES[filter_value(filters, 'paperType')]
+    
+    logger.info(f"Semantic Scholar search params: {params}")
+    with span('semantic.request'):
+        response = http_get(ss_base, params=params, timeout=30)
+        response.raise_for_status()
+    
+    with span('semantic.parse'):
+        data = response.json()
+        papers = [parse_semantic_scholar_paper(paper) for paper in data.get('data', [])]
+    
+    logger.info(f"Semantic Scholar search successful, processed {len(papers)} articles.")
+    return papers
+
+
+def parse_crossref_item(item):
+    """Normalize one CrossRef works item into a paper dict"""
+    # Get DOI
+    doi = item.get('DOI')
+    
+    # Get title
+    title_list = item.get('title', [])
+    title = title_list[0] if title_list else 'N/A'
+    
+    # Get abstract (often not available in CrossRef)
+    abstract = item.get('abstract', 'No abstract available.')
+    
+    # Get authors
+    authors = []
+    for author in item.get('author', []):
+        given = author.get('given', '')
+        family = author.get('family', '')
+        if given and family:
+            authors.append(f"{given} {family}")
+        elif family:
+            authors.append(family)
+    
+    # Get publication date
+    pub_date_parts = item.get('published', {}).get('date-parts', [[]])
+    if pub_date_parts and pub_date_parts[0]:
+        year_val = pub_date_parts[0][0] if len(pub_date_parts[0]) > 0 else None
+        month = pub_date_parts[0][1] if len(pub_date_parts[0]) > 1 else 1
+        day = pub_date_parts[0][2] if len(pub_date_parts[0]) > 2 else 1
+        pub_date = f"{year_val}-{str(month).zfill(2)}-{str(day).zfill(2)}"
+    else:
+        year_val = None
+        pub_date = 'N/A'
+    
+    # Get URL
+    url = item.get('URL') or f'https://doi.org/{doi}' if doi else None
+    
+    # Get PDF URL if available
+    pdf_url = None
+    for link in item.get('link', []):
+        if link.get('content-type') == 'application/pdf':
+            pdf_url = link.get('URL')
+            break
+    
+    citations = item.get('is-referenced-by-count', 0)
+    
+    return {
+        "id": f"crossref_{doi.replace('/', '_') if doi else 'unknown'}",
+        "title": title,
+        "authors": authors,
+        "abstract": abstract,
+        "publishedDate": pub_date,
+        "year": year_val,
+        "url": url,
+        "pdfUrl": pdf_url,
+        "source": "CrossRef",
+        "citations": citations,
+        "doi": doi,
+        "relevanceScore": 0.65
+    }
+
+CROSSREF_WORK_TYPES = {'research': 'journal-article', 'conference': 'proceedings-article'}
+
+def crossref_filter(filters):
+    """CrossRef 'filter' parameter for the publication year range and work type, or None"""
+    year_start, year_end = filter_years(filters)
+    parts = []
+    if year_start:
+        parts.append(f'from-pub-date:{year_start}')
+    if year_end:
+        parts.append(f'until-pub-date:{year_end}')
+    if filter_value(filters, 'paperType') in CROSSREF_WORK_TYPES:
+        parts.append(f"type:{CROSSREF_WORK_TYPES[filter_value(filters, 'paperType')]}")
+    return ','.join(parts) or None
+
+def fetch_crossref_page(query, rows=10, filters=None, cursor=None):
+    """Fetch one page of CrossRef works; returns (papers, next_cursor)"""
+    # CrossRef API endpoint
+    crossref_base = 'https://api.crossref.org/works'
+    
+    params = {
+        'query': query,
+        'rows': rows,
+        'sort': 'relevance',
+        'order': 'desc'
+    }
+    if cursor:
+        params['cursor'] = cursor
+    if crossref_filter(filters):
+        params['filter'] = crossref_filter(filters)
+    
+    logger.info(f"CrossRef search params: {params}")
+    with span('crossref.request'):
+        response = http_get(crossref_base, params=params, timeout=30)
+        response.raise_for_status()
+    
+    with span('crossref.parse'):
+        message = response.json().get('message', {})
+        papers = [parse_crossref_item(item) for item in message.get('items', [])]
+    return papers, message.get('next-cursor')
+
+def search_crossref(query, max_results=10, filters=None):
+    """Search the CrossRef works API and return normalized papers"""
+    papers, _ = fetch_crossref_page(query, max_results, filters)
+    logger.info(f"CrossRef search successful, processed {len(papers)} articles.")
+    return papers
+
+# --- Response Cache ---
+
+class DiskCache:
+    """SQLite-backed key/value cache with per-entry TTL and size-bounded LRU eviction.
+
+    Entries are grouped by namespace (e.g. the search source) so TTLs and
+    hit/miss counters can be tracked separately for each upstream. The total
+    size lives in cache_size, kept current by triggers so every worker sharing
+    the file sees the same figure without summing the table on each write.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.stats = {}
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Workers share the file; wait for each other's writes instead of failing with "database is locked".
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA busy_timeout = 30000")
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # INSERT OR REPLACE only fires the delete trigger for the replaced row with recursive triggers on.
+        self.conn.execute("PRAGMA recursive_triggers = ON")
+        self.conn.execute("BEGIN IMMEDIATE")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "key TEXT PRIMARY KEY, namespace TEXT, value TEXT, size INTEGER, "
+            "created REAL, accessed REAL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS cache_size (id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER)")
+        self.conn.execute("INSERT OR IGNORE INTO cache_size (id, bytes) SELECT 0, COALESCE(SUM(size), 0) FROM cache")
+        self.conn.execute("CREATE TRIGGER IF NOT EXISTS cache_size_insert AFTER INSERT ON cache "
+                          "BEGIN UPDATE cache_size SET bytes = bytes + NEW.size; END")
+        self.conn.execute("CREATE TRIGGER IF NOT EXISTS cache_size_delete AFTER DELETE ON cache "
+                          "BEGIN UPDATE cache_size SET bytes = bytes - OLD.size; END")
+        self.conn.commit()
+
+    def _count(self, namespace, counter, amount=1):
+        counters = self.stats.setdefault(namespace, {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0})
+        counters[counter] += amount
+
+    def get(self, namespace, key, ttl):
+        """Return the cached value, or None if missing or older than ttl seconds"""
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT value, created FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self._count(namespace, "misses")
+                return None
+            value, created = row
+            if now - created > ttl:
+                self.conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self.conn.commit()
+                self._count(namespace, "expired")
+                self._count(namespace, "misses")
+                return None
+            self.conn.execute("UPDATE cache SET accessed = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            self._count(namespace, "hits")
+        return json.loads(value)
+
+    def put(self, namespace, key, value):
+        """Store a JSON-serializable value, evicting least recently used entries if over max_bytes"""
+        payload = json.dumps(value)
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO cache (key, namespace, value, size, created, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, namespace, payload, len(payload), now, now),
+            )
+            self._count(namespace, "stores")
+            total = self.conn.execute("SELECT bytes FROM cache_size").fetchone()[0]
+            while total > self.max_bytes:
+                row = self.conn.execute("SELECT key, namespace, size FROM cache ORDER BY accessed LIMIT 1").fetchone()
+                if row is None:
+                    break
+                self.conn.execute("DELETE FROM cache WHERE key = ?", (row[0],))
+                self._count(row[1], "evictions")
+                total -= row[2]
+            self.conn.commit()
+
+    def delete(self, key):
+        with self.lock:
+            deleted = self.conn.execute("DELETE FROM cache WHERE key = ?", (key,)).rowcount
+            self.conn.commit()
+        return bool(deleted)
+
+    def clear(self, namespace=None):
+        with self.lock:
+            if namespace:
+                self.conn.execute("DELETE FROM cache WHERE namespace = ?", (namespace,))
+            else:
+                self.conn.execute("DELETE FROM cache")
+            self.conn.commit()
+
+    def summary(self):
+        """Per-namespace counters plus current entry counts and sizes"""
+        with self.lock:
+            rows = self.conn.execute("SELECT namespace, COUNT(*), COALESCE(SUM(size), 0) FROM cache GROUP BY namespace").fetchall()
+            stats = {namespace: dict(counters) for namespace, counters in self.stats.items()}
+        for namespace, entries, size in rows:
+            stats.setdefault(namespace, {}).update({"entries": entries, "bytes": size})
+        return {"namespaces": stats, "max_bytes": self.max_bytes, "path": self.path}
+
+def cache_key(*parts):
+    """Stable hash of JSON-serializable key parts"""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+SEARCH_CACHE_PATH = os.environ.get('SEARCH_CACHE_PATH', os.path.join('cache', 'search_cache.sqlite3'))
+SEARCH_CACHE_MAX_BYTES = int(os.environ.get('SEARCH_CACHE_MAX_BYTES', 200 * 1024 * 1024))
+search_cache = DiskCache(SEARCH_CACHE_PATH, SEARCH_CACHE_MAX_BYTES)
+
+# Seconds a cached result set stays fresh for each source.
+SOURCE_CACHE_TTLS = {
+    'pubmed': 24 * 3600,
+    'scholar': 7 * 24 * 3600,
+    'arxiv': 12 * 3600,
+    'semantic': 24 * 3600,
+    'crossref': 24 * 3600,
+}
+
+def normalize_search_key(source, query, max_results, filters):
+    """Cache key for a search: case/whitespace-insensitive query, empty filters dropped"""
+    normalized_query = ' '.join(query.lower().split())
+    normalized_filters = {k: str(v) for k, v in (filters or {}).items() if v not in (None, '', 'all', [], {})}
+    return cache_key(source, normalized_query, normalized_filters, int(max_results))
+
+# --- Concurrent Fan-out Search ---
+
+def search_google_scholar_filtered(query, max_results=10, filters=None):
+    """Adapt the shared filters dict to scholarly's year_low/year_high arguments"""
+    year_start, year_end = filter_years(filters)
+    return scholar_pool.search(query, max_results, year_start, year_end)
+
+# Source keys match the database checkboxes in the frontend.
+SEARCH_SOURCES = {
+    'pubmed': search_pubmed,
+    'scholar': search_google_scholar_filtered,
+    'arxiv': search_arxiv,
+    'semantic': search_semantic_scholar,
+    'crossref': search_crossref,
+}
+
+# Seconds each source may take before its result is dropped from a fan-out search.
+SOURCE_DEADLINES = {
+    'pubmed': 40,
+    'scholar': 30,
+    'arxiv': 30,
+    'semantic': 30,
+    'crossref': 30,
+}
+
+# One small pool per source so a hung Scholar scrape cannot starve the API sources.
+SEARCH_WORKERS_PER_SOURCE = int(os.environ.get('SEARCH_WORKERS_PER_SOURCE', 4))
+search_executors = {
+    name: ThreadPoolExecutor(max_workers=SEARCH_WORKERS_PER_SOURCE, thread_name_prefix=f"search-{name}")
+    for name in SEARCH_SOURCES
+}
+
+def run_source_search(source, query, max_results=10, filters=None, use_cache=True):
+    """Run one source search through the response cache and request coalescing.
+
+    With use_cache=False the cached entry is bypassed and overwritten with a fresh result.
+    """
+    with span(f'search.{source}'):
+        return cached_source_search(source, query, max_results, filters, use_cache)
+
+def cached_source_search(source, query, max_results, filters, use_cache):
+    key = normalize_search_key(source, query, max_results, filters)
+    if use_cache:
+        cached = search_cache.get(source, key, SOURCE_CACHE_TTLS[source])
+        if cached is not None:
+            logger.info(f"Cache hit for {source} search: query='{query}'")
+            return cached
+
+    def fetch():
+        papers = SEARCH_SOURCES[source](query, max_results, filters)
+        try:
+            search_cache.put(source, key, papers)
+        except Exception as e:
+            # The upstream call succeeded; a cache that cannot be written only costs a repeat request later.
+            logger.warning(f"Could not cache {source} search results: {e}")
+        index_papers_async(papers)
+        return papers
+    # Identical searches already in flight share that upstream call instead of repeating it.
+    return search_flights.do(source, key, fetch)
+
+def iter_fan_out_search(query, sources, max_results=10, filters=None, deadline=None, use_cache=True, source_queries=None):
+    """Search several sources concurrently, each under its own deadline.
+
+    Yields (source, papers, status) as each source finishes, fails or times out,
+    so callers can forward results without waiting for the slowest source.
+    status is a dict with the outcome ('ok', 'error' or 'timeout'), result
+    count and elapsed seconds; papers is None unless the outcome is 'ok'.
+    source_queries optionally maps a source to its own query syntax (see
+    build_source_queries); sources without an entry search for query.
+    """
+    start = time.monotonic()
+    source_queries = source_queries or {}
+    deadlines = {name: min(SOURCE_DEADLINES[name], deadline) if deadline else SOURCE_DEADLINES[name] for name in sources}
+    futures = {submit_with_context(search_executors[name], run_source_search, name, source_queries.get(name) or query,
+                                   max_results, filters, use_cache): name
+               for name in sources}
+
+    pending = set(futures)
+    while pending:
+        now = time.monotonic()
+        for future in [f for f in pending if now - start >= deadlines[futures[f]]]:
+            name = futures[future]
+            pending.discard(future)
+            future.cancel()
+            logger.warning(f"Fan-out search: {name} missed its {deadlines[name]}s deadline")
+            yield name, None, {"status": "timeout", "count": 0, "elapsed": round(now - start, 3)}
+        if not pending:
+            break
+
+        next_deadline = min(start + deadlines[futures[f]] for f in pending)
+        done, pending = wait(pending, timeout=max(0, next_deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+        for future in done:
+            name = futures[future]
+            elapsed = round(time.monotonic() - start, 3)
+            try:
+                papers = future.result()
+            except Exception as e:
+                logger.error(f"Fan-out search: {name} failed: {e}", exc_info=True)
+                yield name, None, {"status": "error", "count": 0, "elapsed": elapsed, "error": str(e)}
+                continue
+            yield name, papers, {"status": "ok", "count": len(papers), "elapsed": elapsed}
+
+def fan_out_search(query, sources, max_results=10, filters=None, deadline=None, use_cache=True, source_queries=None):
+    """Collect iter_fan_out_search into (results, status) dicts keyed by source.
+
+    results only holds sources that finished in time; status holds every source.
+    """
+    results, status = {}, {}
+    for name, papers, source_status in iter_fan_out_search(query, sources, max_results, filters, deadline, use_cache,
+                                                           source_queries):
+        if papers is not None:
+            results[name] = papers
+        status[name] = source_status
+    return results, status
+
+# --- Deep Retrieval ---
+# Pages through each source well past the first page, for systematic reviews
+# that need thousands of candidates. Pages are fetched in parallel where the
+# API allows random access (PubMed history server, arXiv start, S2 offset) and
+# sequentially where it only offers cursors (CrossRef).
+
+DEEP_RETRIEVAL_MAX = int(os.environ.get('DEEP_RETRIEVAL_MAX', 5000))
+DEEP_RETRIEVAL_TIMEOUT = int(os.environ.get('DEEP_RETRIEVAL_TIMEOUT', 600))
+DEEP_PAGE_SIZES = {'pubmed': 500, 'arxiv': 200, 'semantic': 100, 'crossref': 1000}
+# Upstream paging limits: EFetch history paging stops at 10,000 records and
+# Semantic Scholar relevance search at 1,000; Scholar is kept small to avoid blocks.
+DEEP_SOURCE_CAPS = {'pubmed': 10000, 'scholar': 100, 'arxiv': 50000, 'semantic': 1000, 'crossref': 100000}
+deep_page_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('DEEP_PAGE_WORKERS', 8)), thread_name_prefix="deep-page")
+# Pages a source may have queued on deep_page_executor at once. arXiv allows one
+# request every 3 seconds, so its queued pages would only hold threads while they
+# wait for the rate limiter; other sources queue all their pages.
+DEEP_PAGES_IN_FLIGHT = {'arxiv': 1}
+deep_source_executor = ThreadPoolExecutor(max_workers=len(SEARCH_SOURCES) * 2, thread_name_prefix="deep-source")
+
+def page_windows(total, page_size):
+    return [(offset, min(page_size, total - offset)) for offset in range(0, total, page_size)]
+
+def iter_pages_parallel(fetch_page, windows, max_in_flight=None):
+    """Fetch (offset, size) windows concurrently, yielding (offset, papers) in offset order.
+
+    At most max_in_flight pages (default: all of them) are submitted ahead of the
+    one being yielded. Stops after the first page that comes back short, since
+    later pages would be empty.
+    """
+    windows = deque(windows)
+    max_in_flight = max_in_flight or len(windows)
+    futures = deque()
+    try:
+        while windows or futures:
+            while windows and len(futures) < max_in_flight:
+                offset, size = windows.popleft()
+                futures.append((offset, size, deep_page_executor.submit(fetch_page, offset, size)))
+            offset, size, future = futures.popleft()
+            papers = future.result()
+            yield offset, papers
+            if len(papers) < size:
+                break
+    finally:
+        for _, _, future in futures:
+            future.cancel()
+
+def deep_pubmed(query, limit, filters=None):
+    result = pubmed_esearch(query, 0, filters)
+    total = min(int(result.get('count', 0)), limit)
+    if not total:
+        return
+    webenv, query_key = result.get('webenv'), result.get('querykey')
+    yield from iter_pages_parallel(lambda offset, size: fetch_pubmed_history_page(webenv, query_key, offset, size),
+                                   page_windows(total, DEEP_PAGE_SIZES['pubmed']))
+
+def deep_arxiv(query, limit, filters=None):
+    yield from iter_pages_parallel(lambda offset, size: list(stream_arxiv(query, size, filters, offset)),
+                                   page_windows(limit, DEEP_PAGE_SIZES['arxiv']), DEEP_PAGES_IN_FLIGHT['arxiv'])
+
+def deep_semantic_scholar(query, limit, filters=None):
+    yield from iter_pages_parallel(lambda offset, size: search_semantic_scholar(query, size, filters, offset),
+                                   page_windows(limit, DEEP_PAGE_SIZES['semantic']))
+
+def deep_crossref(query, limit, filters=None):
+    fetched, cursor = 0, '*'
+    while fetched < limit and cursor:
+        papers, cursor = fetch_crossref_page(query, min(DEEP_PAGE_SIZES['crossref'], limit - fetched), filters, cursor)
+        if not papers:
+            break
+        yield fetched, papers
+        fetched += len(papers)
+
+def deep_google_scholar(query, limit, filters=None):
+    yield 0, search_google_scholar_filtered(query, limit, filters)
+
+# Each generator yields (offset, papers) pages for up to limit results.
+DEEP_SOURCES = {
+    'pubmed': deep_pubmed,
+    'scholar': deep_google_scholar,
+    'arxiv': deep_arxiv,
+    'semantic': deep_semantic_scholar,
+    'crossref': deep_crossref,
+}
+
+def iter_deep_search(query, sources, limit=DEEP_RETRIEVAL_MAX, filters=None, timeout=DEEP_RETRIEVAL_TIMEOUT):
+    """Run deep retrieval on several sources at once.
+
+    Yields ('page', source, {offset, papers}) as pages arrive and
+    ('source', source, status) when a source finishes, fails or times out.
+    Closing the generator stops workers from fetching further pages.
+    """
+    start = time.monotonic()
+    events = queue.Queue()
+    stop = threading.Event()
+
+    def run(name):
+        source_limit = min(limit, DEEP_SOURCE_CAPS[name])
+        count = 0
+        try:
+            for offset, papers in DEEP_SOURCES[name](query, source_limit, filters):
+                if stop.is_set():
+                    break
+                count += len(papers)
+                index_papers_async(papers)
+                events.put(('page', name, {"offset": offset, "papers": papers}))
+            status = {"status": "ok", "count": count}
+        except Exception as e:
+            logger.error(f"Deep retrieval: {name} failed after {count} papers: {e}", exc_info=True)
+            status = {"status": "error", "count": count, "error": str(e)}
+        status["elapsed"] = round(time.monotonic() - start, 3)
+        events.put(('source', name, status))
+
+    for name in sources:
+        deep_source_executor.submit(run, name)
+
+    remaining = set(sources)
+    try:
+        while remaining:
+            try:
+                kind, name, payload = events.get(timeout=max(0, start + timeout - time.monotonic()))
+            except queue.Empty:
+                for name in remaining:
+                    logger.warning(f"Deep retrieval: {name} missed the {timeout}s deadline")
+                    yield 'source', name, {"status": "timeout", "elapsed": round(time.monotonic() - start, 3)}
+                break
+            if kind == 'source':
+                remaining.discard(name)
+            yield kind, name, payload
+    finally:
+        stop.set()
+
+# --- Ranking ---
+
+# Tokenized text keyed by content hash, so papers seen in earlier rankings are not re-tokenized.
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', 50000))
+token_cache = OrderedDict()
+token_cache_lock = threading.Lock()
+
+def tokenize_cached(text):
+    if not text:
+        return []
+    key = hashlib.sha1(text.encode('utf-8')).digest()
+    with token_cache_lock:
+        tokens = token_cache.get(key)
+        if tokens is not None:
+            token_cache.move_to_end(key)
+            return tokens
+    tokens = tokenize(text)
+    with token_cache_lock:
+        token_cache[key] = tokens
+        if len(token_cache) > TOKEN_CACHE_SIZE:
+            token_cache.popitem(last=False)
+    return tokens
+
+BM25_ENGINES = ('sparse', 'okapi')
+# Weight of each paper field in the sparse engine's term frequencies and document lengths.
+BM25_FIELD_WEIGHTS = {'title': 2.0, 'abstract': 1.0}
+
+def parse_field_weights(value):
+    """Validated field_weights for the sparse engine; None keeps BM25_FIELD_WEIGHTS.
+
+    Raises ValueError unless value maps fields of BM25_FIELD_WEIGHTS to
+    non-negative numbers, at least one of them positive.
+    """
+    if value is None:
+        return None
+    if not isinstance(value, dict) or not value:
+        raise ValueError("field_weights must be an object such as {\"title\": 2, \"abstract\": 1}")
+    unknown = [field for field in value if field not in BM25_FIELD_WEIGHTS]
+    if unknown:
+        raise ValueError(f"unknown fields {', '.join(map(str, unknown))}; choose from {', '.join(BM25_FIELD_WEIGHTS)}")
+    weights = {}
+    for field, weight in value.items():
+        try:
+            weights[field] = float(weight) if not isinstance(weight, bool) else math.nan
+        except (TypeError, ValueError):
+            weights[field] = math.nan
+        # NaN fails both comparisons, so non-numbers and booleans land here too.
+        if not 0 <= weights[field] < math.inf:
+            raise ValueError(f"weight of '{field}' must be a non-negative number")
+    if not any(weights.values()):
+        raise ValueError("at least one field weight must be positive")
+    return weights
+
+def bm25_sparse_scores(papers, query, field_weights=None, k1=1.5, b=0.75):
+    """Vectorized BM25 over a sparse document x query-term matrix with weighted fields.
+
+    Only query terms get matrix columns, since no other term can affect a
+    score; every token still counts towards document length. Returns a NumPy
+    array of scores aligned with papers.
+    """
+    field_weights = field_weights or BM25_FIELD_WEIGHTS
+    query_counts = Counter(tokenize_cached(query))
+    vocabulary = {term: j for j, term in enumerate(query_counts)}
+    if not papers or not vocabulary:
+        return np.zeros(len(papers))
+
+    rows, cols, values = [], [], []
+    doc_lengths = np.zeros(len(papers))
+    for i, paper in enumerate(papers):
+        counts = Counter()
+        for field, weight in field_weights.items():
+            if not weight:
+                continue
+            tokens = tokenize_cached(str(paper.get(field) or ''))
+            doc_lengths[i] += weight * len(tokens)
+            for term, tf in Counter(tokens).items():
+                if term in vocabulary:
+                    counts[term] += weight * tf
+        for term, tf in counts.items():
+            rows.append(i)
+            cols.append(vocabulary[term])
+            values.append(tf)
+
+    term_doc = csr_matrix((values, (rows, cols)), shape=(len(papers), len(vocabulary))).tocoo()
+    query_tf = np.fromiter(query_counts.values(), dtype=float, count=len(query_counts))
+    df = np.bincount(term_doc.col, minlength=len(vocabulary))
+    idf = np.log1p((len(papers) - df + 0.5) / (df + 0.5))
+    avg_length = doc_lengths.mean() or 1.0
+    norm = term_doc.data + k1 * (1 - b + b * doc_lengths[term_doc.row] / avg_length)
+    contributions = query_tf[term_doc.col] * idf[term_doc.col] * term_doc.data * (k1 + 1) / norm
+    return np.bincount(term_doc.row, weights=contributions, minlength=len(papers))
+
+def top_k_indices(scores, k):
+    """Indices of the k highest scores, best first, without sorting the whole array"""
+    if k >= len(scores):
+        return np.argsort(-scores, kind='stable')
+    top = np.argpartition(-scores, k)[:k]
+    return top[np.argsort(-scores[top], kind='stable')]
+
+@timed('rank.bm25')
+def bm25_score_papers(papers, verbose_query, engine='sparse', field_weights=None):
+    """Score papers in place against verbose_query.
+
+    The 'sparse' engine scores weighted title and abstract fields with a
+    vectorized BM25; 'okapi' is the original rank_bm25 scorer over abstracts.
+    """
+    if engine == 'sparse':
+        scores = bm25_sparse_scores(papers, verbose_query, field_weights)
+        for paper, score in zip(papers, scores):
+            paper['bm25_score'] = paper['relevanceScore'] = float(score)
+        return papers
+
+    tokenized_corpus = [tokenize_cached(str(paper.get('abstract', ''))) for paper in papers]
+    tokenized_query = tokenize(verbose_query)
+
+    if not any(tokenized_corpus):
+        logger.warning("BM25: Corpus is empty. Scores will be zero.")
+        for paper in papers: paper['bm25_score'] = paper['relevanceScore'] = 0.0
+        return papers
+    if not tokenized_query:
+        logger.warning("BM25: Query is empty. Scores will be zero.")
+        for paper in papers: paper['bm25_score'] = paper['relevanceScore'] = 0.0
+        return papers
+
+    bm25 = BM25Okapi(tokenized_corpus)
+    doc_scores = bm25.get_scores(tokenized_query)
+    for paper, score in zip(papers, doc_scores):
+        paper['bm25_score'] = float(score)
+        paper['relevanceScore'] = float(score)
+    return papers
+
+# --- Deduplication ---
+# The same paper often comes back from several sources under different ids.
+# Records are linked by DOI, then by near-identical titles found through
+# MinHash/LSH blocking and confirmed by year and first author, and each
+# linked group is merged into one canonical record.
+
+MISSING_ABSTRACTS = {'', 'N/A', 'No abstract available.'}
+DEDUP_TITLE_THRESHOLD = 0.8
+MINHASH_BANDS, MINHASH_ROWS = 8, 4
+MINHASH_PRIME = 4294967311  # smallest prime above 2**32
+minhash_rng = np.random.default_rng(20240601)
+MINHASH_A = minhash_rng.integers(1, 1 << 31, MINHASH_BANDS * MINHASH_ROWS, dtype=np.uint64)
+MINHASH_B = minhash_rng.integers(0, 1 << 31, MINHASH_BANDS * MINHASH_ROWS, dtype=np.uint64)
+
+def normalize_doi(doi):
+    if not doi:
+        return None
+    doi = str(doi).strip().lower()
+    for prefix in ('https://doi.org/', 'http://doi.org/', 'https://dx.doi.org/', 'http://dx.doi.org/', 'doi:'):
+        if doi.startswith(prefix):
+            doi = doi[len(prefix):]
+    return doi or None
+
+def normalize_title(title):
+    if not title or title == 'N/A':
+        return ''
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', str(title).lower()).split())
+
+def first_author_surname(paper):
+    authors = paper.get('authors') or []
+    if not authors or not authors[0]:
+        return None
+    return normalize_title(authors[0]).split(' ')[-1] or None
+
+def title_shingles(normalized_title, size=3):
+    if len(normalized_title) <= size:
+        return {normalized_title}
+    return {normalized_title[i:i + size] for i in range(len(normalized_title) - size + 1)}
+
+def minhash_signature(shingles):
+    # crc32 values and coefficients are below 2**32 and 2**31, so a*x + b cannot overflow uint64.
+    hashes = np.fromiter((zlib.crc32(shingle.encode('utf-8')) for shingle in shingles), dtype=np.uint64, count=len(shingles))
+    return ((np.outer(hashes, MINHASH_A) + MINHASH_B) % MINHASH_PRIME).min(axis=0)
+
+def record_int(value):
+    """A record's year or citation count as an int; None when missing or not a whole number (e.g. 'n.d.', '2020a')"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float):
+        return int(value) if value.is_integer() else None
+    try:
+        return int(str(value).strip())
+    except (TypeError, ValueError):
+        return None
+
+def compatible_records(a, b):
+    """Year and first-author checks that keep similar titles from merging different papers"""
+    year_a, year_b = record_int(a.get('year')), record_int(b.get('year'))
+    if year_a and year_b and abs(year_a - year_b) > 1:
+        return False
+    author_a, author_b = first_author_surname(a), first_author_surname(b)
+    return not (author_a and author_b and author_a != author_b)
+
+def merge_records(group):
+    """Merge duplicate records into one, keeping the most complete value of each field"""
+    base = max(group, key=lambda p: sum(1 for v in p.values() if v not in (None, '', 'N/A', [])))
+    merged = dict(base)
+    abstracts = [p['abstract'] for p in group if p.get('abstract') and p['abstract'] not in MISSING_ABSTRACTS]
+    if abstracts:
+        merged['abstract'] = max(abstracts, key=len)
+    merged['authors'] = max((p.get('authors') or [] for p in group), key=len)
+    citations = [p.get('citations') for p in group if p.get('citations') is not None]
+    merged['citations'] = max(citations) if citations else None
+    for field in ('pdfUrl', 'doi', 'url', 'venue', 'year', 'publishedDate'):
+        if merged.get(field) in (None, '', 'N/A'):
+            merged[field] = next((p.get(field) for p in group if p.get(field) not in (None, '', 'N/A')), merged.get(field))
+    scores = [p.get('relevanceScore') for p in group if p.get('relevanceScore') is not None]
+    if scores:
+        merged['relevanceScore'] = max(scores)
+    merged['sources'] = list(dict.fromkeys(s for p in group for s in (p.get('sources') or [p.get('source')]) if s))
+    merged['mergedIds'] = list(dict.fromkeys(i for p in group for i in (p.get('mergedIds') or [p.get('id')]) if i))
+    return merged
+
+@timed('dedupe')
+def dedupe_papers(papers):
+    """Collapse cross-source duplicates, preserving the order of first appearance"""
+    parent = list(range(len(papers)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i, j):
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    by_doi, by_title, buckets = {}, {}, {}
+    shingles = {}
+    for i, paper in enumerate(papers):
+        doi = normalize_doi(paper.get('doi'))
+        if doi:
+            if doi in by_doi:
+                union(by_doi[doi], i)
+            else:
+                by_doi[doi] = i
+
+        title = normalize_title(paper.get('title'))
+        if len(title) < 10:
+            continue
+        if title in by_title:
+            if compatible_records(papers[by_title[title]], paper):
+                union(by_title[title], i)
+            continue
+        by_title[title] = i
+        shingles[i] = title_shingles(title)
+        signature = minhash_signature(shingles[i])
+        for band in range(MINHASH_BANDS):
+            key = (band, signature[band * MINHASH_ROWS:(band + 1) * MINHASH_ROWS].tobytes())
+            buckets.setdefault(key, []).append(i)
+
+    checked = set()
+    for candidates in buckets.values():
+        for x in range(len(candidates)):
+            for y in range(x + 1, len(candidates)):
+                i, j = candidates[x], candidates[y]
+                if (i, j) in checked or find(i) == find(j):
+                    continue
+                checked.add((i, j))
+                jaccard = len(shingles[i] & shingles[j]) / len(shingles[i] | shingles[j])
+                if jaccard >= DEDUP_TITLE_THRESHOLD and compatible_records(papers[i], papers[j]):
+                    union(i, j)
+
+    groups = {}
+    for i in range(len(papers)):
+        groups.setdefault(find(i), []).append(papers[i])
+    return [merge_records(group) if len(group) > 1 else group[0] for group in groups.values()]
+
+# --- Result Sets ---
+# Merged search results stay on the server under a result_set_id, so ranking,
+# deduplication, filtering and export can name a set instead of the client
+# posting every abstract back. Papers are held as slotted records with the
+# repeated strings interned, and each set is also written to a DiskCache so
+# any gunicorn worker can serve a set that another worker created.
+
+PAPER_FIELDS = ('id', 'title', 'authors', 'abstract', 'publishedDate', 'year', 'url', 'pdfUrl', 'source',
+                'citations', 'doi', 'venue', 'relevanceScore', 'bm25_score')
+PAPER_FIELD_SET = frozenset(PAPER_FIELDS)
+# Fields whose values repeat across many papers; author names are interned as well.
+INTERNED_FIELDS = frozenset(('source', 'venue'))
+
+RESULT_SET_CACHE_PATH = os.environ.get('RESULT_SET_CACHE_PATH', os.path.join('cache', 'result_sets.sqlite3'))
+RESULT_SET_CACHE_MAX_BYTES = int(os.environ.get('RESULT_SET_CACHE_MAX_BYTES', 500 * 1024 * 1024))
+RESULT_SET_TTL = int(os.environ.get('RESULT_SET_TTL', 24 * 3600))
+# Papers kept in memory per worker across all result sets; older sets are reloaded from disk on demand.
+RESULT_STORE_MAX_PAPERS = int(os.environ.get('RESULT_STORE_MAX_PAPERS', 200000))
+RESULT_PAGE_SIZE = 50
+result_set_cache = DiskCache(RESULT_SET_CACHE_PATH, RESULT_SET_CACHE_MAX_BYTES)
+
+class PaperRecord:
+    """One paper with a slot per PAPER_FIELDS key, about a quarter the size of the equivalent dict.
+
+    Supports the dict operations the ranking, dedupe and export code uses
+    (get, [], in, keys, values, items), so it can be passed wherever a paper
+    dict is expected. Keys missing from the source dict stay unset; keys
+    outside PAPER_FIELDS (summaries, merge bookkeeping, semantic scores) are
+    kept in extra.
+    """
+    __slots__ = PAPER_FIELDS + ('extra',)
+
+    def __init__(self, paper):
+        self.extra = None
+        for key, value in paper.items():
+            self[key] = value
+
+    def __setitem__(self, key, value):
+        if key not in PAPER_FIELD_SET:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+            return
+        if key == 'authors' and value:
+            value = tuple(sys.intern(str(author)) for author in value)
+        elif key in INTERNED_FIELDS and isinstance(value, str):
+            value = sys.intern(value)
+        setattr(self, key, value)
+
+    def __getitem__(self, key):
+        if key in PAPER_FIELD_SET:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self.extra is None:
+            raise KeyError(key)
+        return self.extra[key]
+
+    def __contains__(self, key):
+        return hasattr(self, key) if key in PAPER_FIELD_SET else bool(self.extra) and key in self.extra
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return [field for field in PAPER_FIELDS if hasattr(self, field)] + list(self.extra or ())
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def to_dict(self, fields=None):
+        if fields is None:
+            return dict(self.items())
+        return {field: self[field] for field in fields if field in self}
+
+def paper_dict(paper):
+    return paper.to_dict() if isinstance(paper, PaperRecord) else paper
+
+class ResultSet:
+    """Ordered PaperRecords plus the request that produced them; lock serializes re-ranking and dedupe"""
+
+    def __init__(self, result_set_id, records, meta, created=None, revision=None):
+        self.result_set_id = result_set_id
+        self.records = records
+        self.meta = meta
+        self.created = created or time.time()
+        self.revision = revision or uuid.uuid4().hex
+        self.lock = threading.Lock()
+        self.facets = None
+
+    def facet_index(self):
+        """The FacetIndex over the current records, rebuilt after dedupe or re-ranking replaced them"""
+        records, index = self.records, self.facets
+        if index is None or index.records is not records:
+            index = self.facets = FacetIndex(records)
+        return index
+
+    def describe(self):
+        return {"result_set_id": self.result_set_id, "count": len(self.records), "created": self.created, **self.meta}
+
+class ResultStore:
+    """Result sets by id in a per-worker LRU bounded by total papers, backed by a shared DiskCache.
+
+    The disk copy holds the set and, under a separate small key, its current
+    revision. A worker re-reads a set it holds in memory only when another
+    worker has saved a newer revision.
+    """
+
+    def __init__(self, cache, max_papers=RESULT_STORE_MAX_PAPERS, ttl=RESULT_SET_TTL):
+        self.cache = cache
+        self.max_papers = max_papers
+        self.ttl = ttl
+        self.sets = OrderedDict()
+        self.papers = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def revision_key(result_set_id):
+        # DiskCache keys are unique across namespaces.
+        return f"{result_set_id}:revision"
+
+    def add(self, papers, **meta):
+        records = [paper if isinstance(paper, PaperRecord) else PaperRecord(paper) for paper in papers]
+        result_set = ResultSet(uuid.uuid4().hex, records, meta)
+        self.save(result_set)
+        return result_set
+
+    def get(self, result_set_id):
+        """The result set, reloaded from disk if it was evicted or changed by another worker; None if unknown or expired"""
+        revision = self.cache.get('result_set_revision', self.revision_key(result_set_id), self.ttl)
+        if revision is None:
+            self.discard(result_set_id)
+            return None
+        with self.lock:
+            result_set = self.sets.get(result_set_id)
+            if result_set is not None and result_set.revision == revision:
+                self.sets.move_to_end(result_set_id)
+                return result_set
+        stored = self.cache.get('result_set', result_set_id, self.ttl)
+        if stored is None:
+            return None
+        result_set = ResultSet(result_set_id, [PaperRecord(paper) for paper in stored['papers']], stored['meta'],
+                               stored['created'], stored['revision'])
+        self._remember(result_set)
+        return result_set
+
+    def save(self, result_set):
+        """Write the set (after creating, re-ranking or deduplicating it) and make it current in this worker"""
+        result_set.revision = uuid.uuid4().hex
+        self.cache.put('result_set', result_set.result_set_id, {
+            "meta": result_set.meta, "created": result_set.created, "revision": result_set.revision,
+            "papers": [record.to_dict() for record in result_set.records]})
+        self.cache.put('result_set_revision', self.revision_key(result_set.result_set_id), result_set.revision)
+        self._remember(result_set)
+
+    def _remember(self, result_set):
+        with self.lock:
+            previous = self.sets.pop(result_set.result_set_id, None)
+            if previous is not None:
+                self.papers -= len(previous.records)
+            self.sets[result_set.result_set_id] = result_set
+            self.papers += len(result_set.records)
+            while self.papers > self.max_papers and len(self.sets) > 1:
+                _, evicted = self.sets.popitem(last=False)
+                self.papers -= len(evicted.records)
+
+    def discard(self, result_set_id):
+        with self.lock:
+            result_set = self.sets.pop(result_set_id, None)
+            if result_set is not None:
+                self.papers -= len(result_set.records)
+
+    def delete(self, result_set_id):
+        self.discard(result_set_id)
+        self.cache.delete(self.revision_key(result_set_id))
+        return self.cache.delete(result_set_id)
+
+    def summary(self):
+        with self.lock:
+            return {"sets_in_memory": len(self.sets), "papers_in_memory": self.papers, "max_papers": self.max_papers}
+
+result_store = ResultStore(result_set_cache)
+
+CITATION_BUCKETS = (0, 1, 10, 100, 1000)
+CITATION_BUCKET_LABELS = ('0', '1-9', '10-99', '100-999', '1000+')
+FACET_TOP_VENUES = 20
+
+def filter_terms(value):
+    """Lower-cased terms of a comma-separated string or a JSON list"""
+    items = value if isinstance(value, (list, tuple)) else str(value or '').split(',')
+    return {str(item).strip().lower() for item in items if str(item).strip()}
+
+def filter_int(args, key):
+    """Integer filter argument, None when absent; ValueError naming the argument otherwise"""
+    value = args.get(key)
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{key} must be an integer") from None
+
+class FacetIndex:
+    """Column arrays over one list of records for vectorized filtering and facet counts.
+
+    Years and citation counts are int arrays (-1 when unknown), venues are
+    codes into a label list, and each source keeps the positions of its
+    records, since merged records can belong to several sources.
+    """
+
+    def __init__(self, records):
+        self.records = records
+        self.years = np.array([self.known(record.get('year')) for record in records], dtype=np.int32)
+        self.citations = np.array([self.known(record.get('citations')) for record in records], dtype=np.int64)
+        self.has_pdf = np.array([bool(record.get('pdfUrl')) for record in records], dtype=bool)
+        self.has_abstract = np.array([record.get('abstract') not in MISSING_ABSTRACTS | {None} for record in records], dtype=bool)
+        venue_labels = {}
+        self.venue_codes = np.array([venue_labels.setdefault(record.get('venue'), len(venue_labels)) if record.get('venue') else -1
+                                     for record in records], dtype=np.int32)
+        self.venues = list(venue_labels)
+        source_positions = {}
+        for position, record in enumerate(records):
+            for source in record.get('sources') or [record.get('source')]:
+                if source:
+                    source_positions.setdefault(str(source), []).append(position)
+        self.sources = {source: np.array(positions, dtype=np.int64) for source, positions in source_positions.items()}
+
+    @staticmethod
+    def known(value):
+        value = record_int(value)
+        return -1 if value is None or value < 0 else value
+
+    def select(self, args):
+        """Boolean mask of the records passing query-string style filter args.
+
+        source and venue (comma-separated or a list, case-insensitive),
+        year_start, year_end, min_citations, has_abstract and has_pdf.
+        Raises ValueError for arguments that are not integers where needed.
+        """
+        selection = np.ones(len(self.records), dtype=bool)
+        wanted_sources = filter_terms(args.get('source'))
+        if wanted_sources:
+            in_sources = np.zeros_like(selection)
+            for source, positions in self.sources.items():
+                if source.lower() in wanted_sources:
+                    in_sources[positions] = True
+            selection &= in_sources
+        wanted_venues = filter_terms(args.get('venue'))
+        if wanted_venues:
+            codes = [code for code, venue in enumerate(self.venues) if str(venue).lower() in wanted_venues]
+            selection &= np.isin(self.venue_codes, codes)
+        year_start, year_end = filter_int(args, 'year_start'), filter_int(args, 'year_end')
+        if year_start is not None or year_end is not None:
+            # Papers of unknown year never match a year range, whichever bounds are given.
+            selection &= self.years >= 0
+        if year_start is not None:
+            selection &= self.years >= year_start
+        if year_end is not None:
+            selection &= self.years <= year_end
+        min_citations = filter_int(args, 'min_citations')
+        if min_citations is not None:
+            selection &= self.citations >= min_citations
+        if truthy(args.get('has_abstract', '')):
+            selection &= self.has_abstract
+        if truthy(args.get('has_pdf', '')):
+            selection &= self.has_pdf
+        return selection
+
+    def counts(self, selection):
+        """Facet value -> count over the selected records"""
+        known_years = selection & (self.years >= 0)
+        years, year_counts = np.unique(self.years[known_years], return_counts=True)
+        venue_counts = np.bincount(self.venue_codes[selection & (self.venue_codes >= 0)], minlength=len(self.venues))
+        top_venues = [code for code in np.argsort(-venue_counts, kind='stable')[:FACET_TOP_VENUES] if venue_counts[code]]
+        known_citations = self.citations[selection & (self.citations >= 0)]
+        buckets = np.bincount(np.searchsorted(CITATION_BUCKETS, known_citations, side='right') - 1, minlength=len(CITATION_BUCKETS))
+        with_pdf = int(np.count_nonzero(selection & self.has_pdf))
+        return {
+            "year": {str(year): int(count) for year, count in zip(years, year_counts)},
+            "source": {source: int(np.count_nonzero(selection[positions])) for source, positions in self.sources.items()},
+            "venue": {self.venues[code]: int(venue_counts[code]) for code in top_venues},
+            "has_pdf": {"true": with_pdf, "false": int(np.count_nonzero(selection)) - with_pdf},
+            "citations": {label: int(count) for label, count in zip(CITATION_BUCKET_LABELS, buckets)},
+        }
+
+def filter_result_set(result_set, args):
+    """A result set's records filtered by FacetIndex.select args and sorted by 'sort'.
+
+    sort is relevance, year, citations or title; the default keeps the
+    stored order.
+    """
+    index = result_set.facet_index()
+    selected = [index.records[position] for position in np.flatnonzero(index.select(args))]
+    sort = args.get('sort')
+    if sort == 'relevance':
+        selected.sort(key=lambda record: record.get('relevanceScore') or 0.0, reverse=True)
+    elif sort in ('year', 'citations'):
+        selected.sort(key=lambda record: record.get(sort) if isinstance(record.get(sort), int) else -1, reverse=True)
+    elif sort == 'title':
+        selected.sort(key=lambda record: normalize_title(record.get('title')))
+    return selected
+
+# --- Local Paper Index ---
+
+class PaperIndex:
+    """Persistent BM25 inverted index over every paper the search routes have fetched.
+
+    Postings live in SQLite so the index survives restarts and grows
+    incrementally; IDF statistics come from the whole accumulated corpus.
+    """
+
+    def __init__(self, path, k1=1.5, b=0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(
+            "CREATE TABLE IF NOT EXISTS papers ("
+            "  doc_id INTEGER PRIMARY KEY, paper_id TEXT UNIQUE, content_hash TEXT, length INTEGER, data TEXT);"
+            "CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, df INTEGER) WITHOUT ROWID;"
+            "CREATE TABLE IF NOT EXISTS postings ("
+            "  term TEXT, doc_id INTEGER, tf INTEGER, PRIMARY KEY (term, doc_id)) WITHOUT ROWID;"
+        )
+        self.conn.commit()
+
+    @staticmethod
+    def terms(text):
+        # Stopwords occur in nearly every paper, so their postings would be scanned for almost any query.
+        return [token for token in tokenize(text) if token not in STOPWORDS and any(ch.isalnum() for ch in token)]
+
+    @classmethod
+    def index_terms(cls, paper):
+        abstract = paper.get('abstract') or ''
+        if abstract.strip() in MISSING_ABSTRACTS:
+            abstract = ''
+        return cls.terms(f"{paper.get('title') or ''} {abstract}")
+
+    def _remove_postings(self, doc_id):
+        terms = [row[0] for row in self.conn.execute("SELECT term FROM postings WHERE doc_id = ?", (doc_id,))]
+        self.conn.executemany("UPDATE terms SET df = df - 1 WHERE term = ?", [(term,) for term in terms])
+        self.conn.execute("DELETE FROM postings WHERE doc_id = ?", (doc_id,))
+
+    def add_papers(self, papers):
+        """Insert or refresh papers; only papers whose title/abstract changed are re-tokenized"""
+        added = 0
+        with self.lock:
+            for paper in papers:
+                paper_id = paper.get('id')
+                if not paper_id:
+                    continue
+                content_hash = hashlib.sha1(f"{paper.get('title')}\x00{paper.get('abstract')}".encode('utf-8')).hexdigest()
+                row = self.conn.execute("SELECT doc_id, content_hash FROM papers WHERE paper_id = ?", (paper_id,)).fetchone()
+                data = json.dumps(paper)
+                if row and row[1] == content_hash:
+                    self.conn.execute("UPDATE papers SET data = ? WHERE doc_id = ?", (data, row[0]))
+                    continue
+
+                counts = Counter(self.index_terms(paper))
+                if row:
+                    doc_id = row[0]
+                    self._remove_postings(doc_id)
+                    self.conn.execute("UPDATE papers SET content_hash = ?, length = ?, data = ? WHERE doc_id = ?",
+                                      (content_hash, sum(counts.values()), data, doc_id))
+                else:
+                    doc_id = self.conn.execute("INSERT INTO papers (paper_id, content_hash, length, data) VALUES (?, ?, ?, ?)",
+                                               (paper_id, content_hash, sum(counts.values()), data)).lastrowid
+                self.conn.executemany("INSERT INTO postings (term, doc_id, tf) VALUES (?, ?, ?)",
+                                      [(term, doc_id, tf) for term, tf in counts.items()])
+                self.conn.executemany("INSERT INTO terms (term, df) VALUES (?, 1) ON CONFLICT(term) DO UPDATE SET df = df + 1",
+                                      [(term,) for term in counts])
+                added += 1
+            self.conn.commit()
+        return added
+
+    def search(self, query, limit=20, sources=None):
+        """Return the top papers for query by BM25 over the whole index"""
+        query_terms = set(self.terms(query))
+        if not query_terms:
+            return []
+        # Only the reads hold the lock; scoring runs concurrently with indexing and other searches.
+        with self.lock:
+            doc_count, avg_length = self.conn.execute("SELECT COUNT(*), AVG(length) FROM papers").fetchone()
+            if not doc_count:
+                return []
+            term_postings = []
+            for term in query_terms:
+                row = self.conn.execute("SELECT df FROM terms WHERE term = ?", (term,)).fetchone()
+                if not row or row[0] <= 0:
+                    continue
+                term_postings.append((row[0], self.conn.execute(
+                    "SELECT postings.doc_id, postings.tf, papers.length FROM postings "
+                    "JOIN papers ON papers.doc_id = postings.doc_id WHERE postings.term = ?", (term,)).fetchall()))
+
+        avg_length = avg_length or 1.0
+        scores = {}
+        for df, postings in term_postings:
+            idf = math.log((doc_count - df + 0.5) / (df + 0.5) + 1)
+            for doc_id, tf, length in postings:
+                norm = tf + self.k1 * (1 - self.b + self.b * length / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+        results = []
+        with self.lock:
+            for doc_id, score in ranked:
+                paper = json.loads(self.conn.execute("SELECT data FROM papers WHERE doc_id = ?", (doc_id,)).fetchone()[0])
+                # Paper ids are prefixed with the source key, e.g. 'arxiv_2101.00001'.
+                if sources and paper_id_source(paper) not in sources:
+                    continue
+                paper['bm25_score'] = paper['relevanceScore'] = float(score)
+                results.append(paper)
+                if len(results) >= limit:
+                    break
+        return results
+
+    def document_frequencies(self, terms):
+        """Return (indexed paper count, {term: df}) for the given terms"""
+        terms = list(terms)
+        dfs = {}
+        with self.lock:
+            doc_count = self.conn.execute("SELECT COUNT(*) FROM papers").fetchone()[0]
+            # Stay under SQLite's bound-parameter limit.
+            for i in range(0, len(terms), 500):
+                chunk = terms[i:i + 500]
+                placeholders = ','.join('?' * len(chunk))
+                dfs.update(self.conn.execute(f"SELECT term, df FROM terms WHERE term IN ({placeholders})", chunk).fetchall())
+        return doc_count, dfs
+
+    def summary(self):
+        with self.lock:
+            papers, terms = self.conn.execute("SELECT (SELECT COUNT(*) FROM papers), (SELECT COUNT(*) FROM terms WHERE df > 0)").fetchone()
+        return {"papers": papers, "terms": terms, "path": self.path}
+
+def paper_id_source(paper):
+    return str(paper.get('id', '')).split('_', 1)[0]
+
+PAPER_INDEX_PATH = os.environ.get('PAPER_INDEX_PATH', os.path.join('cache', 'paper_index.sqlite3'))
+paper_index = PaperIndex(PAPER_INDEX_PATH)
+# Single writer thread so indexing never adds latency to the search that fetched the papers.
+index_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="paper-index")
+
+def index_papers_async(papers):
+    def run():
+        try:
+            added = paper_index.add_papers(papers)
+            logger.debug(f"Indexed {added} new or changed papers")
+        except Exception as e:
+            logger.error(f"Error adding papers to local index: {e}", exc_info=True)
+    index_executor.submit(run)
+
+# --- Local Query Builder ---
+
+KEYPHRASE_MAX_WORDS = 3
+KEYPHRASE_DEFAULT_LIMIT = 8
+# Notes beyond this many characters add little signal but cost tokenization time.
+KEYPHRASE_MAX_CHARS = int(os.environ.get('KEYPHRASE_MAX_CHARS', 200000))
+PUBMED_FIELD_TAG = '[Title/Abstract]'
+
+def is_phrase_word(token):
+    return len(token) > 1 and token not in STOPWORDS and any(ch.isalpha() for ch in token) \
+        and all(ch.isalnum() or ch == '-' for ch in token)
+
+def candidate_phrases(tokens):
+    """RAKE-style candidates: runs of content words split at stopwords and punctuation"""
+    phrase = []
+    for token in tokens:
+        if is_phrase_word(token):
+            phrase.append(token)
+            continue
+        if phrase:
+            yield tuple(phrase)
+            phrase = []
+    if phrase:
+        yield tuple(phrase)
+
+def extract_keyphrases(text, limit=KEYPHRASE_DEFAULT_LIMIT):
+    """Rank keyphrases of text by TF-IDF, with IDF taken from the local paper index.
+
+    Every n-gram of up to KEYPHRASE_MAX_WORDS words inside a candidate run is
+    scored by the summed weights of its words, its own frequency, and how
+    consistently its words occur together (phrase count over the count of its
+    rarest word), so "message passing" beats "passing neural". A phrase is
+    skipped when more than half of its words already appear in better ones.
+    Returns [{'phrase': str, 'score': float}], best first.
+    """
+    tokens = tokenize(text[:KEYPHRASE_MAX_CHARS])
+    phrase_counts = Counter()
+    for run in candidate_phrases(tokens):
+        for n in range(1, min(len(run), KEYPHRASE_MAX_WORDS) + 1):
+            for i in range(len(run) - n + 1):
+                phrase_counts[run[i:i + n]] += 1
+    if not phrase_counts:
+        return []
+
+    word_counts = {phrase[0]: count for phrase, count in phrase_counts.items() if len(phrase) == 1}
+    doc_count, dfs = paper_index.document_frequencies(word_counts)
+    word_weights = {
+        word: (1 + math.log(tf)) * (math.log((doc_count + 1) / (dfs.get(word, 0) + 1)) + 1)
+        for word, tf in word_counts.items()
+    }
+    scored = sorted(
+        ((sum(word_weights[word] for word in phrase) * (1 + math.log(count))
+          * count / min(word_counts[word] for word in phrase), phrase)
+         for phrase, count in phrase_counts.items()),
+        reverse=True,
+    )
+
+    keyphrases = []
+    covered = set()
+    for score, phrase in scored:
+        if 2 * sum(word in covered for word in phrase) > len(phrase):
+            continue
+        covered.update(phrase)
+        keyphrases.append({"phrase": ' '.join(phrase), "score": round(score, 4)})
+        if len(keyphrases) >= limit:
+            break
+    return keyphrases
+
+def quote_phrase(phrase):
+    return f'"{phrase}"' if ' ' in phrase else phrase
+
+def join_phrases(parts):
+    """Join phrases into one query, skipping words an earlier part already added,
+    so overlapping n-grams ("graph neural" + "neural networks") are not repeated"""
+    words, seen = [], set()
+    for part in parts:
+        for word in part.split():
+            if word.lower() not in seen:
+                seen.add(word.lower())
+                words.append(word)
+    return ' '.join(words)
+
+def build_source_queries(phrases, topic=None):
+    """Source-specific query strings.
+
+    The topic words (or, without a topic, the best phrase) are required and the
+    remaining phrases are OR'd together to broaden the search around them.
+    """
+    head = [word for word in tokenize(topic or '') if is_phrase_word(word)]
+    rest = phrases
+    if not head:
+        if not phrases:
+            return {}
+        head, rest = [quote_phrase(phrases[0])], phrases[1:]
+
+    def fielded(template):
+        required = ' AND '.join(template.format(term) for term in head)
+        if not rest:
+            return required
+        return f"{required} AND ({' OR '.join(template.format(quote_phrase(p)) for p in rest)})"
+
+    plain = join_phrases(term.replace('"', '') for term in head + rest)
+    return {
+        'pubmed': fielded('{}' + PUBMED_FIELD_TAG),
+        'arxiv': fielded('all:{}'),
+        'semantic': plain,
+        'crossref': plain,
+        'scholar': ' '.join(head + [quote_phrase(p) for p in rest]),
+    }
+
+def build_local_query_plan(topic, notes=None, file_text=None, limit=KEYPHRASE_DEFAULT_LIMIT):
+    """Query plan built from keyphrases alone; same shape as the Ollama query plan"""
+    topic = (topic or '').strip()
+    keyphrases = extract_keyphrases('\n'.join(part for part in (notes, file_text) if part), limit)
+    # Phrases the topic already spells out would only repeat its words.
+    topic_words = set(topic.lower().split())
+    phrases = [p["phrase"] for p in keyphrases if not set(p["phrase"].split()) <= topic_words]
+
+    queries = [topic] if topic else []
+    for i in range(0, min(len(phrases), 6), 2):
+        queries.append(join_phrases([topic] + phrases[i:i + 2]))
+    return {
+        "queries": list(dict.fromkeys(queries)),
+        "verbose_query": join_phrases([topic] + phrases),
+        "source_queries": build_source_queries(phrases[:4], topic),
+        "keyphrases": keyphrases,
+    }
+
+# --- Citation Graph Expansion ---
+
+CITATION_GRAPH_PATH = os.environ.get('CITATION_GRAPH_PATH', os.path.join('cache', 'citation_graph.sqlite3'))
+CITATION_EDGE_TTL = int(os.environ.get('CITATION_EDGE_TTL', 30 * 24 * 3600))
+S2_BATCH_URL = 'https://api.semanticscholar.org/graph/v1/paper/batch'
+S2_BATCH_SIZE = 100  # the API accepts up to 500 ids, but nested citation lists make large batches slow
+EXPAND_MAX_DEPTH = 2
+# Papers whose neighbours are fetched at each BFS level; the most connected ones go first.
+EXPAND_FRONTIER_LIMIT = int(os.environ.get('EXPAND_FRONTIER_LIMIT', 200))
+PAGERANK_RESTART = 0.15
+PAGERANK_ITERATIONS = 30
+graph_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('EXPAND_WORKERS', 4)), thread_name_prefix="citation-graph")
+
+class CitationGraph:
+    """Persistent cache of citation edges and paper metadata keyed by Semantic Scholar paperId.
+
+    A paper counts as expanded once its references and citations have been
+    stored; expansions older than CITATION_EDGE_TTL are fetched again so new
+    citations show up. DOIs and other external ids resolve through an alias table.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(
+            "CREATE TABLE IF NOT EXISTS nodes (paper_id TEXT PRIMARY KEY, data TEXT);"
+            "CREATE TABLE IF NOT EXISTS edges (citing TEXT, cited TEXT, PRIMARY KEY (citing, cited)) WITHOUT ROWID;"
+            "CREATE INDEX IF NOT EXISTS edges_cited ON edges (cited);"
+            "CREATE TABLE IF NOT EXISTS expansions (paper_id TEXT PRIMARY KEY, updated REAL);"
+            "CREATE TABLE IF NOT EXISTS aliases (alias TEXT PRIMARY KEY, paper_id TEXT);"
+        )
+        self.conn.commit()
+
+    def resolve(self, aliases):
+        with self.lock:
+            return {alias: row[0] for alias in aliases
+                    for row in [self.conn.execute("SELECT paper_id FROM aliases WHERE alias = ?", (alias,)).fetchone()] if row}
+
+    def add_aliases(self, mapping):
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO aliases (alias, paper_id) VALUES (?, ?)", list(mapping.items()))
+            self.conn.commit()
+
+    def fresh_expansions(self, paper_ids, ttl=CITATION_EDGE_TTL):
+        cutoff = time.time() - ttl
+        with self.lock:
+            return {paper_id for paper_id in paper_ids
+                    if (self.conn.execute("SELECT updated FROM expansions WHERE paper_id = ?", (paper_id,)).fetchone() or (0,))[0] > cutoff}
+
+    def add_expansion(self, paper_id, paper, references, citations):
+        """Store a paper's metadata and its reference/citation edges, replacing older edges"""
+        now = time.time()
+        with self.lock:
+            self.conn.execute("DELETE FROM edges WHERE citing = ? OR cited = ?", (paper_id, paper_id))
+            self.conn.executemany("INSERT OR IGNORE INTO edges (citing, cited) VALUES (?, ?)",
+                                  [(paper_id, cited) for cited in references] + [(citing, paper_id) for citing in citations])
+            if paper is not None:
+                self.conn.execute("INSERT OR REPLACE INTO nodes (paper_id, data) VALUES (?, ?)", (paper_id, json.dumps(paper)))
+            self.conn.execute("INSERT OR REPLACE INTO expansions (paper_id, updated) VALUES (?, ?)", (paper_id, now))
+            self.conn.commit()
+
+    def put_papers(self, papers):
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO nodes (paper_id, data) VALUES (?, ?)",
+                                  [(paper_id, json.dumps(paper)) for paper_id, paper in papers.items()])
+            self.conn.commit()
+
+    def papers(self, paper_ids):
+        with self.lock:
+            return {paper_id: json.loads(row[0]) for paper_id in paper_ids
+                    for row in [self.conn.execute("SELECT data FROM nodes WHERE paper_id = ?", (paper_id,)).fetchone()] if row}
+
+    def edges(self, paper_ids):
+        """Every stored (citing, cited) edge touching any of paper_ids"""
+        edges = set()
+        with self.lock:
+            for paper_id in paper_ids:
+                edges.update(self.conn.execute("SELECT citing, cited FROM edges WHERE citing = ? OR cited = ?", (paper_id, paper_id)))
+        return edges
+
+    def summary(self):
+        with self.lock:
+            nodes, edges, expanded = self.conn.execute(
+                "SELECT (SELECT COUNT(*) FROM nodes), (SELECT COUNT(*) FROM edges), (SELECT COUNT(*) FROM expansions)").fetchone()
+        return {"papers": nodes, "edges": edges, "expanded": expanded, "path": self.path}
+
+citation_graph = CitationGraph(CITATION_GRAPH_PATH)
+
+def s2_paper_batch(ids, fields):
+    """Semantic Scholar batch lookup; returns one result (or None for unknown ids) per id"""
+    response = http_post(S2_BATCH_URL, params={'fields': fields}, json={'ids': ids}, timeout=60)
+    response.raise_for_status()
+    return response.json()
+
+# crossref_ ids are the DOI with '/' replaced by '_'; registrant prefixes never contain '_'.
+CROSSREF_ID = re.compile(r'^crossref_(10\.[\d.]+)_(.+)$')
+# arXiv entry ids carry a version suffix, which the S2 ARXIV: alias does not take.
+ARXIV_ID_VERSION = re.compile(r'v\d+$')
+
+def seed_alias(seed):
+    """Map a seed (our paper id, S2 paperId or DOI) to an id the S2 batch API accepts (DOI:, ARXIV:, PMID: or a paperId)"""
+    seed = str(seed).strip()
+    if seed.startswith('semantic_'):
+        return seed[len('semantic_'):]
+    if seed.startswith('arxiv_'):
+        return f"ARXIV:{ARXIV_ID_VERSION.sub('', seed[len('arxiv_'):])}"
+    if seed.startswith('pubmed_'):
+        return f"PMID:{seed[len('pubmed_'):]}"
+    crossref_id = CROSSREF_ID.match(seed)
+    doi = normalize_doi(f"{crossref_id.group(1)}/{crossref_id.group(2)}" if crossref_id else seed)
+    if doi and doi.startswith('10.'):
+        return f"DOI:{doi}"
+    return seed
+
+def fetch_expansions(paper_ids):
+    """Fetch metadata plus reference and citation ids for paper_ids (S2 ids or DOI: aliases).
+
+    Batches are sent concurrently on graph_executor; the per-host semaphore
+    and rate limiter in http_request bound the actual upstream load.
+    Returns {requested id: parsed S2 record} for ids S2 knows.
+    """
+    fields = f"{SEMANTIC_SCHOLAR_FIELDS},references.paperId,citations.paperId"
+    batches = [paper_ids[i:i + S2_BATCH_SIZE] for i in range(0, len(paper_ids), S2_BATCH_SIZE)]
+    results = {}
+    for batch, records in zip(batches, graph_executor.map(s2_paper_batch, batches, [fields] * len(batches))):
+        for requested, record in zip(batch, records):
+            if record and record.get('paperId'):
+                results[requested] = record
+    return results
+
+def store_expansion(record):
+    references = [ref['paperId'] for ref in record.get('references') or [] if ref and ref.get('paperId')]
+    citations = [cit['paperId'] for cit in record.get('citations') or [] if cit and cit.get('paperId')]
+    citation_graph.add_expansion(record['paperId'], parse_semantic_scholar_paper(record), references, citations)
+
+def expand_frontier(paper_ids):
+    """Make sure every paper in paper_ids has fresh edges in the graph cache; returns how many were fetched"""
+    fresh = citation_graph.fresh_expansions(paper_ids)
+    stale = [paper_id for paper_id in paper_ids if paper_id not in fresh]
+    for record in fetch_expansions(stale).values():
+        store_expansion(record)
+    return len(stale)
+
+def resolve_seeds(seeds):
+    """Resolve seed ids to S2 paperIds, looking unknown DOIs up once and caching the alias"""
+    aliases = list(dict.fromkeys(seed_alias(seed) for seed in seeds if seed))
+    resolved = citation_graph.resolve(aliases)
+    unresolved = [alias for alias in aliases if alias not in resolved]
+    if unresolved:
+        # The lookup already carries the seeds' edges, so store them instead of fetching twice.
+        records = fetch_expansions(unresolved)
+        for record in records.values():
+            store_expansion(record)
+        found = {alias: record['paperId'] for alias, record in records.items()}
+        citation_graph.add_aliases(found)
+        resolved.update(found)
+    return list(dict.fromkeys(resolved[alias] for alias in aliases if alias in resolved))
+
+def personalized_pagerank(nodes, edges, seeds, restart=PAGERANK_RESTART, iterations=PAGERANK_ITERATIONS):
+    """PageRank on the undirected citation graph with random jumps back to the seeds"""
+    position = {node: i for i, node in enumerate(nodes)}
+    rows, cols = [], []
+    for citing, cited in edges:
+        if citing in position and cited in position:
+            rows += [position[citing], position[cited]]
+            cols += [position[cited], position[citing]]
+    n = len(nodes)
+    adjacency = csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(n, n))
+    adjacency.data[:] = 1.0  # collapse duplicate edges
+    degree = np.asarray(adjacency.sum(axis=0)).ravel()
+    degree[degree == 0] = 1.0
+    transition = adjacency.multiply(1.0 / degree).tocsr()  # column-stochastic
+    personalization = np.zeros(n)
+    personalization[[position[seed] for seed in seeds if seed in position]] = 1.0
+    personalization /= personalization.sum() or 1.0
+    scores = personalization.copy()
+    for _ in range(iterations):
+        scores = (1 - restart) * (transition @ scores) + restart * personalization
+    return dict(zip(nodes, scores))
+
+@timed('expand')
+def expand_citations(seeds, depth=1, max_results=50):
+    """Breadth-first citation expansion from seeds, ranked by personalized PageRank.
+
+    Each level expands at most EXPAND_FRONTIER_LIMIT papers, preferring those
+    linked to the most already-visited papers. Returns (ranked papers, stats).
+    """
+    seed_ids = resolve_seeds(seeds)
+    visited = set(seed_ids)
+    frontier = list(seed_ids)
+    fetched = 0
+    for level in range(depth):
+        fetched += expand_frontier(frontier)
+        edges = citation_graph.edges(frontier)
+        links = Counter(node for edge in edges for node in edge if node not in visited)
+        frontier = [node for node, _ in links.most_common(EXPAND_FRONTIER_LIMIT)] if level + 1 < depth else []
+        visited.update(links)
+    edges = citation_graph.edges(visited)
+
+    nodes = sorted(visited)
+    scores = personalized_pagerank(nodes, edges, seed_ids) if nodes else {}
+    seed_set = set(seed_ids)
+    seed_links = Counter()
+    for citing, cited in edges:
+        if citing in seed_set and cited not in seed_set:
+            seed_links[cited] += 1
+        if cited in seed_set and citing not in seed_set:
+            seed_links[citing] += 1
+    ranked = sorted((node for node in nodes if node not in seed_set), key=lambda node: scores[node], reverse=True)[:max_results]
+
+    papers = citation_graph.papers(ranked)
+    missing = [node for node in ranked if node not in papers]
+    if missing:
+        fetched_papers = {}
+        batches = [missing[i:i + S2_BATCH_SIZE] for i in range(0, len(missing), S2_BATCH_SIZE)]
+        for records in graph_executor.map(s2_paper_batch, batches, [SEMANTIC_SCHOLAR_FIELDS] * len(batches)):
+            fetched_papers.update({record['paperId']: parse_semantic_scholar_paper(record) for record in records if record})
+        citation_graph.put_papers(fetched_papers)
+        papers.update(fetched_papers)
+
+    results = []
+    for node in ranked:
+        if node not in papers:
+            continue
+        paper = dict(papers[node])
+        paper['graph_score'] = paper['relevanceScore'] = float(scores[node])
+        paper['seedLinks'] = seed_links.get(node, 0)
+        results.append(paper)
+    index_papers_async(results)
+    stats = {"seeds": seed_ids, "nodes": len(nodes), "edges": len(edges), "expanded_from_upstream": fetched}
+    return results, stats
+
+# --- Ollama Generation and Caching ---
+
+OLLAMA_DEFAULT_MODEL = 'gemma:2b'
+# A single Ollama host serves every request, so cap how many generations run at once.
+OLLAMA_MAX_CONCURRENCY = int(os.environ.get('OLLAMA_MAX_CONCURRENCY', 2))
+ollama_semaphore = threading.BoundedSemaphore(OLLAMA_MAX_CONCURRENCY)
+summary_executor = ThreadPoolExecutor(max_workers=OLLAMA_MAX_CONCURRENCY, thread_name_prefix="ollama-summary")
+llm_flights = SingleFlight()
+
+LLM_CACHE_PATH = os.environ.get('LLM_CACHE_PATH', os.path.join('cache', 'llm_cache.sqlite3'))
+LLM_CACHE_MAX_BYTES = int(os.environ.get('LLM_CACHE_MAX_BYTES', 100 * 1024 * 1024))
+SUMMARY_CACHE_TTL = int(os.environ.get('SUMMARY_CACHE_TTL', 30 * 24 * 3600))
+llm_cache = DiskCache(LLM_CACHE_PATH, LLM_CACHE_MAX_BYTES)
+
+@timed('llm.generate')
+def ollama_generate(model, prompt, format=None):
+    """Run one chat completion on the shared Ollama host, bounded by OLLAMA_MAX_CONCURRENCY"""
+    kwargs = {'format': format} if format else {}
+    with ollama_semaphore:
+        response = ollama.chat(model=model, messages=[{'role': 'user', 'content': prompt}], **kwargs)
+    return response['message']['content'].strip()
+
+REFINE_CACHE_TTL = int(os.environ.get('REFINE_CACHE_TTL', 7 * 24 * 3600))
+
+def normalize_prompt(prompt):
+    """Collapse whitespace so prompts differing only in layout share a cache entry"""
+    return ' '.join(prompt.split())
+
+def memoized_generate(namespace, model, prompt, ttl, format=None, parse=None):
+    """ollama_generate with results memoized by (namespace, model, normalized prompt).
+
+    If parse is given, the model output is passed through it before caching, so
+    output that fails to parse raises and is never cached. Returns (result, cached).
+    """
+    key = cache_key(namespace, model, normalize_prompt(prompt), format)
+    cached = llm_cache.get(namespace, key, ttl)
+    if cached is not None:
+        return cached, True
+
+    def generate():
+        text = ollama_generate(model, prompt, format)
+        result = parse(text) if parse else text
+        llm_cache.put(namespace, key, result)
+        return result
+    return llm_flights.do(namespace, key, generate), False
+
+def summarize_abstract(abstract, model=OLLAMA_DEFAULT_MODEL):
+    """Summarize an abstract, reusing cached summaries keyed by (model, abstract hash).
+
+    Returns (summary, cached).
+    """
+    key = cache_key('summary', model, hashlib.sha256(abstract.encode('utf-8')).hexdigest())
+    cached = llm_cache.get('summary', key, SUMMARY_CACHE_TTL)
+    if cached is not None:
+        return cached, True
+
+    def generate():
+        prompt = f"Summarize the following research paper abstract concisely. Provide only the summary, no additional text or explanation:\n\nAbstract: \"{abstract}\"\n\nSummary:"
+        summary = ollama_generate(model, prompt)
+        llm_cache.put('summary', key, summary)
+        return summary
+    return llm_flights.do('summary', key, generate), False
+
+def build_query_plan_prompt(topic, notes=None, file_text=None, subject=None, paper_type=None):
+    """One prompt asking for both the database search queries and the BM25 verbose query"""
+    context = f"User's main topic/question: \"{topic}\"\n"
+    if notes:
+        context += f"Additional notes/context from user: \"{notes}\"\n"
+    if file_text:
+        context += f"Key content extracted from uploaded documents:\n---\n{file_text[:5000]}\n---\n"
+    if subject and subject != 'all':
+        context += f"The user's primary subject focus is: {subject}.\n"
+    if paper_type and paper_type != 'all':
+        context += f"The user is looking for papers that are primarily of type: {paper_type}.\n"
+    return (
+        "You are an expert research assistant. Based on the user's input below, produce two things:\n"
+        "1. \"queries\": 3-5 diverse, precise search queries an expert would type into academic databases "
+        "such as arXiv (field codes like ti:, abs:, cat: and AND/OR/NOT are allowed) and Google Scholar.\n"
+        "2. \"verbose_query\": a single detailed paragraph (100-250 words) describing the ideal paper, rich in "
+        "relevant keywords, concepts, methods and terminology, to be used for BM25 relevance scoring against abstracts.\n\n"
+        f"User-provided information:\n{context}\n"
+        "Return ONLY a JSON object of the form {\"queries\": [\"...\"], \"verbose_query\": \"...\"}."
+    )
+
+def parse_query_plan(text):
+    """Extract {'queries': [...], 'verbose_query': str} from the model output"""
+    match = re.search(r'\{.*\}', text, re.DOTALL)
+    plan = json.loads(match.group(0) if match else text)
+    queries = [q.strip() for q in plan.get('queries', []) if isinstance(q, str) and q.strip()]
+    verbose_query = plan.get('verbose_query')
+    if not queries or not isinstance(verbose_query, str) or not verbose_query.strip():
+        raise ValueError("Ollama response is missing queries or verbose_query")
+    return {"queries": queries, "verbose_query": verbose_query.strip()}
+
+# --- Semantic Reranking ---
+
+EMBEDDING_MODEL = os.environ.get('EMBEDDING_MODEL', 'nomic-embed-text')
+EMBEDDING_BATCH_SIZE = int(os.environ.get('EMBEDDING_BATCH_SIZE', 64))
+EMBEDDING_MAX_CHARS = 4000
+VECTOR_STORE_DIR = os.environ.get('VECTOR_STORE_DIR', os.path.join('cache', 'vectors'))
+SEMANTIC_WEIGHT = 0.5
+QUERY_EMBEDDING_CACHE_SIZE = 256
+
+class VectorStore:
+    """Persistent embedding store for one model, keyed by paper id.
+
+    Unit-normalized float32 vectors live in a memory-mapped file that grows by
+    doubling; a SQLite table maps paper ids to rows together with a hash of
+    the embedded text, so a paper is re-embedded only when its text changes.
+    Every gunicorn worker opens the same files: rows are allocated inside a
+    SQLite write transaction, and a worker remaps the file when another one
+    has grown it. Reranking reads the rows of the papers it was given, so
+    there is no nearest-neighbour search and hence no ANN index.
+    """
+
+    def __init__(self, directory, model):
+        os.makedirs(directory, exist_ok=True)
+        slug = re.sub(r'[^A-Za-z0-9_.-]+', '_', model)
+        self.vectors_path = os.path.join(directory, f"{slug}.f32")
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(directory, f"{slug}.sqlite3"), check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);"
+            "CREATE TABLE IF NOT EXISTS vectors (paper_id TEXT PRIMARY KEY, content_hash TEXT, row INTEGER);"
+        )
+        self.conn.commit()
+        self.dim = None
+        self.vectors = None
+        self._load_dim()
+
+    def _load_dim(self):
+        if self.dim is None:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'dim'").fetchone()
+            self.dim = int(row[0]) if row else None
+
+    def _open(self):
+        if self.vectors is not None:
+            self.vectors.flush()
+        capacity = os.path.getsize(self.vectors_path) // (self.dim * 4) if os.path.exists(self.vectors_path) else 0
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r+', shape=(capacity, self.dim)) if capacity else None
+
+    def _mapped(self, rows):
+        """Make at least rows rows addressable, remapping if another worker grew the file; False if it is still shorter"""
+        if self.vectors is None or self.vectors.shape[0] < rows:
+            self._open()
+        return self.vectors is not None and self.vectors.shape[0] >= rows
+
+    def _reserve(self, rows):
+        # Only called inside a write transaction, so no other worker resizes the file meanwhile.
+        if self._mapped(rows):
+            return
+        size = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+        with open(self.vectors_path, 'ab') as f:
+            f.truncate(max(rows * self.dim * 4, 2 * size, 1024 * self.dim * 4))
+        self._open()
+
+    def get(self, keys):
+        """Return {paper_id: vector} for (paper_id, content_hash) pairs stored with the same hash"""
+        found = {}
+        with self.lock:
+            self._load_dim()
+            if self.dim is None:
+                return found
+            for paper_id, content_hash in keys:
+                row = self.conn.execute("SELECT content_hash, row FROM vectors WHERE paper_id = ?", (paper_id,)).fetchone()
+                if row and row[0] == content_hash and self._mapped(row[1] + 1):
+                    found[paper_id] = np.array(self.vectors[row[1]])
+        return found
+
+    def put(self, items):
+        """Store (paper_id, content_hash, vector) triples, overwriting a paper's previous vector"""
+        if not items:
+            return
+        with self.lock:
+            # BEGIN IMMEDIATE takes SQLite's write lock up front, serializing row allocation across workers.
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('dim', ?)", (str(len(items[0][2])),))
+                self._load_dim()
+                next_row = self.conn.execute("SELECT COALESCE(MAX(row), -1) + 1 FROM vectors").fetchone()[0]
+                rows = []
+                for paper_id, content_hash, _ in items:
+                    row = self.conn.execute("SELECT row FROM vectors WHERE paper_id = ?", (paper_id,)).fetchone()
+                    if row is None:
+                        row = (next_row,)
+                        next_row += 1
+                    rows.append(row[0])
+                    self.conn.execute("INSERT OR REPLACE INTO vectors (paper_id, content_hash, row) VALUES (?, ?, ?)",
+                                      (paper_id, content_hash, row[0]))
+                self._reserve(next_row)
+                for row, (_, _, vector) in zip(rows, items):
+                    self.vectors[row] = vector
+                self.vectors.flush()
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+
+    def summary(self):
+        with self.lock:
+            count = self.conn.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+            return {"vectors": count, "dim": self.dim, "path": self.vectors_path}
+
+vector_stores = {}
+vector_stores_lock = threading.Lock()
+query_embeddings = OrderedDict()
+query_embeddings_lock = threading.Lock()
+
+def get_vector_store(model):
+    with vector_stores_lock:
+        if model not in vector_stores:
+            vector_stores[model] = VectorStore(VECTOR_STORE_DIR, model)
+        return vector_stores[model]
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+@timed('llm.embed')
+def embed_batch(texts, model):
+    with ollama_semaphore:
+        response = ollama.embed(model=model, input=[text[:EMBEDDING_MAX_CHARS] for text in texts])
+    return response['embeddings']
+
+def embed_texts(texts, model):
+    """Embed texts with Ollama in batches of EMBEDDING_BATCH_SIZE; returns unit vectors as rows"""
+    batches = [texts[i:i + EMBEDDING_BATCH_SIZE] for i in range(0, len(texts), EMBEDDING_BATCH_SIZE)]
+    if len(batches) == 1:
+        vectors = embed_batch(batches[0], model)
+    else:
+        vectors = [vector for batch in summary_executor.map(embed_batch, batches, [model] * len(batches)) for vector in batch]
+    return normalize_rows(np.asarray(vectors, dtype=np.float32))
+
+def paper_embedding_text(paper):
+    abstract = paper.get('abstract') or ''
+    if abstract in MISSING_ABSTRACTS:
+        abstract = ''
+    return f"{paper.get('title') or ''}\n{abstract}".strip()
+
+def embed_papers(papers, model):
+    """Unit embedding per paper (zero rows for papers without text), embedding only uncached papers"""
+    store = get_vector_store(model)
+    keys = []
+    for paper in papers:
+        text = paper_embedding_text(paper)
+        paper_id = str(paper.get('id') or hashlib.sha1(text.encode('utf-8')).hexdigest())
+        keys.append((paper_id, hashlib.sha1(text.encode('utf-8')).hexdigest(), text))
+    cached = store.get([(paper_id, content_hash) for paper_id, content_hash, text in keys if text])
+    missing = list({paper_id: (paper_id, content_hash, text) for paper_id, content_hash, text in keys
+                    if text and paper_id not in cached}.values())
+    if missing:
+        vectors = embed_texts([text for _, _, text in missing], model)
+        store.put([(paper_id, content_hash, vector) for (paper_id, content_hash, _), vector in zip(missing, vectors)])
+        cached.update({paper_id: vector for (paper_id, _, _), vector in zip(missing, vectors)})
+    matrix = np.zeros((len(papers), store.dim or 1), dtype=np.float32)
+    for index, (paper_id, _, text) in enumerate(keys):
+        if text:
+            matrix[index] = cached[paper_id]
+    return matrix, len(missing)
+
+def embed_query(query, model):
+    key = (model, ' '.join(query.split()))
+    with query_embeddings_lock:
+        vector = query_embeddings.get(key)
+        if vector is not None:
+            query_embeddings.move_to_end(key)
+            return vector
+    vector = embed_texts([query], model)[0]
+    with query_embeddings_lock:
+        query_embeddings[key] = vector
+        while len(query_embeddings) > QUERY_EMBEDDING_CACHE_SIZE:
+            query_embeddings.popitem(last=False)
+    return vector
+
+@timed('rank.semantic')
+def semantic_rerank(papers, query, model=EMBEDDING_MODEL, weight=SEMANTIC_WEIGHT):
+    """Blend cosine similarity with the papers' existing bm25_score, in place.
+
+    BM25 scores are min-max scaled to [0, 1] within the result set so the two
+    signals are comparable; relevanceScore becomes
+    (1 - weight) * bm25 + weight * cosine.
+    """
+    if not papers:
+        return papers
+    matrix, embedded = embed_papers(papers, model)
+    cosines = matrix @ embed_query(query, model) if matrix.shape[1] > 1 else np.zeros(len(papers))
+    bm25 = np.array([paper.get('bm25_score', 0.0) for paper in papers], dtype=np.float64)
+    spread = bm25.max() - bm25.min()
+    bm25 = (bm25 - bm25.min()) / spread if spread > 0 else np.zeros(len(papers))
+    blended = (1 - weight) * bm25 + weight * cosines
+    for paper, cosine, score in zip(papers, cosines, blended):
+        paper['semantic_score'] = float(cosine)
+        paper['relevanceScore'] = float(score)
+    logger.info(f"Semantic rerank: {len(papers)} papers, {embedded} newly embedded with '{model}'")
+    return papers
+
+# --- Document Ingestion ---
+
+# Every gunicorn worker starts its own pool, so by default they share the CPUs instead of each taking all of them.
+INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', max(1, min(4, (os.cpu_count() or 2) // int(os.environ.get('WEB_CONCURRENCY', 2))))))
+INGEST_PAGES_PER_TASK = int(os.environ.get('INGEST_PAGES_PER_TASK', 8))
+INGEST_MAX_BYTES = int(os.environ.get('INGEST_MAX_BYTES', 100 * 1024 * 1024))
+INGEST_CACHE_PATH = os.environ.get('INGEST_CACHE_PATH', os.path.join('cache', 'ingest_cache.sqlite3'))
+INGEST_CACHE_MAX_BYTES = int(os.environ.get('INGEST_CACHE_MAX_BYTES', 500 * 1024 * 1024))
+INGEST_CACHE_TTL = 365 * 24 * 3600
+INGEST_KEY_TERMS = 30
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tif', '.tiff', '.webp')
+ingest_cache = DiskCache(INGEST_CACHE_PATH, INGEST_CACHE_MAX_BYTES)
+ingest_executor = None
+ingest_executor_lock = threading.Lock()
+
+def get_ingest_executor():
+    """Process pool for text extraction, started on first use.
+
+    Workers are spawned rather than forked because the server process already
+    runs background threads whose locks a forked child would inherit. Their
+    tasks live in ingest_worker so a spawned worker does not import this module.
+    """
+    global ingest_executor
+    with ingest_executor_lock:
+        if ingest_executor is None:
+            ingest_executor = ProcessPoolExecutor(max_workers=INGEST_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return ingest_executor
+
+def reset_ingest_executor():
+    """Drop a pool whose worker died so the next upload starts a fresh one"""
+    global ingest_executor
+    with ingest_executor_lock:
+        if ingest_executor is not None:
+            ingest_executor.shutdown(wait=False, cancel_futures=True)
+            ingest_executor = None
+
+def document_kind(filename, content_type):
+    name = (filename or '').lower()
+    if content_type == 'application/pdf' or name.endswith('.pdf'):
+        return 'pdf'
+    if (content_type or '').startswith('image/') or name.endswith(IMAGE_EXTENSIONS):
+        return 'image'
+    return None
+
+def submit_extraction(path, kind):
+    """Queue extraction of one saved upload; returns futures whose results are lists of page texts"""
+    executor = get_ingest_executor()
+    if kind == 'image':
+        return [executor.submit(extract_image_text, path)]
+    total = len(pypdf.PdfReader(path).pages)
+    return [executor.submit(extract_pdf_pages, path, start, count)
+            for start, count in page_windows(total, INGEST_PAGES_PER_TASK)]
+
+def collect_extraction(futures, kind):
+    if kind == 'image':
+        return [futures[0].result()]
+    return [text for future in futures for text in future.result()]
+
+def key_terms(text, limit=INGEST_KEY_TERMS):
+    """Best keyphrases of a text, for query generation and BM25 verbose queries"""
+    return [keyphrase["phrase"] for keyphrase in extract_keyphrases(text, limit)]
+
+@timed('ingest')
+def ingest_files(uploads):
+    """Extract text from (filename, content_type, bytes) uploads in parallel, reusing cached text by content hash.
+
+    Every uncached file's pages are queued on the process pool before any
+    result is awaited, so pages of all files are extracted together.
+    """
+    documents = []
+    pending = {}
+    temp_paths = []
+    try:
+        for filename, content_type, data in uploads:
+            document = {"name": filename, "sha256": hashlib.sha256(data).hexdigest(), "bytes": len(data)}
+            documents.append(document)
+            kind = document_kind(filename, content_type)
+            if kind is None:
+                document["error"] = "Unsupported file type"
+                continue
+            document["kind"] = kind
+            cached = ingest_cache.get(kind, document["sha256"], INGEST_CACHE_TTL)
+            if cached is not None:
+                document.update(pages=cached, cached=True)
+                continue
+            document["cached"] = False
+            if document["sha256"] in pending:
+                continue
+            with tempfile.NamedTemporaryFile(suffix=os.path.splitext(filename or '')[1], delete=False) as f:
+                f.write(data)
+            temp_paths.append(f.name)
+            try:
+                pending[document["sha256"]] = (kind, submit_extraction(f.name, kind))
+            except Exception as e:
+                document["error"] = f"Could not read file: {e}"
+
+        extracted = {}
+        for digest, (kind, futures) in pending.items():
+            try:
+                extracted[digest] = collect_extraction(futures, kind)
+                ingest_cache.put(kind, digest, extracted[digest])
+            except Exception as e:
+                logger.error(f"Text extraction failed for {digest}: {e}", exc_info=True)
+                extracted[digest] = e
+                if isinstance(e, BrokenProcessPool):
+                    reset_ingest_executor()
+    finally:
+        for path in temp_paths:
+            os.unlink(path)
+
+    for document in documents:
+        if "pages" in document or "error" in document:
+            continue
+        result = extracted.get(document["sha256"])
+        if isinstance(result, Exception):
+            document["error"] = f"Text extraction failed: {result}"
+        else:
+            document["pages"] = result
+
+    for document in documents:
+        pages = document.pop("pages", None)
+        if pages is not None:
+            document["text"] = '\n'.join(pages)
+            document["page_count"] = len(pages)
+            document["key_terms"] = key_terms(document["text"])
+    return documents
+
+# --- Saved Queries and Snapshots ---
+
+SNAPSHOT_DB_PATH = os.environ.get('SNAPSHOT_DB_PATH', os.path.join('cache', 'snapshots.sqlite3'))
+SNAPSHOT_HISTORY = int(os.environ.get('SNAPSHOT_HISTORY', 10))
+SNAPSHOT_POLL_SECONDS = float(os.environ.get('SNAPSHOT_POLL_SECONDS', 30))
+SNAPSHOT_DEFAULT_INTERVAL = 24 * 3600
+SNAPSHOT_MIN_INTERVAL = 3600
+# A claimed run whose worker has not finished it within this time is treated as abandoned.
+SNAPSHOT_LEASE_SECONDS = float(os.environ.get('SNAPSHOT_LEASE_SECONDS', 3600))
+SAVED_QUERY_COLUMNS = 'query_id, spec, created, last_run, next_run, running, claimed_at'
+SNAPSHOT_SUMMARY_TOP = 20
+SNAPSHOT_READ_CHUNK = 64 * 1024
+snapshot_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="snapshot")
+
+def encode_snapshot_papers(papers):
+    """zlib-compressed JSON Lines, so a snapshot can be read back one paper at a time"""
+    return zlib.compress(''.join(json.dumps(paper) + '\n' for paper in papers).encode('utf-8'))
+
+def iter_snapshot_papers(blob):
+    """Decompress snapshot papers incrementally, yielding one paper dict at a time"""
+    decompressor = zlib.decompressobj()
+    view = memoryview(blob)
+    pending = b''
+    for offset in range(0, len(view), SNAPSHOT_READ_CHUNK):
+        data = view[offset:offset + SNAPSHOT_READ_CHUNK]
+        # Bound the output too: repetitive JSON compresses well over 10:1.
+        while data:
+            pending += decompressor.decompress(data, SNAPSHOT_READ_CHUNK)
+            data = decompressor.unconsumed_tail
+            *lines, pending = pending.split(b'\n')
+            for line in lines:
+                if line:
+                    yield json.loads(line)
+    pending += decompressor.flush()
+    if pending.strip():
+        yield json.loads(pending)
+
+class SnapshotStore:
+    """Saved queries and the merged, ranked result snapshots of their scheduled runs.
 
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+    Snapshot papers are stored as zlib-compressed JSON Lines; only the newest
+    SNAPSHOT_HISTORY snapshots of each saved query are kept.
+    """
 
-try:
-    nltk.data.find('tokenizers/punkt')
-except LookupError:
-    logger.info("NLTK 'punkt' tokenizer not found. Downloading...")
-    nltk.download('punkt')
-    logger.info("'punkt' downloaded.")
+    def __init__(self, path, history=SNAPSHOT_HISTORY):
+        self.path = path
+        self.history = history
+        self.lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(
+            "CREATE TABLE IF NOT EXISTS saved_queries ("
+            "  query_id TEXT PRIMARY KEY, spec TEXT, created REAL, last_run REAL, next_run REAL, running INTEGER DEFAULT 0,"
+            "  claimed_at REAL);"
+            "CREATE TABLE IF NOT EXISTS snapshots ("
+            "  snapshot_id TEXT PRIMARY KEY, query_id TEXT, created REAL, papers BLOB, new_ids TEXT, sources TEXT, elapsed REAL);"
+            "CREATE INDEX IF NOT EXISTS snapshots_query ON snapshots (query_id, created);"
+        )
+        self.conn.commit()
 
-# --- Helper Functions ---
-def tokenize(text):
-    if not text:
-        return []
-    return nltk.word_tokenize(text.lower())
+    def add(self, spec):
+        query_id = uuid.uuid4().hex
+        now = time.time()
+        with self.lock:
+            self.conn.execute("INSERT INTO saved_queries (query_id, spec, created, next_run) VALUES (?, ?, ?, ?)",
+                              (query_id, json.dumps(spec), now, now))
+            self.conn.commit()
+        return query_id
 
-# --- Proxy Setup for Scholarly (Simplified) ---
-proxies = []
-proxy_file_path = 'proxies.txt'
+    def delete(self, query_id):
+        with self.lock:
+            deleted = self.conn.execute("DELETE FROM saved_queries WHERE query_id = ?", (query_id,)).rowcount
+            self.conn.execute("DELETE FROM snapshots WHERE query_id = ?", (query_id,))
+            self.conn.commit()
+        return bool(deleted)
 
-def load_proxies():
-    """Load proxies from file if available"""
-    global proxies
-    if os.path.exists(proxy_file_path):
-        with open(proxy_file_path, 'r') as f:
-            proxies = [line.strip() for line in f if line.strip()]
-        logger.info(f"Loaded {len(proxies)} proxies from {proxy_file_path}")
-    else:
-        logger.warning(f"Proxy file not found: {proxy_file_path}. Scholarly will operate without proxies.")
+    def _saved(self, row):
+        query_id, spec, created, last_run, next_run, running, claimed_at = row
+        # A lease that ran out (its worker died or restarted) no longer counts as running.
+        running = bool(running) and (claimed_at or 0) > time.time() - SNAPSHOT_LEASE_SECONDS
+        return {"query_id": query_id, **json.loads(spec), "created": created, "last_run": last_run,
+                "next_run": next_run, "running": running}
 
-def set_scholarly_proxy():
-    """Configure scholarly to use a proxy if available"""
-    if not proxies:
-        logger.warning("No proxies loaded. Scholarly will attempt direct connection.")
-        scholarly.use_proxy(None)
-        return
-    
-    # Use a random proxy from the list
-    selected_proxy = random.choice(proxies)
-    logger.info(f"Attempting to use proxy: {selected_proxy}")
-    
+    def get(self, query_id):
+        with self.lock:
+            row = self.conn.execute(f"SELECT {SAVED_QUERY_COLUMNS} FROM saved_queries WHERE query_id = ?", (query_id,)).fetchone()
+        return self._saved(row) if row else None
+
+    def list(self):
+        with self.lock:
+            rows = self.conn.execute(f"SELECT {SAVED_QUERY_COLUMNS} FROM saved_queries ORDER BY created").fetchall()
+        return [self._saved(row) for row in rows]
+
+    def _claim(self, query_id, now):
+        # Conditional on the row still being idle (or its lease expired), so only one worker wins it.
+        return self.conn.execute(
+            "UPDATE saved_queries SET running = 1, claimed_at = ? WHERE query_id = ? AND (running = 0 OR claimed_at IS NULL OR claimed_at <= ?)",
+            (now, query_id, now - SNAPSHOT_LEASE_SECONDS)).rowcount == 1
+
+    def claim_due(self, now=None):
+        """Mark due saved queries that are idle or whose lease expired as running, and return those this worker won"""
+        now = now or time.time()
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT {SAVED_QUERY_COLUMNS} FROM saved_queries WHERE next_run <= ? AND (running = 0 OR claimed_at IS NULL OR claimed_at <= ?)",
+                (now, now - SNAPSHOT_LEASE_SECONDS)).fetchall()
+            claimed = [row for row in rows if self._claim(row[0], now)]
+            self.conn.commit()
+        return [self._saved(row) for row in claimed]
+
+    def claim(self, query_id):
+        """Mark one saved query as running; False if it is missing or already running"""
+        with self.lock:
+            claimed = self._claim(query_id, time.time())
+            self.conn.commit()
+        return claimed
+
+    def finish(self, query_id, interval, ran):
+        now = time.time()
+        with self.lock:
+            if ran:
+                self.conn.execute("UPDATE saved_queries SET running = 0, claimed_at = NULL, last_run = ?, next_run = ? WHERE query_id = ?",
+                                  (now, now + interval, query_id))
+            else:
+                # Failed runs retry after a short delay instead of waiting a full interval.
+                self.conn.execute("UPDATE saved_queries SET running = 0, claimed_at = NULL, next_run = ? WHERE query_id = ?",
+                                  (now + min(interval, SNAPSHOT_MIN_INTERVAL), query_id))
+            self.conn.commit()
+
+    def add_snapshot(self, query_id, papers, new_ids, sources, elapsed):
+        snapshot_id = uuid.uuid4().hex
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO snapshots (snapshot_id, query_id, created, papers, new_ids, sources, elapsed) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (snapshot_id, query_id, time.time(), encode_snapshot_papers(papers),
+                 json.dumps(new_ids), json.dumps(sources), elapsed))
+            self.conn.execute(
+                "DELETE FROM snapshots WHERE query_id = ? AND snapshot_id NOT IN "
+                "(SELECT snapshot_id FROM snapshots WHERE query_id = ? ORDER BY created DESC LIMIT ?)",
+                (query_id, query_id, self.history))
+            self.conn.commit()
+        return snapshot_id
+
+    def _snapshot(self, row, with_papers=True):
+        snapshot_id, query_id, created, papers, new_ids, sources, elapsed = row
+        snapshot = {"snapshot_id": snapshot_id, "query_id": query_id, "created": created,
+                    "new_ids": json.loads(new_ids), "sources": json.loads(sources), "elapsed": elapsed}
+        if with_papers:
+            snapshot["papers"] = list(iter_snapshot_papers(papers))
+        return snapshot
+
+    def latest_snapshot(self, query_id):
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM snapshots WHERE query_id = ? ORDER BY created DESC LIMIT 1", (query_id,)).fetchone()
+        return self._snapshot(row) if row else None
+
+    def snapshot(self, snapshot_id):
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM snapshots WHERE snapshot_id = ?", (snapshot_id,)).fetchone()
+        return self._snapshot(row) if row else None
+
+    def snapshot_papers(self, snapshot_id, new_only=False):
+        """Iterator over a snapshot's papers, decompressed as it is consumed; None if there is no such snapshot"""
+        with self.lock:
+            row = self.conn.execute("SELECT papers, new_ids FROM snapshots WHERE snapshot_id = ?", (snapshot_id,)).fetchone()
+        if row is None:
+            return None
+        papers = iter_snapshot_papers(row[0])
+        if new_only:
+            new_ids = set(json.loads(row[1]))
+            papers = (paper for paper in papers if paper.get('id') in new_ids)
+        return papers
+
+    def snapshots(self, query_id):
+        """Metadata (no papers) of a saved query's snapshots, newest first"""
+        with self.lock:
+            rows = self.conn.execute("SELECT * FROM snapshots WHERE query_id = ? ORDER BY created DESC", (query_id,)).fetchall()
+        return [self._snapshot(row, with_papers=False) for row in rows]
+
+snapshot_store = SnapshotStore(SNAPSHOT_DB_PATH)
+
+def paper_identity(paper):
+    """Key that stays stable for the same paper across runs, whichever source record won the merge"""
+    return normalize_doi(paper.get('doi')) or normalize_title(paper.get('title') or '') or str(paper.get('id'))
+
+def run_saved_query(saved):
+    """Fan the saved query out to its sources, merge, rank and store a snapshot with the new papers marked"""
+    start = time.monotonic()
+    sources = saved.get('sources') or list(SEARCH_SOURCES)
+    # Always fetch fresh results; the point of a scheduled run is to see what changed upstream.
+    results, status = fan_out_search(saved['query'], sources, saved.get('max_results', 10), saved.get('filters'), None, False)
+    if not results:
+        raise RuntimeError(f"No source returned results: {status}")
+    papers = dedupe_papers([paper for name in sources for paper in results.get(name, [])])
+    bm25_score_papers(papers, saved.get('verbose_query') or saved['query'])
+    papers.sort(key=lambda paper: paper['bm25_score'], reverse=True)
+
+    if saved.get('summarize'):
+        top = [paper for paper in papers[:SNAPSHOT_SUMMARY_TOP]
+               if paper.get('abstract') and paper['abstract'] not in MISSING_ABSTRACTS]
+        futures = {summary_executor.submit(summarize_abstract, paper['abstract']): paper for paper in top}
+        for future in as_completed(futures):
+            try:
+                futures[future]['summary'] = future.result()[0]
+            except Exception as e:
+                logger.warning(f"Snapshot summary failed: {e}")
+
+    previous = snapshot_store.latest_snapshot(saved['query_id'])
+    seen = {paper_identity(paper) for paper in previous['papers']} if previous else set()
+    new_ids = [paper['id'] for paper in papers if previous and paper_identity(paper) not in seen]
+    elapsed = round(time.monotonic() - start, 3)
+    snapshot_id = snapshot_store.add_snapshot(saved['query_id'], papers, new_ids, status, elapsed)
+    logger.info(f"Saved query '{saved['query']}' refreshed in {elapsed}s: {len(papers)} papers, {len(new_ids)} new")
+    return snapshot_id
+
+def refresh_saved_query(saved):
+    """Run a claimed saved query and reschedule it, logging rather than raising on failure"""
+    ran = False
     try:
-        pg = ProxyGenerator()
-        # Note: This is a simplified proxy setup. Production use may require more robust configuration.
-        scholarly.use_proxy(pg)
-        logger.info("Proxy configured for scholarly")
+        run_saved_query(saved)
+        ran = True
     except Exception as e:
-        logger.warning(f"Could not configure proxy: {e}. Continuing without proxy.")
-        scholarly.use_proxy(None)
+        logger.error(f"Saved query '{saved['query']}' failed: {e}", exc_info=True)
+    finally:
+        snapshot_store.finish(saved['query_id'], saved.get('interval', SNAPSHOT_DEFAULT_INTERVAL), ran)
+
+class SnapshotScheduler:
+    """Background thread that submits due saved queries to snapshot_executor"""
+
+    def __init__(self, store, poll_seconds=SNAPSHOT_POLL_SECONDS):
+        self.store = store
+        self.poll_seconds = poll_seconds
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._loop, name="snapshot-scheduler", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _loop(self):
+        while not self.stop_event.is_set():
+            try:
+                for saved in self.store.claim_due():
+                    snapshot_executor.submit(refresh_saved_query, saved)
+            except Exception as e:
+                logger.error(f"Snapshot scheduler error: {e}", exc_info=True)
+            self.stop_event.wait(self.poll_seconds)
+
+snapshot_scheduler = SnapshotScheduler(snapshot_store)
+
+# --- Export ---
+# Exports are generators from input papers to output bytes: each paper is
+# formatted, buffered into EXPORT_CHUNK_BYTES chunks and optionally gzipped
+# as the response streams, so memory does not grow with the export size.
+
+EXPORT_CHUNK_BYTES = 64 * 1024
+EXPORT_GZIP_LEVEL = int(os.environ.get('EXPORT_GZIP_LEVEL', 6))
+EXPORT_CSV_FIELDS = ('id', 'title', 'authors', 'year', 'publishedDate', 'venue', 'source', 'doi', 'url', 'pdfUrl',
+                     'citations', 'relevanceScore', 'abstract', 'summary')
+JOURNAL_SOURCES = {'PubMed', 'CrossRef'}
+BIBTEX_SPECIAL = re.compile(r'([\\{}%&$#_^~])')
+BIBTEX_REPLACEMENTS = {'\\': r'\textbackslash{}', '^': r'\^{}', '~': r'\~{}'}
+
+def truthy(value):
+    """Boolean query-string or JSON flag: 1, true or yes"""
+    return str(value).lower() in ('1', 'true', 'yes')
+
+def export_value(paper, field):
+    value = paper.get(field)
+    if value in (None, 'N/A') or (field == 'abstract' and value in MISSING_ABSTRACTS):
+        return ''
+    if isinstance(value, (list, tuple)):
+        return '; '.join(str(item) for item in value)
+    return str(value)
+
+def export_csv(papers):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def row(values):
+        writer.writerow(values)
+        line = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return line
+
+    yield row(EXPORT_CSV_FIELDS)
+    for paper in papers:
+        yield row([export_value(paper, field) for field in EXPORT_CSV_FIELDS])
+
+def export_jsonl(papers):
+    for paper in papers:
+        yield json.dumps(paper_dict(paper), ensure_ascii=False) + '\n'
+
+def bibtex_escape(value):
+    value = BIBTEX_SPECIAL.sub(lambda match: BIBTEX_REPLACEMENTS.get(match.group(1), '\\' + match.group(1)), value)
+    return ' '.join(value.split())
+
+def bibtex_key(paper, used):
+    """authorYEARword citation key, suffixed b, c, ... when an earlier entry already took it"""
+    surname = re.sub(r'[^a-z]', '', first_author_surname(paper) or '') or 'anon'
+    title_words = [word for word in normalize_title(paper.get('title') or '').split() if word not in STOPWORDS]
+    key = f"{surname}{paper.get('year') or ''}{title_words[0] if title_words else ''}"
+    count = used.get(key, 0)
+    used[key] = count + 1
+    return key + (chr(ord('a') + count) if count < 26 else str(count)) if count else key
+
+def export_bibtex(papers):
+    used = {}
+    for paper in papers:
+        arxiv_id = paper['id'][len('arxiv_'):] if str(paper.get('id', '')).startswith('arxiv_') else None
+        fields = [
+            ('title', '{' + bibtex_escape(export_value(paper, 'title')) + '}'),
+            ('author', ' and '.join(bibtex_escape(author) for author in paper.get('authors') or [] if author)),
+            ('journal', bibtex_escape(export_value(paper, 'venue'))),
+            ('year', export_value(paper, 'year')),
+            ('doi', export_value(paper, 'doi')),
+            ('url', export_value(paper, 'url')),
+            ('eprint', arxiv_id or ''),
+            ('archiveprefix', 'arXiv' if arxiv_id else ''),
+            ('abstract', bibtex_escape(export_value(paper, 'abstract'))),
+            ('note', f"Source: {paper['source']}" if paper.get('source') else ''),
+        ]
+        entry_type = 'article' if paper.get('source') in JOURNAL_SOURCES else 'misc'
+        body = ',\n'.join(f"  {name} = {{{value}}}" for name, value in fields if value)
+        yield f"@{entry_type}{{{bibtex_key(paper, used)},\n{body}\n}}\n\n"
+
+def export_ris(papers):
+    for paper in papers:
+        source = paper.get('source')
+        lines = [('TY', 'JOUR' if source in JOURNAL_SOURCES else 'UNPB' if source == 'arXiv' else 'GEN'),
+                 ('TI', export_value(paper, 'title'))]
+        lines += [('AU', author) for author in paper.get('authors') or [] if author]
+        published = export_value(paper, 'publishedDate')
+        lines += [('PY', export_value(paper, 'year')), ('DA', published.replace('-', '/') if published else ''),
+                  ('JO', export_value(paper, 'venue')), ('DO', export_value(paper, 'doi')), ('UR', export_value(paper, 'url')),
+                  ('L1', export_value(paper, 'pdfUrl')), ('AB', export_value(paper, 'abstract')), ('DB', source or ''),
+                  ('ID', export_value(paper, 'id'))]
+        yield ''.join(f"{tag}  - {' '.join(value.split())}\r\n" for tag, value in lines if value) + "ER  - \r\n\r\n"
+
+# format -> (mimetype, file extension, writer)
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv', export_csv),
+    'bibtex': ('application/x-bibtex', 'bib', export_bibtex),
+    'ris': ('application/x-research-info-systems', 'ris', export_ris),
+    'jsonl': ('application/x-ndjson', 'jsonl', export_jsonl),
+}
+
+def chunked_bytes(pieces, size=EXPORT_CHUNK_BYTES):
+    """Join formatted records into UTF-8 chunks of about size bytes"""
+    buffer, buffered = [], 0
+    for piece in pieces:
+        data = piece.encode('utf-8')
+        buffer.append(data)
+        buffered += len(data)
+        if buffered >= size:
+            yield b''.join(buffer)
+            buffer, buffered = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+def gzip_chunks(chunks, level=EXPORT_GZIP_LEVEL):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def export_papers(papers, export_format, compress=False):
+    """Stream papers in export_format as bytes chunks, logging the paper count once the stream ends"""
+    count = 0
+
+    def counted():
+        nonlocal count
+        for paper in papers:
+            count += 1
+            yield paper
+
+    chunks = chunked_bytes(EXPORT_FORMATS[export_format][2](counted()))
+    try:
+        yield from gzip_chunks(chunks) if compress else chunks
+    finally:
+        logger.info(f"Exported {count} papers as {export_format}{' (gzip)' if compress else ''}")
 
-# Load proxies on startup
-load_proxies()
+def deep_search_papers(query, sources, limit, filters=None):
+    """Papers from deep retrieval, flattened page by page as they arrive"""
+    for kind, name, payload in iter_deep_search(query, sources, limit, filters):
+        if kind == 'page':
+            yield from payload['papers']
+        elif payload.get('status') != 'ok':
+            logger.warning(f"Export: {name} stopped early ({payload.get('status')}); exporting what it returned")
 
 # --- API Routes ---
 
-@app.route('/api/search-pubmed', methods=['POST'])
+@api.route('/api/search-pubmed', methods=['POST'])
 def search_pubmed_route():
     """Search PubMed for research papers"""
     data = request.json
     query = data.get('query')
     max_results = int(data.get('max_results', 10))
+    use_cache = not data.get('bypass_cache', False)
     filters = data.get('filters', {})
 
     if not query:
         return jsonify({"error": "Query is required"}), 400
     logger.info(f"Received PubMed search: query='{query}', max_results={max_results}, filters={filters}")
 
-    eutils_base = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/'
-    papers = []
     try:
-        term = query
-        year_start_filter = filters.get('yearStart')
-        year_end_filter = filters.get('yearEnd')
-        date_filter_string = ""
-        if year_start_filter or year_end_filter:
-            start_date_pubmed = str(year_start_filter) if year_start_filter else "1000"
-            end_date_pubmed = str(year_end_filter) if year_end_filter else "3000"
-            date_filter_string = f" AND ({start_date_pubmed}[Date - Publication]:{end_date_pubmed}[Date - Publication])"
-        term += date_filter_string
-
-        search_params = {'db': 'pubmed', 'term': term, 'retmax': max_results, 'usehistory': 'y', 'retmode': 'json', 'sort': 'relevance'}
-        logger.info(f"PubMed ESearch params: {search_params}")
-        search_resp = httpRequest.get(f"{eutils_base}esearch.fcgi", params=search_params, timeout=30)
-        search_resp.raise_for_status()
-        search_data = search_resp.json()
-        logger.debug(f"PubMed ESearch response data: {search_data}")
-
-        id_list = search_data.get("esearchresult", {}).get("idlist")
-        if not id_list:
-            logger.info("No PubMed IDs found for the query.")
-            return jsonify([])
-
-        fetch_params = {'db': 'pubmed', 'id': ','.join(id_list), 'retmode': 'xml'}
-        logger.info(f"PubMed EFetch params: {fetch_params}")
-        fetch_resp = httpRequest.post(f"{eutils_base}efetch.fcgi", data=fetch_params, timeout=45)
-        fetch_resp.raise_for_status()
-        
-        root = ET.fromstring(fetch_resp.content)
-        for article_et in root.findall('.//PubmedArticle'):
-            pmid_node = article_et.find('.//PMID')
-            pmid = pmid_node.text if pmid_node is not None else None
-            article_title_node = article_et.find('.//ArticleTitle')
-            title_parts = [text_part for text_part in article_title_node.itertext()] if article_title_node is not None else []
-            title = "".join(title_parts).strip() if title_parts else 'N/A'
-            
-            abstract_text_nodes = article_et.findall('.//AbstractText')
-            abstract_parts = []
-            if abstract_text_nodes:
-                for node in abstract_text_nodes:
-                    node_text_parts = [text_part for text_part in node.itertext()]
-                    node_text = "".join(node_text_parts).strip()
-                    if node_text:
-                        label = node.get('Label')
-                        abstract_parts.append(f"{label}: {node_text}" if label else node_text)
-                abstract = "\n".join(abstract_parts) if abstract_parts else "No abstract available."
-            else:
-                abstract = "No abstract available."
-
-            author_list_node = article_et.find('.//AuthorList')
-            authors = []
-            if author_list_node is not None:
-                for author_node in author_list_node.findall('.//Author'):
-                    last_name_node = author_node.find('.//LastName')
-                    fore_name_node = author_node.find('.//ForeName')
-                    initials_node = author_node.find('.//Initials')
-                    last_name = last_name_node.text if last_name_node is not None and last_name_node.text else ""
-                    fore_name = fore_name_node.text if fore_name_node is not None and fore_name_node.text else ""
-                    initials = initials_node.text if initials_node is not None and initials_node.text else ""
-                    author_name = ""
-                    if fore_name and last_name: author_name = f"{fore_name} {last_name}"
-                    elif last_name and initials: author_name = f"{initials} {last_name}"
-                    elif last_name: author_name = last_name
-                    elif fore_name: author_name = fore_name
-                    if author_name: authors.append(author_name.strip())
-            
-            pub_date_node = article_et.find('.//ArticleDate') or article_et.find('.//PubDate')
-            year_val, pub_date_str = None, "N/A"
-            if pub_date_node is not None:
-                year_node = pub_date_node.find('.//Year')
-                if year_node is not None and year_node.text:
-                    try:
-                        year_val = int(year_node.text)
-                        month_node = pub_date_node.find('.//Month')
-                        day_node = pub_date_node.find('.//Day')
-                        month_str = month_node.text if month_node is not None and month_node.text else "01"
-                        try: month_val = int(month_str)
-                        except ValueError:
-                            month_map = {"jan": "01", "feb": "02", "mar": "03", "apr": "04", "may": "05", "jun": "06", "jul": "07", "aug": "08", "sep": "09", "oct": "10", "nov": "11", "dec": "12"}
-                            month_val = month_map.get(month_str.lower()[:3], "01")
-                        day_str = day_node.text if day_node is not None and day_node.text else "01"
-                        pub_date_str = f"{year_val}-{str(month_val).zfill(2)}-{day_str.zfill(2)}"
-                    except ValueError:
-                        logger.warning(f"Could not parse year for PMID {pmid}: {year_node.text}")
-                        pub_date_str = year_node.text
-            
-            doi_node = article_et.find('.//ArticleId[@IdType="doi"]')
-            doi = doi_node.text if doi_node is not None else None
-            papers.append({
-                "id": f"pubmed_{pmid}", "title": title, "authors": authors, "abstract": abstract,
-                "publishedDate": pub_date_str, "year": year_val,
-                "url": f"https://pubmed.ncbi.nlm.nih.gov/{pmid}/" if pmid else (f"https://doi.org/{doi}" if doi else None),
-                "pdfUrl": f"https://doi.org/{doi}" if doi else None, "source": "PubMed", "citations": None, "doi": doi,
-                "relevanceScore": 0.6
-            })
-        logger.info(f"PubMed search successful, processed {len(papers)} articles.")
+        papers = run_source_search('pubmed', query, max_results, filters, use_cache)
     except httpRequest.exceptions.RequestException as e:
         logger.error(f"Network error during PubMed search: {e}", exc_info=True)
         return jsonify({"error": f"Network error during PubMed search: {str(e)}"}), 503
@@ -193,12 +3544,13 @@ def search_pubmed_route():
         return jsonify({"error": f"Error searching PubMed: {str(e)}"}), 500
     return jsonify(papers)
 
-@app.route('/api/search-scholar', methods=['POST'])
+@api.route('/api/search-scholar', methods=['POST'])
 def search_google_scholar_route():
     """Search Google Scholar for research papers"""
     data = request.json
     query = data.get('query')
     max_results = int(data.get('max_results', 10))
+    use_cache = not data.get('bypass_cache', False)
     year_low = data.get('year_low')
     year_high = data.get('year_high')
 
@@ -206,153 +3558,69 @@ def search_google_scholar_route():
         return jsonify({"error": "Query is required"}), 400
     logger.info(f"Received Google Scholar search request: query='{query}', max_results={max_results}")
 
-    results = []
     try:
-        # Set proxy before search
-        set_scholarly_proxy()
-        
-        search_args = {'query': query}
-        if year_low is not None: search_args['year_low'] = int(year_low)
-        if year_high is not None: search_args['year_high'] = int(year_high)
-        
-        logger.info(f"Calling scholarly.search_pubs with args: {search_args}")
-        search_results_gen = scholarly.search_pubs(**search_args)
-        
-        count = 0
-        for item in search_results_gen:
-            if count >= max_results: break
-            
-            bib = item.get('bib', {})
-            abstract_text = bib.get('abstract', 'N/A')
-            pub_year = bib.get('pub_year')
-            try:
-                year_int = int(pub_year) if pub_year else None
-            except (ValueError, TypeError):
-                year_int = None
-
-            authors_data = bib.get('author')
-            authors_list = []
-            if isinstance(authors_data, str):
-                authors_list = authors_data.split(' and ')
-            elif isinstance(authors_data, list):
-                authors_list = authors_data
-            else:
-                authors_list = []
-
-            results.append({
-                "id": f"scholar_{item.get('id_scholarcitedby', bib.get('title', f'untitled_{count}'))}",
-                "title": bib.get('title', 'N/A'),
-                "authors": authors_list,
-                "abstract": abstract_text,
-                "venue": bib.get('venue', None),
-                "year": year_int,
-                "publishedDate": f"{year_int}-01-01" if year_int else None,
-                "url": item.get('pub_url', item.get('eprint_url', None)),
-                "pdfUrl": item.get('eprint_url') if item.get('eprint_url') and "pdf" in item.get('eprint_url', "").lower() else None,
-                "citations": bib.get('num_citations', 0),
-                "source": "Google Scholar",
-                "relevanceScore": 0.7
-            })
-            count += 1
-        logger.info(f"Google Scholar search successful, found {len(results)} results.")
+        filters = {'yearStart': year_low, 'yearEnd': year_high}
+        results = run_source_search('scholar', query, max_results, filters, use_cache)
     except Exception as e:
         logger.error(f"Error scraping Google Scholar: {e}", exc_info=True)
         return jsonify({"error": f"Error scraping Google Scholar: {str(e)}"}), 500
     return jsonify(results)
 
-@app.route('/api/search-arxiv', methods=['POST'])
+@api.route('/api/scholar-jobs', methods=['POST'])
+def submit_scholar_job_route():
+    """Queue a Google Scholar search on the Scholar worker pool and return its job id"""
+    data = request.json
+    query = data.get('query')
+    max_results = int(data.get('max_results', 10))
+    use_cache = not data.get('bypass_cache', False)
+    filters = {'yearStart': data.get('year_low'), 'yearEnd': data.get('year_high')}
+
+    if not query:
+        return jsonify({"error": "Query is required"}), 400
+
+    job_id = uuid.uuid4().hex
+    future = search_executors['scholar'].submit(run_source_search, 'scholar', query, max_results, filters, use_cache)
+    with scholar_jobs_lock:
+        scholar_jobs[job_id] = {"query": query, "future": future, "submitted": time.time()}
+        while len(scholar_jobs) > SCHOLAR_JOB_HISTORY:
+            scholar_jobs.popitem(last=False)
+    return jsonify({"job_id": job_id, "status": "queued"}), 202
+
+@api.route('/api/scholar-jobs/<job_id>', methods=['GET'])
+def scholar_job_status_route(job_id):
+    """Report a queued Scholar search's status, with its results once finished"""
+    with scholar_jobs_lock:
+        job = scholar_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job id"}), 404
+
+    future = job["future"]
+    body = {"job_id": job_id, "query": job["query"]}
+    if not future.done():
+        body["status"] = "running" if future.running() else "queued"
+        return jsonify(body)
+    error = future.exception()
+    if error is not None:
+        body.update(status="error", error=f"Error scraping Google Scholar: {error}")
+    else:
+        body.update(status="done", results=future.result())
+    return jsonify(body)
+
+@api.route('/api/search-arxiv', methods=['POST'])
 def search_arxiv_route():
     """Search arXiv for research papers"""
     data = request.json
     query = data.get('query')
     max_results = int(data.get('max_results', 10))
+    use_cache = not data.get('bypass_cache', False)
     filters = data.get('filters', {})
 
     if not query:
         return jsonify({"error": "Query is required"}), 400
     logger.info(f"Received arXiv search: query='{query}', max_results={max_results}")
 
-    papers = []
     try:
-        # arXiv API endpoint
-        arxiv_base = 'http://export.arxiv.org/api/query'
-        
-        # Build search query
-        search_query = f'all:{query}'
-        
-        params = {
-            'search_query': search_query,
-            'start': 0,
-            'max_results': max_results,
-            'sortBy': 'relevance',
-            'sortOrder': 'descending'
-        }
-        
-        logger.info(f"arXiv search params: {params}")
-        response = httpRequest.get(arxiv_base, params=params, timeout=30)
-        response.raise_for_status()
-        
-        # Parse XML response
-        root = ET.fromstring(response.content)
-        
-        # Define namespace
-        ns = {
-            'atom': 'http://www.w3.org/2005/Atom',
-            'arxiv': 'http://arxiv.org/schemas/atom'
-        }
-        
-        for entry in root.findall('atom:entry', ns):
-            title_elem = entry.find('atom:title', ns)
-            title = title_elem.text.strip() if title_elem is not None else 'N/A'
-            
-            summary_elem = entry.find('atom:summary', ns)
-            abstract = summary_elem.text.strip() if summary_elem is not None else 'No abstract available.'
-            
-            # Get authors
-            authors = []
-            for author in entry.findall('atom:author', ns):
-                name_elem = author.find('atom:name', ns)
-                if name_elem is not None:
-                    authors.append(name_elem.text.strip())
-            
-            # Get publication date
-            published_elem = entry.find('atom:published', ns)
-            published_date = published_elem.text[:10] if published_elem is not None else 'N/A'
-            year_val = None
-            if published_date != 'N/A':
-                try:
-                    year_val = int(published_date.split('-')[0])
-                except:
-                    pass
-            
-            # Get arXiv ID and URLs
-            id_elem = entry.find('atom:id', ns)
-            arxiv_url = id_elem.text if id_elem is not None else None
-            arxiv_id = arxiv_url.split('/abs/')[-1] if arxiv_url else None
-            pdf_url = f'http://arxiv.org/pdf/{arxiv_id}.pdf' if arxiv_id else None
-            
-            # Get DOI if available
-            doi = None
-            doi_elem = entry.find('arxiv:doi', ns)
-            if doi_elem is not None:
-                doi = doi_elem.text
-            
-            papers.append({
-                "id": f"arxiv_{arxiv_id}",
-                "title": title,
-                "authors": authors,
-                "abstract": abstract,
-                "publishedDate": published_date,
-                "year": year_val,
-                "url": arxiv_url,
-                "pdfUrl": pdf_url,
-                "source": "arXiv",
-                "citations": None,
-                "doi": doi,
-                "relevanceScore": 0.7
-            })
-        
-        logger.info(f"arXiv search successful, processed {len(papers)} articles.")
+        papers = run_source_search('arxiv', query, max_results, filters, use_cache)
     except httpRequest.exceptions.RequestException as e:
         logger.error(f"Network error during arXiv search: {e}", exc_info=True)
         return jsonify({"error": f"Network error during arXiv search: {str(e)}"}), 503
@@ -364,73 +3632,21 @@ def search_arxiv_route():
         return jsonify({"error": f"Error searching arXiv: {str(e)}"}), 500
     return jsonify(papers)
 
-@app.route('/api/search-semantic-scholar', methods=['POST'])
+@api.route('/api/search-semantic-scholar', methods=['POST'])
 def search_semantic_scholar_route():
     """Search Semantic Scholar for research papers"""
     data = request.json
     query = data.get('query')
     max_results = int(data.get('max_results', 10))
+    filters = data.get('filters', {})
+    use_cache = not data.get('bypass_cache', False)
 
     if not query:
         return jsonify({"error": "Query is required"}), 400
-    logger.info(f"Received Semantic Scholar search: query='{query}', max_results={max_results}")
+    logger.info(f"Received Semantic Scholar search: query='{query}', max_results={max_results}, filters={filters}")
 
-    papers = []
     try:
-        # Semantic Scholar API endpoint
-        ss_base = 'https://api.semanticscholar.org/graph/v1/paper/search'
-        
-        params = {
-            'query': query,
-            'limit': min(max_results, 100),  # API limit is 100
-            'fields': 'paperId,title,abstract,authors,year,publicationDate,url,citationCount,openAccessPdf'
-        }
-        
-        logger.info(f"Semantic Scholar search params: {params}")
-        response = httpRequest.get(ss_base, params=params, timeout=30)
-        response.raise_for_status()
-        
-        data = response.json()
-        
-        for paper in data.get('data', []):
-            paper_id = paper.get('paperId')
-            title = paper.get('title', 'N/A')
-            abstract = paper.get('abstract', 'No abstract available.')
-            
-            # Get authors
-            authors = []
-            for author in paper.get('authors', []):
-                authors.append(author.get('name', ''))
-            
-            year_val = paper.get('year')
-            pub_date = paper.get('publicationDate', 'N/A')
-            
-            url = paper.get('url') or f'https://www.semanticscholar.org/paper/{paper_id}'
-            
-            # Get PDF URL if available
-            pdf_url = None
-            open_access = paper.get('openAccessPdf')
-            if open_access:
-                pdf_url = open_access.get('url')
-            
-            citations = paper.get('citationCount', 0)
-            
-            papers.append({
-                "id": f"semantic_{paper_id}",
-                "title": title,
-                "authors": authors,
-                "abstract": abstract,
-                "publishedDate": pub_date,
-                "year": year_val,
-                "url": url,
-                "pdfUrl": pdf_url,
-                "source": "Semantic Scholar",
-                "citations": citations,
-                "doi": None,
-                "relevanceScore": 0.75
-            })
-        
-        logger.info(f"Semantic Scholar search successful, processed {len(papers)} articles.")
+        papers = run_source_search('semantic', query, max_results, filters, use_cache)
     except httpRequest.exceptions.RequestException as e:
         logger.error(f"Network error during Semantic Scholar search: {e}", exc_info=True)
         return jsonify({"error": f"Network error during Semantic Scholar search: {str(e)}"}), 503
@@ -439,95 +3655,21 @@ def search_semantic_scholar_route():
         return jsonify({"error": f"Error searching Semantic Scholar: {str(e)}"}), 500
     return jsonify(papers)
 
-@app.route('/api/search-crossref', methods=['POST'])
+@api.route('/api/search-crossref', methods=['POST'])
 def search_crossref_route():
     """Search CrossRef for research papers"""
     data = request.json
     query = data.get('query')
     max_results = int(data.get('max_results', 10))
+    filters = data.get('filters', {})
+    use_cache = not data.get('bypass_cache', False)
 
     if not query:
         return jsonify({"error": "Query is required"}), 400
-    logger.info(f"Received CrossRef search: query='{query}', max_results={max_results}")
+    logger.info(f"Received CrossRef search: query='{query}', max_results={max_results}, filters={filters}")
 
-    papers = []
     try:
-        # CrossRef API endpoint
-        crossref_base = 'https://api.crossref.org/works'
-        
-        params = {
-            'query': query,
-            'rows': max_results,
-            'sort': 'relevance',
-            'order': 'desc'
-        }
-        
-        logger.info(f"CrossRef search params: {params}")
-        response = httpRequest.get(crossref_base, params=params, timeout=30)
-        response.raise_for_status()
-        
-        data = response.json()
-        
-        for item in data.get('message', {}).get('items', []):
-            # Get DOI
-            doi = item.get('DOI')
-            
-            # Get title
-            title_list = item.get('title', [])
-            title = title_list[0] if title_list else 'N/A'
-            
-            # Get abstract (often not available in CrossRef)
-            abstract = item.get('abstract', 'No abstract available.')
-            
-            # Get authors
-            authors = []
-            for author in item.get('author', []):
-                given = author.get('given', '')
-                family = author.get('family', '')
-                if given and family:
-                    authors.append(f"{given} {family}")
-                elif family:
-                    authors.append(family)
-            
-            # Get publication date
-            pub_date_parts = item.get('published', {}).get('date-parts', [[]])
-            if pub_date_parts and pub_date_parts[0]:
-                year_val = pub_date_parts[0][0] if len(pub_date_parts[0]) > 0 else None
-                month = pub_date_parts[0][1] if len(pub_date_parts[0]) > 1 else 1
-                day = pub_date_parts[0][2] if len(pub_date_parts[0]) > 2 else 1
-                pub_date = f"{year_val}-{str(month).zfill(2)}-{str(day).zfill(2)}"
-            else:
-                year_val = None
-                pub_date = 'N/A'
-            
-            # Get URL
-            url = item.get('URL') or f'https://doi.org/{doi}' if doi else None
-            
-            # Get PDF URL if available
-            pdf_url = None
-            for link in item.get('link', []):
-                if link.get('content-type') == 'application/pdf':
-                    pdf_url = link.get('URL')
-                    break
-            
-            citations = item.get('is-referenced-by-count', 0)
-            
-            papers.append({
-                "id": f"crossref_{doi.replace('/', '_') if doi else 'unknown'}",
-                "title": title,
-                "authors": authors,
-                "abstract": abstract,
-                "publishedDate": pub_date,
-                "year": year_val,
-                "url": url,
-                "pdfUrl": pdf_url,
-                "source": "CrossRef",
-                "citations": citations,
-                "doi": doi,
-                "relevanceScore": 0.65
-            })
-        
-        logger.info(f"CrossRef search successful, processed {len(papers)} articles.")
+        papers = run_source_search('crossref', query, max_results, filters, use_cache)
     except httpRequest.exceptions.RequestException as e:
         logger.error(f"Network error during CrossRef search: {e}", exc_info=True)
         return jsonify({"error": f"Network error during CrossRef search: {str(e)}"}), 503
@@ -536,36 +3678,547 @@ def search_crossref_route():
         return jsonify({"error": f"Error searching CrossRef: {str(e)}"}), 500
     return jsonify(papers)
 
-@app.route('/api/rank-bm25', methods=['POST'])
+@api.route('/api/search', methods=['POST'])
+def search_all_route():
+    """Search the selected sources concurrently and merge whatever finishes in time"""
+    data = request.json
+    query = data.get('query')
+    max_results = int(data.get('max_results', 10))
+    use_cache = not data.get('bypass_cache', False)
+    filters = data.get('filters', {})
+    sources = data.get('sources') or list(SEARCH_SOURCES)
+    deadline = data.get('deadline')
+    deduplicate = data.get('deduplicate', True)
+    source_queries = data.get('source_queries') or {}
+
+    if not query:
+        return jsonify({"error": "Query is required"}), 400
+    unknown = [name for name in list(sources) + list(source_queries) if name not in SEARCH_SOURCES]
+    if unknown:
+        return jsonify({"error": f"Unknown sources: {', '.join(unknown)}"}), 400
+    logger.info(f"Received fan-out search: query='{query}', sources={sources}, max_results={max_results}, filters={filters}")
+
+    start = time.monotonic()
+    results, status = fan_out_search(query, sources, max_results, filters, float(deadline) if deadline else None, use_cache,
+                                     source_queries)
+    papers = [paper for name in sources for paper in results.get(name, [])]
+    fetched = len(papers)
+    if deduplicate:
+        papers = dedupe_papers(papers)
+    result_set = result_store.add(papers, query=query, sources=sources)
+    elapsed = round(time.monotonic() - start, 3)
+    logger.info(f"Fan-out search finished in {elapsed}s with {len(papers)} papers ({fetched - len(papers)} duplicates merged): {status}")
+    response = {"result_set_id": result_set.result_set_id, "count": len(papers), "sources": status,
+                "duplicatesMerged": fetched - len(papers), "elapsed": elapsed}
+    if data.get('include_papers', True):
+        response["papers"] = papers
+    return jsonify(response)
+
+def sse_event(event, payload):
+    """Format one Server-Sent Events message with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+@api.route('/api/search-stream', methods=['POST'])
+def search_stream_route():
+    """Stream each source's papers as Server-Sent Events as soon as it finishes"""
+    data = request.json
+    query = data.get('query')
+    max_results = int(data.get('max_results', 10))
+    use_cache = not data.get('bypass_cache', False)
+    filters = data.get('filters', {})
+    sources = data.get('sources') or list(SEARCH_SOURCES)
+    deadline = data.get('deadline')
+    deduplicate = data.get('deduplicate', True)
+    verbose_query = data.get('verbose_query') or query
+    semantic = data.get('semantic', False)
+    source_queries = data.get('source_queries') or {}
+
+    if not query:
+        return jsonify({"error": "Query is required"}), 400
+    unknown = [name for name in list(sources) + list(source_queries) if name not in SEARCH_SOURCES]
+    if unknown:
+        return jsonify({"error": f"Unknown sources: {', '.join(unknown)}"}), 400
+    logger.info(f"Received streaming search: query='{query}', sources={sources}, max_results={max_results}, filters={filters}")
+
+    def generate():
+        start = time.monotonic()
+        results, status = {}, {}
+        for name, papers, source_status in iter_fan_out_search(query, sources, max_results, filters, float(deadline) if deadline else None,
+                                                               use_cache, source_queries):
+            status[name] = source_status
+            if papers is not None:
+                results[name] = papers
+            yield sse_event('source', {"source": name, "papers": papers or [], **source_status})
+
+        merged = [paper for name in sources for paper in results.get(name, [])]
+        fetched = len(merged)
+        if deduplicate:
+            merged = dedupe_papers(merged)
+        try:
+            bm25_score_papers(merged, verbose_query)
+            if semantic:
+                semantic_rerank(merged, verbose_query)
+            merged.sort(key=lambda paper: paper['relevanceScore'], reverse=True)
+        except Exception as e:
+            logger.error(f"Error during ranking of streamed results: {e}", exc_info=True)
+        result_set = result_store.add(merged, query=query, sources=sources)
+        elapsed = round(time.monotonic() - start, 3)
+        logger.info(f"Streaming search finished in {elapsed}s with {len(merged)} papers")
+        # The papers already went out in the source events; clients page the ranked set by id.
+        yield sse_event('done', {"result_set_id": result_set.result_set_id, "count": len(merged), "sources": status,
+                                 "duplicatesMerged": fetched - len(merged), "elapsed": elapsed})
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=headers)
+
+@api.route('/api/search-deep', methods=['POST'])
+def search_deep_route():
+    """Page deeply through the selected sources, streaming pages as Server-Sent Events"""
+    data = request.json
+    query = data.get('query')
+    limit = min(int(data.get('limit', DEEP_RETRIEVAL_MAX)), DEEP_RETRIEVAL_MAX)
+    filters = data.get('filters', {})
+    sources = data.get('sources') or list(SEARCH_SOURCES)
+
+    if not query:
+        return jsonify({"error": "Query is required"}), 400
+    unknown = [name for name in sources if name not in DEEP_SOURCES]
+    if unknown:
+        return jsonify({"error": f"Unknown sources: {', '.join(unknown)}"}), 400
+    logger.info(f"Received deep retrieval: query='{query}', sources={sources}, limit={limit}, filters={filters}")
+
+    def generate():
+        start = time.monotonic()
+        status, records = {}, []
+        for kind, name, payload in iter_deep_search(query, sources, limit, filters):
+            if kind == 'page':
+                records.extend(PaperRecord(paper) for paper in payload['papers'])
+                yield sse_event('page', {"source": name, **payload})
+            else:
+                status[name] = payload
+                yield sse_event('source', {"source": name, **payload})
+        # Kept as a result set so the client can dedupe, rank and export it by id.
+        result_set = result_store.add(records, query=query, sources=sources, deep=True)
+        elapsed = round(time.monotonic() - start, 3)
+        logger.info(f"Deep retrieval finished in {elapsed}s with {len(records)} papers: {status}")
+        yield sse_event('done', {"result_set_id": result_set.result_set_id, "sources": status, "total": len(records), "elapsed": elapsed})
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=headers)
+
+@api.route('/api/cache-stats', methods=['GET'])
+def cache_stats_route():
+    """Report search cache hit/miss counters and size"""
+    return jsonify(search_cache.summary())
+
+@api.route('/api/cache-clear', methods=['POST'])
+def cache_clear_route():
+    """Drop cached search results, optionally for a single source"""
+    source = (request.json or {}).get('source')
+    if source and source not in SEARCH_SOURCES:
+        return jsonify({"error": f"Unknown source: {source}"}), 400
+    search_cache.clear(source)
+    logger.info(f"Cleared search cache for {source or 'all sources'}")
+    return jsonify({"cleared": source or "all"})
+
+@api.route('/api/upstream-stats', methods=['GET'])
+def upstream_stats_route():
+    """Report rate limiter delays and coalesced searches per source"""
+    return jsonify({
+        source: {
+            "rate_limit": {"rate": bucket.rate, "burst": bucket.capacity, **bucket.stats},
+            "coalescing": search_flights.stats.get(source, {"executed": 0, "coalesced": 0}),
+        }
+        for source, bucket in rate_limiters.items()
+    })
+
+@api.route('/api/scholar-proxies', methods=['GET'])
+def scholar_proxies_route():
+    """Report Scholar worker pool and proxy health"""
+    return jsonify({"pool": scholar_pool.summary(), "proxies": proxy_rotator.summary()})
+
+@api.route('/api/saved-queries', methods=['POST'])
+def create_saved_query_route():
+    """Save a query to be re-run across its sources on a schedule"""
+    data = request.json
+    query = data.get('query')
+    sources = data.get('sources') or list(SEARCH_SOURCES)
+
+    if not query:
+        return jsonify({"error": "Query is required"}), 400
+    unknown = [name for name in sources if name not in SEARCH_SOURCES]
+    if unknown:
+        return jsonify({"error": f"Unknown sources: {', '.join(unknown)}"}), 400
+
+    spec = {
+        "name": data.get('name') or query,
+        "query": query,
+        "verbose_query": data.get('verbose_query'),
+        "sources": sources,
+        "max_results": int(data.get('max_results', 25)),
+        "filters": data.get('filters', {}),
+        "interval": max(float(data.get('interval_hours', SNAPSHOT_DEFAULT_INTERVAL / 3600)) * 3600, SNAPSHOT_MIN_INTERVAL),
+        "summarize": bool(data.get('summarize', False)),
+    }
+    query_id = snapshot_store.add(spec)
+    # Produce the first snapshot now rather than at the next scheduler poll.
+    if snapshot_store.claim(query_id):
+        snapshot_executor.submit(refresh_saved_query, snapshot_store.get(query_id))
+    logger.info(f"Saved query '{query}' as {query_id}")
+    return jsonify(snapshot_store.get(query_id)), 201
+
+@api.route('/api/saved-queries', methods=['GET'])
+def list_saved_queries_route():
+    """List saved queries with their schedule and latest snapshot"""
+    saved_queries = snapshot_store.list()
+    for saved in saved_queries:
+        snapshots = snapshot_store.snapshots(saved['query_id'])
+        saved['latest_snapshot'] = snapshots[0] if snapshots else None
+    return jsonify(saved_queries)
+
+@api.route('/api/saved-queries/<query_id>', methods=['DELETE'])
+def delete_saved_query_route(query_id):
+    if not snapshot_store.delete(query_id):
+        return jsonify({"error": "Unknown saved query"}), 404
+    return jsonify({"deleted": query_id})
+
+@api.route('/api/saved-queries/<query_id>/refresh', methods=['POST'])
+def refresh_saved_query_route(query_id):
+    """Re-run a saved query now in the background"""
+    if snapshot_store.get(query_id) is None:
+        return jsonify({"error": "Unknown saved query"}), 404
+    if not snapshot_store.claim(query_id):
+        return jsonify({"query_id": query_id, "status": "running"}), 202
+    snapshot_executor.submit(refresh_saved_query, snapshot_store.get(query_id))
+    return jsonify({"query_id": query_id, "status": "queued"}), 202
+
+@api.route('/api/saved-queries/<query_id>/snapshot', methods=['GET'])
+def latest_snapshot_route(query_id):
+    """Serve the latest stored snapshot; ?new_only=true returns only papers new since the previous run"""
+    saved = snapshot_store.get(query_id)
+    if saved is None:
+        return jsonify({"error": "Unknown saved query"}), 404
+    snapshot = snapshot_store.latest_snapshot(query_id)
+    if snapshot is None:
+        return jsonify({"query_id": query_id, "status": "running" if saved['running'] else "pending", "papers": []}), 202
+    if truthy(request.args.get('new_only', '')):
+        new_ids = set(snapshot['new_ids'])
+        snapshot['papers'] = [paper for paper in snapshot['papers'] if paper['id'] in new_ids]
+    return jsonify({**snapshot, "saved_query": saved})
+
+@api.route('/api/saved-queries/<query_id>/snapshots', methods=['GET'])
+def list_snapshots_route(query_id):
+    """Snapshot history (without papers) of a saved query, newest first"""
+    if snapshot_store.get(query_id) is None:
+        return jsonify({"error": "Unknown saved query"}), 404
+    return jsonify(snapshot_store.snapshots(query_id))
+
+@api.route('/api/snapshots/<snapshot_id>', methods=['GET'])
+def snapshot_route(snapshot_id):
+    snapshot = snapshot_store.snapshot(snapshot_id)
+    if snapshot is None:
+        return jsonify({"error": "Unknown snapshot"}), 404
+    return jsonify(snapshot)
+
+def export_response(papers, export_format, compress, name):
+    mimetype, extension, _ = EXPORT_FORMATS[export_format]
+    filename = f"{name}.{extension}" + ('.gz' if compress else '')
+    headers = {'Content-Disposition': f'attachment; filename="{filename}"', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(export_papers(papers, export_format, compress)),
+                    mimetype='application/gzip' if compress else mimetype, headers=headers)
+
+@api.route('/api/export', methods=['POST'])
+def export_route():
+    """Stream papers as CSV, BibTeX, RIS or JSONL, optionally gzipped.
+
+    Papers come from one of: 'papers' in the body, a stored 'snapshot_id'
+    (with 'new_only'), a 'result_set_id' (with the filter and sort arguments
+    of GET /api/result-sets/<id>), or a deep retrieval run for 'query' over
+    'sources' that is exported page by page as it arrives.
+    """
+    data = request.json
+    export_format = data.get('format', 'csv')
+    compress = truthy(data.get('gzip', False))
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": f"Unknown export format '{export_format}'. Choose one of: {', '.join(EXPORT_FORMATS)}"}), 400
+
+    if data.get('snapshot_id'):
+        papers = snapshot_store.snapshot_papers(data['snapshot_id'], truthy(data.get('new_only', False)))
+        if papers is None:
+            return jsonify({"error": "Unknown snapshot"}), 404
+        name = f"snapshot-{data['snapshot_id']}"
+    elif data.get('result_set_id'):
+        result_set = result_store.get(data['result_set_id'])
+        if result_set is None:
+            return jsonify({"error": "Unknown or expired result set"}), 404
+        try:
+            papers = filter_result_set(result_set, data)
+        except ValueError as e:
+            return jsonify({"error": f"Invalid result set arguments: {e}"}), 400
+        name = f"results-{data['result_set_id']}"
+    elif data.get('query'):
+        sources = data.get('sources') or list(DEEP_SOURCES)
+        unknown = [source for source in sources if source not in DEEP_SOURCES]
+        if unknown:
+            return jsonify({"error": f"Unknown sources: {', '.join(unknown)}"}), 400
+        limit = min(int(data.get('limit', DEEP_RETRIEVAL_MAX)), DEEP_RETRIEVAL_MAX)
+        papers = deep_search_papers(data['query'], sources, limit, data.get('filters', {}))
+        name = 'search-export'
+    elif data.get('papers'):
+        papers = data['papers']
+        name = 'papers'
+    else:
+        return jsonify({"error": "Provide papers, a snapshot_id, a result_set_id or a query to export"}), 400
+    logger.info(f"Received export request: format={export_format}, gzip={compress}, from={name}")
+    return export_response(papers, export_format, compress, name)
+
+@api.route('/api/snapshots/<snapshot_id>/export', methods=['GET'])
+def export_snapshot_route(snapshot_id):
+    """Download a stored snapshot: ?format=csv|bibtex|ris|jsonl&gzip=1&new_only=1"""
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": f"Unknown export format '{export_format}'. Choose one of: {', '.join(EXPORT_FORMATS)}"}), 400
+    papers = snapshot_store.snapshot_papers(snapshot_id, truthy(request.args.get('new_only', '')))
+    if papers is None:
+        return jsonify({"error": "Unknown snapshot"}), 404
+    return export_response(papers, export_format, truthy(request.args.get('gzip', '')), f"snapshot-{snapshot_id}")
+
+@api.route('/api/result-sets', methods=['POST'])
+def create_result_set_route():
+    """Store posted papers, or the union of stored result_set_ids, as a result set so later calls can refer to them by id"""
+    data = request.json
+    if data.get('result_set_ids'):
+        return merge_result_sets(data['result_set_ids'], data.get('query'))
+    papers_data = data.get('papers')
+    if not papers_data:
+        return jsonify({"error": "Papers data is required"}), 400
+    if len(papers_data) > RESULT_STORE_MAX_PAPERS:
+        return jsonify({"error": f"At most {RESULT_STORE_MAX_PAPERS} papers can be stored in one result set"}), 400
+    result_set = result_store.add(papers_data, query=data.get('query'))
+    return jsonify(result_set.describe()), 201
+
+def merge_result_sets(result_set_ids, query=None):
+    """One set holding each paper of the given sets once, at its best relevanceScore, best first.
+
+    Used for searches that ran several queries ranked against the same verbose
+    query, so their scores are comparable.
+    """
+    best = {}
+    for result_set_id in result_set_ids:
+        result_set = result_store.get(result_set_id)
+        if result_set is None:
+            return jsonify({"error": f"Unknown or expired result set {result_set_id}"}), 404
+        for record in result_set.records:
+            seen = best.get(record['id'])
+            if seen is None or (record.get('relevanceScore') or 0) > (seen.get('relevanceScore') or 0):
+                best[record['id']] = record
+    records = sorted(best.values(), key=lambda record: record.get('relevanceScore') or 0, reverse=True)
+    result_set = result_store.add([PaperRecord(record.to_dict()) for record in records], query=query,
+                                  merged_from=list(result_set_ids))
+    return jsonify(result_set.describe()), 201
+
+@api.route('/api/result-sets/<result_set_id>', methods=['GET'])
+def result_set_route(result_set_id):
+    """A page of a result set: ?offset&limit&fields=id,title,...&sort plus the filters of FacetIndex.select"""
+    result_set = result_store.get(result_set_id)
+    if result_set is None:
+        return jsonify({"error": "Unknown or expired result set"}), 404
+    try:
+        offset = max(int(request.args.get('offset', 0)), 0)
+        limit = min(max(int(request.args.get('limit', RESULT_PAGE_SIZE)), 0), RESULT_STORE_MAX_PAPERS)
+        selected = filter_result_set(result_set, request.args)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid result set arguments: {e}"}), 400
+    fields = [field.strip() for field in request.args['fields'].split(',')] if request.args.get('fields') else None
+    papers = [record.to_dict(fields) for record in selected[offset:offset + limit]]
+    return jsonify({**result_set.describe(), "matched": len(selected), "offset": offset, "papers": papers})
+
+@api.route('/api/result-sets/<result_set_id>/facets', methods=['GET'])
+def result_set_facets_route(result_set_id):
+    """Year, source, venue, PDF and citation-bucket counts over a result set, narrowed by the same filters as paging"""
+    result_set = result_store.get(result_set_id)
+    if result_set is None:
+        return jsonify({"error": "Unknown or expired result set"}), 404
+    index = result_set.facet_index()
+    try:
+        selection = index.select(request.args)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid result set arguments: {e}"}), 400
+    return jsonify({**result_set.describe(), "matched": int(np.count_nonzero(selection)), "facets": index.counts(selection)})
+
+@api.route('/api/result-sets/<result_set_id>', methods=['DELETE'])
+def delete_result_set_route(result_set_id):
+    if not result_store.delete(result_set_id):
+        return jsonify({"error": "Unknown or expired result set"}), 404
+    return jsonify({"deleted": result_set_id})
+
+@api.route('/api/local-search', methods=['POST'])
+def local_search_route():
+    """Search the local index of previously fetched papers without touching upstream APIs"""
+    data = request.json
+    query = data.get('query')
+    max_results = int(data.get('max_results', 20))
+    sources = data.get('sources')
+
+    if not query:
+        return jsonify({"error": "Query is required"}), 400
+    logger.info(f"Received local index search: query='{query}', max_results={max_results}")
+
+    try:
+        start = time.monotonic()
+        papers = paper_index.search(query, max_results, sources)
+        elapsed = round(time.monotonic() - start, 4)
+        logger.info(f"Local index search returned {len(papers)} papers in {elapsed}s")
+    except Exception as e:
+        logger.error(f"Error searching local index: {e}", exc_info=True)
+        return jsonify({"error": f"Error searching local index: {str(e)}"}), 500
+    return jsonify({"papers": papers, "elapsed": elapsed, "index": paper_index.summary()})
+
+@api.route('/api/expand', methods=['POST'])
+def expand_route():
+    """Expand seed papers through their references and citations and rank the neighbourhood"""
+    data = request.json
+    seeds = list(data.get('seeds') or [])
+    for paper in data.get('papers') or []:
+        seeds.append(paper.get('doi') or paper.get('id'))
+    depth = min(int(data.get('depth', 1)), EXPAND_MAX_DEPTH)
+    max_results = int(data.get('max_results', 50))
+
+    seeds = [seed for seed in seeds if seed]
+    if not seeds:
+        return jsonify({"error": "Seeds (DOIs or Semantic Scholar paper ids) are required"}), 400
+    logger.info(f"Received citation expansion: {len(seeds)} seeds, depth={depth}")
+
+    try:
+        start = time.monotonic()
+        papers, stats = expand_citations(seeds, depth, max_results)
+        elapsed = round(time.monotonic() - start, 3)
+        logger.info(f"Citation expansion returned {len(papers)} papers in {elapsed}s")
+    except httpRequest.exceptions.RequestException as e:
+        logger.error(f"Network error during citation expansion: {e}", exc_info=True)
+        return jsonify({"error": f"Network error during citation expansion: {str(e)}"}), 503
+    except Exception as e:
+        logger.error(f"Error during citation expansion: {e}", exc_info=True)
+        return jsonify({"error": f"Error during citation expansion: {str(e)}"}), 500
+    return jsonify({"papers": papers, **stats, "elapsed": elapsed, "graph": citation_graph.summary()})
+
+@api.route('/api/ingest', methods=['POST'])
+def ingest_route():
+    """Extract text and key terms from uploaded PDFs and images (multipart field `files`)"""
+    files = request.files.getlist('files')
+    if not files:
+        return jsonify({"error": "At least one file is required"}), 400
+
+    uploads = []
+    for file in files:
+        data = file.read(INGEST_MAX_BYTES + 1)
+        if len(data) > INGEST_MAX_BYTES:
+            return jsonify({"error": f"{file.filename} exceeds the {INGEST_MAX_BYTES} byte upload limit"}), 413
+        uploads.append((file.filename, file.mimetype, data))
+
+    started = time.monotonic()
+    documents = ingest_files(uploads)
+    combined = '\n'.join(document["text"] for document in documents if "text" in document)
+    return jsonify({
+        "documents": documents,
+        "key_terms": key_terms(combined),
+        "elapsed": round(time.monotonic() - started, 3),
+    })
+
+@api.route('/api/deduplicate', methods=['POST'])
+def deduplicate_route():
+    """Merge cross-source duplicates in a list of papers, or in a stored result set in place"""
+    data = request.json
+    papers_data = data.get('papers')
+    result_set_id = data.get('result_set_id')
+
+    if result_set_id:
+        result_set = result_store.get(result_set_id)
+        if result_set is None:
+            return jsonify({"error": "Unknown or expired result set"}), 404
+        try:
+            with result_set.lock:
+                before = len(result_set.records)
+                merged = dedupe_papers(result_set.records)
+                result_set.records = [paper if isinstance(paper, PaperRecord) else PaperRecord(paper) for paper in merged]
+                result_store.save(result_set)
+        except Exception as e:
+            logger.error(f"Error during deduplication of result set {result_set_id}: {e}", exc_info=True)
+            return jsonify({"error": f"Error during deduplication: {str(e)}"}), 500
+        logger.info(f"Deduplication merged {before - len(result_set.records)} duplicates in result set {result_set_id}.")
+        return jsonify({**result_set.describe(), "duplicatesMerged": before - len(result_set.records)})
+    if not papers_data:
+        return jsonify({"error": "Papers data (or a result_set_id) is required"}), 400
+    logger.info(f"Received deduplication request. Papers: {len(papers_data)}")
+
+    try:
+        papers = dedupe_papers(papers_data)
+        logger.info(f"Deduplication merged {len(papers_data) - len(papers)} duplicates.")
+    except Exception as e:
+        logger.error(f"Error during deduplication: {e}", exc_info=True)
+        return jsonify({"error": f"Error during deduplication: {str(e)}"}), 500
+    return jsonify(papers)
+
+# Per-paper scores returned when a stored result set is ranked.
+RANKING_FIELDS = ('bm25_score', 'semantic_score', 'relevanceScore')
+
+def rank_papers(papers, verbose_query, engine, field_weights, semantic, semantic_weight, embedding_model):
+    """Score papers in place with BM25, optionally blended with embeddings; returns their relevanceScores"""
+    bm25_score_papers(papers, verbose_query, engine, field_weights)
+    if semantic:
+        try:
+            semantic_rerank(papers, verbose_query, embedding_model, semantic_weight)
+        except Exception as e:
+            logger.warning(f"Semantic rerank failed, keeping BM25 scores: {e}")
+            for paper in papers: paper['relevanceScore'] = paper['bm25_score']
+    return np.array([paper['relevanceScore'] for paper in papers], dtype=float)
+
+@api.route('/api/rank-bm25', methods=['POST'])
 def rank_bm25_route():
-    """Rank papers using BM25 algorithm"""
+    """Rank posted papers, or a stored result set in place, using BM25"""
     data = request.json
     papers_data = data.get('papers')
+    result_set_id = data.get('result_set_id')
     verbose_query = data.get('verbose_query')
+    engine = data.get('engine', 'sparse')
+    field_weights = data.get('field_weights')
+    top_k = data.get('top_k')
+    semantic = data.get('semantic', False)
+    semantic_weight = float(data.get('semantic_weight', SEMANTIC_WEIGHT))
+    embedding_model = data.get('embedding_model', EMBEDDING_MODEL)
 
-    if not papers_data or not verbose_query:
-        return jsonify({"error": "Papers data and verbose query are required"}), 400
-    logger.info(f"Received BM25 ranking request. Papers: {len(papers_data)}, Query: '{verbose_query[:100]}...'")
+    if not (papers_data or result_set_id) or not verbose_query:
+        return jsonify({"error": "Papers data (or a result_set_id) and verbose query are required"}), 400
+    if engine not in BM25_ENGINES:
+        return jsonify({"error": f"Unknown BM25 engine '{engine}'. Choose one of: {', '.join(BM25_ENGINES)}"}), 400
+    try:
+        field_weights = parse_field_weights(field_weights)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid field_weights: {e}"}), 400
+
+    if result_set_id:
+        # The set is re-ordered best first and only ids and scores go back to the client.
+        result_set = result_store.get(result_set_id)
+        if result_set is None:
+            return jsonify({"error": "Unknown or expired result set"}), 404
+        logger.info(f"Received BM25 ranking request for result set {result_set_id} ({len(result_set.records)} papers), Engine: {engine}")
+        try:
+            with result_set.lock:
+                scores = rank_papers(result_set.records, verbose_query, engine, field_weights, semantic, semantic_weight, embedding_model)
+                result_set.records = [result_set.records[i] for i in np.argsort(-scores, kind='stable')]
+                result_store.save(result_set)
+        except Exception as e:
+            logger.error(f"Error during BM25 ranking of result set {result_set_id}: {e}", exc_info=True)
+            return jsonify({"error": f"Error during BM25 ranking: {str(e)}"}), 500
+        ranked = result_set.records[:int(top_k)] if top_k else result_set.records
+        ranking = [{"id": record.get('id'), **record.to_dict(RANKING_FIELDS)} for record in ranked]
+        return jsonify({"result_set_id": result_set_id, "count": len(result_set.records), "ranking": ranking})
 
+    logger.info(f"Received BM25 ranking request. Papers: {len(papers_data)}, Engine: {engine}, Query: '{verbose_query[:100]}...'")
     try:
-        corpus = [str(paper.get('abstract', '')) for paper in papers_data]
-        tokenized_corpus = [tokenize(doc) for doc in corpus]
-        tokenized_query = tokenize(verbose_query)
-
-        if not any(tokenized_corpus):
-            logger.warning("BM25: Corpus is empty. Scores will be zero.")
-            for paper in papers_data: paper['bm25_score'] = paper['relevanceScore'] = 0.0
-            return jsonify(papers_data)
-        if not tokenized_query:
-            logger.warning("BM25: Query is empty. Scores will be zero.")
-            for paper in papers_data: paper['bm25_score'] = paper['relevanceScore'] = 0.0
-            return jsonify(papers_data)
-
-        bm25 = BM25Okapi(tokenized_corpus)
-        doc_scores = bm25.get_scores(tokenized_query)
-        for paper, score in zip(papers_data, doc_scores):
-            paper['bm25_score'] = float(score)
-            paper['relevanceScore'] = float(score)
+        scores = rank_papers(papers_data, verbose_query, engine, field_weights, semantic, semantic_weight, embedding_model)
+        if top_k:
+            papers_data = [papers_data[i] for i in top_k_indices(scores, int(top_k))]
         logger.info("BM25 ranking successful.")
     except Exception as e:
         logger.error(f"Error during BM25 ranking: {e}", exc_info=True)
@@ -573,12 +4226,12 @@ def rank_bm25_route():
         return jsonify({"error": f"Error during BM25 ranking: {str(e)}", "ranked_papers_fallback": papers_data}), 500
     return jsonify(papers_data)
 
-@app.route('/api/ollama-refine-query', methods=['POST'])
+@api.route('/api/ollama-refine-query', methods=['POST'])
 def ollama_refine_query():
     """Refine search query using Ollama AI"""
     data = request.json
     query = data.get('query')
-    model = data.get('model', 'gemma:2b')
+    model = data.get('model', OLLAMA_DEFAULT_MODEL)
 
     if not query:
         return jsonify({"error": "Query is required"}), 400
@@ -586,34 +4239,237 @@ def ollama_refine_query():
     try:
         logger.info(f"Calling Ollama for query refinement with model '{model}' for query: '{query}'")
         prompt = f"Refine the following research paper search query to be more effective and comprehensive. Provide only the refined query, no additional text or explanation:\n\nOriginal query: \"{query}\"\n\nRefined query:"
-        response = ollama.chat(model=model, messages=[{'role': 'user', 'content': prompt}])
-        refined_query = response['message']['content'].strip()
-        logger.info(f"Ollama refined query: '{refined_query}'")
-        return jsonify({"refined_query": refined_query})
+        refined_query, cached = memoized_generate('refine', model, prompt, REFINE_CACHE_TTL)
+        logger.info(f"Ollama refined query{' (cached)' if cached else ''}: '{refined_query}'")
+        return jsonify({"refined_query": refined_query, "cached": cached})
     except Exception as e:
         logger.error(f"Error refining query with Ollama: {e}", exc_info=True)
         return jsonify({"error": f"Error refining query with Ollama: {str(e)}"}), 500
 
-@app.route('/api/ollama-summarize-abstract', methods=['POST'])
+@api.route('/api/ollama-query-plan', methods=['POST'])
+def ollama_query_plan():
+    """Generate database search queries and the BM25 verbose query in one Ollama call"""
+    data = request.json
+    topic = data.get('topic')
+    model = data.get('model', OLLAMA_DEFAULT_MODEL)
+
+    if not topic:
+        return jsonify({"error": "Topic is required"}), 400
+
+    fallback = data.get('fallback', True)
+    try:
+        logger.info(f"Calling Ollama for query plan with model '{model}' for topic: '{topic}'")
+        prompt = build_query_plan_prompt(topic, data.get('notes'), data.get('file_text'), data.get('subject'), data.get('paper_type'))
+        plan, cached = memoized_generate('query-plan', model, prompt, REFINE_CACHE_TTL, format='json', parse=parse_query_plan)
+        logger.info(f"Ollama query plan{' (cached)' if cached else ''}: {len(plan['queries'])} queries")
+        return jsonify({**plan, "cached": cached, "generator": "ollama"})
+    except (ValueError, AttributeError) as e:
+        logger.error(f"Could not parse Ollama query plan: {e}", exc_info=True)
+        if not fallback:
+            return jsonify({"error": f"Could not parse Ollama query plan: {str(e)}"}), 502
+    except Exception as e:
+        logger.error(f"Error generating query plan with Ollama: {e}", exc_info=True)
+        if not fallback:
+            return jsonify({"error": f"Error generating query plan with Ollama: {str(e)}"}), 500
+    logger.info("Falling back to the local query builder")
+    plan = build_local_query_plan(topic, data.get('notes'), data.get('file_text'))
+    return jsonify({**plan, "cached": False, "generator": "local"})
+
+@api.route('/api/build-query', methods=['POST'])
+def build_query_route():
+    """Build search queries from keyphrases of the topic, notes and file text, without an LLM"""
+    data = request.json
+    topic = data.get('topic')
+    notes = data.get('notes')
+    file_text = data.get('file_text')
+    max_phrases = int(data.get('max_phrases', KEYPHRASE_DEFAULT_LIMIT))
+
+    if not (topic or notes or file_text):
+        return jsonify({"error": "A topic, notes or file_text is required"}), 400
+
+    started = time.monotonic()
+    plan = build_local_query_plan(topic, notes, file_text, max_phrases)
+    return jsonify({**plan, "generator": "local", "elapsed": round(time.monotonic() - started, 4)})
+
+@api.route('/api/ollama-summarize-abstract', methods=['POST'])
 def ollama_summarize_abstract():
     """Summarize abstract using Ollama AI"""
     data = request.json
     abstract = data.get('abstract')
-    model = data.get('model', 'gemma:2b')
+    model = data.get('model', OLLAMA_DEFAULT_MODEL)
 
     if not abstract:
         return jsonify({"error": "Abstract is required"}), 400
 
     try:
         logger.info(f"Calling Ollama for abstract summarization with model '{model}'")
-        prompt = f"Summarize the following research paper abstract concisely. Provide only the summary, no additional text or explanation:\n\nAbstract: \"{abstract}\"\n\nSummary:"
-        response = ollama.chat(model=model, messages=[{'role': 'user', 'content': prompt}])
-        summary = response['message']['content'].strip()
-        logger.info(f"Ollama summarized abstract")
-        return jsonify({"summary": summary})
+        summary, cached = summarize_abstract(abstract, model)
+        logger.info(f"Ollama summarized abstract{' (cached)' if cached else ''}")
+        return jsonify({"summary": summary, "cached": cached})
     except Exception as e:
         logger.error(f"Error summarizing abstract with Ollama: {e}", exc_info=True)
         return jsonify({"error": f"Error summarizing abstract with Ollama: {str(e)}"}), 500
 
+@api.route('/api/ollama-summarize-batch', methods=['POST'])
+def ollama_summarize_batch():
+    """Summarize many abstracts through the bounded Ollama worker pool.
+
+    Accepts 'papers' as a list of {id, abstract} objects. Returns every
+    summary at once, or with 'stream': true sends a Server-Sent Event per
+    summary as it completes.
+    """
+    data = request.json
+    papers_data = data.get('papers')
+    model = data.get('model', OLLAMA_DEFAULT_MODEL)
+    stream = data.get('stream', False)
+
+    if not papers_data:
+        return jsonify({"error": "Papers data is required"}), 400
+    items = [(str(paper.get('id', i)), paper.get('abstract')) for i, paper in enumerate(papers_data)]
+    items = [(paper_id, abstract) for paper_id, abstract in items if abstract and abstract not in MISSING_ABSTRACTS]
+    logger.info(f"Received batch summarization request. Abstracts: {len(items)}, Model: '{model}'")
+
+    futures = {submit_with_context(summary_executor, summarize_abstract, abstract, model): paper_id for paper_id, abstract in items}
+
+    def results():
+        for future in as_completed(futures):
+            paper_id = futures[future]
+            try:
+                summary, cached = future.result()
+                yield {"id": paper_id, "summary": summary, "cached": cached}
+            except Exception as e:
+                logger.error(f"Error summarizing abstract {paper_id} with Ollama: {e}", exc_info=True)
+                yield {"id": paper_id, "error": str(e)}
+
+    if stream:
+        def generate():
+            for result in results():
+                yield sse_event('summary', result)
+            yield sse_event('done', {"count": len(futures)})
+        headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=headers)
+
+    summaries, errors, cached_count = {}, {}, 0
+    for result in results():
+        if 'error' in result:
+            errors[result['id']] = result['error']
+        else:
+            summaries[result['id']] = result['summary']
+            cached_count += result['cached']
+    logger.info(f"Batch summarization finished: {len(summaries)} summaries ({cached_count} cached), {len(errors)} errors")
+    return jsonify({"summaries": summaries, "errors": errors, "cached": cached_count})
+
+# --- Application Factory ---
+
+APP_ROOT = os.path.dirname(os.path.abspath(__file__))
+STATIC_MAX_AGE = int(os.environ.get('STATIC_MAX_AGE', 3600))
+site = Blueprint('site', __name__)
+runtime_started = False
+runtime_lock = threading.Lock()
+
+@site.route('/')
+def index_route():
+    return send_from_directory(APP_ROOT, 'index.html', max_age=STATIC_MAX_AGE)
+
+@site.route('/<any("index.html", "script.js", "styles.css"):filename>')
+def static_asset_route(filename):
+    """Serve the frontend files (conditional requests are answered with 304 via their ETag)"""
+    return send_from_directory(APP_ROOT, filename, max_age=STATIC_MAX_AGE)
+
+@api.before_request
+def start_request_timing():
+    request.environ['timing.started'] = time.perf_counter()
+    request_timings.set([])
+
+@api.after_request
+def finish_request_timing(response):
+    """Record request metrics and, if SERVER_TIMING is set, add a Server-Timing header.
+
+    Streamed responses are timed up to the point their body starts streaming.
+    """
+    elapsed = time.perf_counter() - request.environ.get('timing.started', time.perf_counter())
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.inc('http_requests_total', route=route, method=request.method, status=response.status_code)
+    metrics.observe('http_request_duration_seconds', elapsed, route=route)
+    if SERVER_TIMING_ENABLED:
+        timings = request_timings.get() or []
+        entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings]
+        response.headers['Server-Timing'] = ', '.join(entries + [f"total;dur={elapsed * 1000:.1f}"])
+    return response
+
+def collect_runtime_metrics():
+    """Scrape-time samples from the caches, rate limiters, request coalescing and Scholar proxies"""
+    for cache_name, cache in (('search', search_cache), ('llm', llm_cache), ('ingest', ingest_cache), ('result_sets', result_set_cache)):
+        with cache.lock:
+            stats = {namespace: dict(counters) for namespace, counters in cache.stats.items()}
+        for namespace, counters in stats.items():
+            for event, value in counters.items():
+                yield 'cache_events_total', 'counter', {"cache": cache_name, "namespace": namespace, "event": event}, value
+    for source, bucket in rate_limiters.items():
+        yield 'rate_limit_requests_total', 'counter', {"source": source}, bucket.stats["requests"]
+        yield 'rate_limit_delayed_total', 'counter', {"source": source}, bucket.stats["delayed"]
+        yield 'rate_limit_delay_seconds_total', 'counter', {"source": source}, bucket.stats["delay_seconds"]
+    for flights_name, flights in (('search', search_flights), ('llm', llm_flights)):
+        for namespace, counters in list(flights.stats.items()):
+            for outcome, value in counters.items():
+                yield 'singleflight_calls_total', 'counter', {"group": flights_name, "namespace": namespace, "outcome": outcome}, value
+    proxy_summary = proxy_rotator.summary(top=0)
+    for state in ('total', 'healthy', 'quarantined', 'in_flight'):
+        yield 'scholar_proxies', 'gauge', {"state": state}, proxy_summary[state]
+    yield 'scholar_jobs_queued', 'gauge', {}, scholar_pool.jobs.qsize()
+    result_summary = result_store.summary()
+    yield 'result_sets_in_memory', 'gauge', {}, result_summary['sets_in_memory']
+    yield 'result_set_papers_in_memory', 'gauge', {}, result_summary['papers_in_memory']
+
+metrics.add_collector(collect_runtime_metrics)
+
+@api.route('/metrics', methods=['GET'])
+def metrics_route():
+    """Prometheus text-format metrics for this worker process"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def start_runtime():
+    """Once-per-process startup: NLTK data, Scholar proxies and the snapshot scheduler"""
+    global runtime_started
+    with runtime_lock:
+        if runtime_started:
+            return
+        runtime_started = True
+    ensure_nltk_data()
+    load_proxies()
+    proxy_rotator.add_proxies(proxies)
+    snapshot_scheduler.start()
+    atexit.register(shutdown_runtime)
+
+def shutdown_runtime():
+    """Stop background threads and drain executors so a worker can exit cleanly"""
+    global runtime_started
+    with runtime_lock:
+        if not runtime_started:
+            return
+        runtime_started = False
+    logger.info("Shutting down background workers")
+    snapshot_scheduler.stop()
+    proxy_rotator.stop()
+    executors = [*search_executors.values(), deep_page_executor, deep_source_executor,
+                 summary_executor, graph_executor, snapshot_executor]
+    for executor in executors:
+        executor.shutdown(wait=False, cancel_futures=True)
+    reset_ingest_executor()
+    # Let queued index writes finish so fetched papers are not lost.
+    index_executor.shutdown(wait=True)
+
+def create_app(start_background=True):
+    """Build the Flask app. Serve with gunicorn via wsgi.py (see gunicorn.conf.py)."""
+    app = Flask(__name__, static_folder=None, template_folder='templates')
+    CORS(app)
+    app.register_blueprint(api)
+    app.register_blueprint(site)
+    if start_background:
+        start_runtime()
+    return app
+
 if __name__ == '__main__':
+    # Development server. With the debug reloader only the serving child process starts background work.
+    app = create_app(start_background=os.environ.get('WERKZEUG_RUN_MAIN') == 'true')
     app.run(debug=True, host='0.0.0.0', port=5001)
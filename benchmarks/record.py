@@ -0,0 +1,60 @@
+"""Re-record the benchmark fixtures from the live upstream APIs.
+
+Needs network access. Fixture results change whenever the upstream indexes
+do, so record once, commit, and compare benchmark runs against the same
+fixtures; re-record only when a parser change needs new shapes of data.
+
+    python benchmarks/record.py --query "graph neural networks protein structure" --count 50
+"""
+import argparse
+import json
+import os
+import time
+
+import requests
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+EUTILS_BASE = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/'
+# Must match the fields app.py requests, or the parser is benchmarked on different data.
+SEMANTIC_SCHOLAR_FIELDS = 'paperId,title,abstract,authors,year,publicationDate,url,citationCount,openAccessPdf'
+# Stay under the slowest published rate (arXiv: one request every three seconds).
+REQUEST_INTERVAL = 3
+
+
+def save(name, content):
+    path = os.path.join(FIXTURE_DIR, name)
+    with open(path, 'wb') as f:
+        f.write(content)
+    print(f"Wrote {path} ({len(content)} bytes)")
+
+def fetch(method, url, **kwargs):
+    response = requests.request(method, url, timeout=60, **kwargs)
+    response.raise_for_status()
+    time.sleep(REQUEST_INTERVAL)
+    return response
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--query', default='graph neural networks protein structure')
+    parser.add_argument('--count', type=int, default=50, help="records per source")
+    args = parser.parse_args()
+
+    esearch = fetch('GET', f"{EUTILS_BASE}esearch.fcgi", params={
+        'db': 'pubmed', 'term': args.query, 'retmax': args.count, 'retmode': 'json', 'sort': 'relevance'})
+    save('pubmed_esearch.json', json.dumps(esearch.json(), indent=1).encode('utf-8'))
+    ids = esearch.json()['esearchresult']['idlist']
+    save('pubmed_efetch.xml', fetch('POST', f"{EUTILS_BASE}efetch.fcgi", data={'db': 'pubmed', 'id': ','.join(ids), 'retmode': 'xml'}).content)
+
+    save('arxiv_query.xml', fetch('GET', 'http://export.arxiv.org/api/query', params={
+        'search_query': f'all:{args.query}', 'start': 0, 'max_results': args.count, 'sortBy': 'relevance', 'sortOrder': 'descending'}).content)
+
+    semantic = fetch('GET', 'https://api.semanticscholar.org/graph/v1/paper/search', params={
+        'query': args.query, 'limit': min(args.count, 100), 'fields': SEMANTIC_SCHOLAR_FIELDS})
+    save('semantic_search.json', json.dumps(semantic.json(), indent=1).encode('utf-8'))
+
+    crossref = fetch('GET', 'https://api.crossref.org/works', params={
+        'query': args.query, 'rows': args.count, 'sort': 'relevance', 'order': 'desc'})
+    save('crossref_works.json', json.dumps(crossref.json(), indent=1).encode('utf-8'))
+
+if __name__ == '__main__':
+    main()
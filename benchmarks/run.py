@@ -0,0 +1,321 @@
+"""Offline benchmark for the parsers, search, BM25 ranking and summarize routes.
+
+Upstream APIs and Ollama are replaced by standin.py replaying the recorded
+fixtures, so runs need no network and are repeatable. Each scenario is driven
+at the requested concurrency through Flask's test client and reports
+throughput, p50/p95/p99 latency and peak traced memory. Per-stage latencies
+come from the app's own Server-Timing spans.
+
+    python benchmarks/run.py --concurrency 8 --requests 100 --json bench.json
+    python benchmarks/run.py --baseline bench.json     # exit 1 on regression
+"""
+import argparse
+import io
+import itertools
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urlunsplit
+
+import numpy as np
+from requests.adapters import HTTPAdapter
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+FIXTURE_DIR = os.path.join(BENCH_DIR, 'fixtures')
+
+SEARCH_QUERIES = [
+    'graph neural networks protein structure prediction',
+    'transformer models single-cell RNA sequencing',
+    'federated learning electronic health records',
+    'diffusion models medical image segmentation',
+    'causal inference sepsis early warning',
+]
+VERBOSE_QUERY = (
+    "Interpretable graph neural networks and transformer models for molecular property prediction and "
+    "protein structure prediction, evaluated on benchmark datasets with calibration, ablation studies and "
+    "external validation, using self-supervised pretraining and contrastive learning."
+)
+SEARCH_SOURCES = ['pubmed', 'arxiv', 'semantic', 'crossref']
+SCENARIOS = ['parse-pubmed', 'parse-arxiv', 'parse-semantic', 'parse-crossref',
+             'search', 'search-cached', 'rank', 'rank-result-set', 'summarize']
+# Tracked metric -> True if higher is better, for --baseline comparisons.
+COMPARED = {'throughput': True, 'p95_ms': False, 'peak_mb': False}
+UNLIMITED_RATE = 1e9
+
+
+class ReplayAdapter(HTTPAdapter):
+    """Sends every upstream request to the stand-in, keeping the original host as the first path segment"""
+    target = None
+
+    def send(self, request, **kwargs):
+        url = urlsplit(request.url)
+        request.url = urlunsplit(('http', self.target, f"/{url.netloc}{url.path}", url.query, ''))
+        return super().send(request, **kwargs)
+
+
+def start_standin(upstream_latency, ollama_latency):
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(BENCH_DIR, 'standin.py'), '--port', '0',
+         '--upstream-latency', str(upstream_latency), '--ollama-latency', str(ollama_latency)],
+        stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    if not line:
+        raise RuntimeError("Stand-in server exited before it started listening")
+    return process, line.rsplit('http://', 1)[1].strip()
+
+def load_app(netloc, workdir, keep_rate_limits):
+    """Import app with its caches in workdir, Ollama and the upstreams pointed at the stand-in"""
+    os.environ['OLLAMA_HOST'] = f"http://{netloc}"
+    os.environ['SERVER_TIMING'] = '1'
+    for name, filename in (('SEARCH_CACHE_PATH', 'search_cache.sqlite3'), ('LLM_CACHE_PATH', 'llm_cache.sqlite3'),
+                           ('PAPER_INDEX_PATH', 'paper_index.sqlite3'), ('CITATION_GRAPH_PATH', 'citation_graph.sqlite3'),
+                           ('INGEST_CACHE_PATH', 'ingest_cache.sqlite3'), ('SNAPSHOT_DB_PATH', 'snapshots.sqlite3'),
+                           ('RESULT_SET_CACHE_PATH', 'result_sets.sqlite3'), ('RATE_LIMIT_DB_PATH', 'rate_limits.sqlite3'),
+                           ('VECTOR_STORE_DIR', 'vectors')):
+        os.environ[name] = os.path.join(workdir, filename)
+    import app
+    ReplayAdapter.target = netloc
+    app.HTTPAdapter = ReplayAdapter
+    if not keep_rate_limits:
+        # The published upstream rates would make every scenario measure the rate limiter.
+        for source in app.rate_limiters:
+            app.rate_limiters[source] = app.TokenBucket(UNLIMITED_RATE, UNLIMITED_RATE)
+    app.ensure_nltk_data()
+    return app
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURE_DIR, name), 'rb') as f:
+        return f.read()
+
+def parse_scenarios(app):
+    """One call per scenario parses a whole recorded response with the app's parser"""
+    pubmed_xml = read_fixture('pubmed_efetch.xml')
+    arxiv_xml = read_fixture('arxiv_query.xml')
+    semantic_json = read_fixture('semantic_search.json')
+    crossref_json = read_fixture('crossref_works.json')
+    return {
+        'parse-pubmed': lambda: list(app.iter_xml_records(io.BytesIO(pubmed_xml), 'PubmedArticle', app.parse_pubmed_article)),
+        'parse-arxiv': lambda: list(app.iter_xml_records(io.BytesIO(arxiv_xml), app.ATOM_ENTRY_TAG, app.parse_arxiv_entry)),
+        'parse-semantic': lambda: [app.parse_semantic_scholar_paper(paper) for paper in json.loads(semantic_json)['data']],
+        'parse-crossref': lambda: [app.parse_crossref_item(item) for item in json.loads(crossref_json)['message']['items']],
+    }
+
+def route_scenarios(app, args):
+    """Scenario name -> function(i) returning the (path, JSON body bytes) of request i"""
+    parsers = parse_scenarios(app)
+    corpus = [paper for name in ('parse-pubmed', 'parse-arxiv', 'parse-semantic', 'parse-crossref') for paper in parsers[name]()]
+    ranked = [dict(corpus[i % len(corpus)], id=f"{corpus[i % len(corpus)]['id']}_{i}") for i in range(args.rank_papers)]
+    rank_body = json.dumps({"papers": ranked, "verbose_query": VERBOSE_QUERY, "engine": args.engine,
+                            "semantic": args.semantic}).encode('utf-8')
+    # The same papers stored server-side, so only the id and query are posted.
+    result_set_id = app.result_store.add(ranked, query=VERBOSE_QUERY).result_set_id
+    rank_set_body = json.dumps({"result_set_id": result_set_id, "verbose_query": VERBOSE_QUERY, "engine": args.engine,
+                                "semantic": args.semantic, "top_k": 50}).encode('utf-8')
+    abstracts = [paper['abstract'] for paper in corpus if paper.get('abstract') not in app.MISSING_ABSTRACTS]
+    batches = itertools.count()
+
+    def search(i, bypass_cache=True):
+        body = {"query": SEARCH_QUERIES[i % len(SEARCH_QUERIES)], "sources": SEARCH_SOURCES,
+                "max_results": args.max_results, "bypass_cache": bypass_cache}
+        return '/api/search', json.dumps(body).encode('utf-8')
+
+    def summarize(i):
+        # A per-batch tag keeps every abstract out of the LLM cache, so each one reaches the mock model.
+        batch = next(batches)
+        papers = [{"id": f"{batch}-{j}", "abstract": f"{abstracts[(batch * args.summary_batch + j) % len(abstracts)]} [{batch}-{j}]"}
+                  for j in range(args.summary_batch)]
+        return '/api/ollama-summarize-batch', json.dumps({"papers": papers}).encode('utf-8')
+
+    return {
+        'search': search,
+        'search-cached': lambda i: search(i, bypass_cache=False),
+        'rank': lambda i: ('/api/rank-bm25', rank_body),
+        'rank-result-set': lambda i: ('/api/rank-bm25', rank_set_body),
+        'summarize': summarize,
+    }
+
+
+def parse_server_timing(header):
+    """'stage;dur=1.2, other;dur=3.4' -> [(stage, ms), ...]"""
+    timings = []
+    for entry in filter(None, (part.strip() for part in (header or '').split(','))):
+        name, _, duration = entry.partition(';dur=')
+        if duration:
+            timings.append((name, float(duration)))
+    return timings
+
+def percentiles(values):
+    if not values:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50_ms": round(float(p50), 2), "p95_ms": round(float(p95), 2), "p99_ms": round(float(p99), 2)}
+
+def drive(call, requests, concurrency):
+    """Run call(i) for i in range(requests) on concurrency threads; returns (latencies, stage timings, errors, seconds)"""
+    latencies, stages, errors = [], {}, []
+    lock = threading.Lock()
+
+    def one(i):
+        started = time.perf_counter()
+        try:
+            timings = call(i)
+            error = None
+        except Exception as e:
+            timings, error = [], str(e)
+        elapsed = (time.perf_counter() - started) * 1000
+        with lock:
+            latencies.append(elapsed)
+            if error:
+                errors.append(error)
+            for stage, ms in timings:
+                stages.setdefault(stage, []).append(ms)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    return latencies, stages, errors, time.perf_counter() - started
+
+def scenario_call(flask_app, name, parsers, routes):
+    if name in parsers:
+        parse = parsers[name]
+
+        def call(i):
+            started = time.perf_counter()
+            parse()
+            return [(name, (time.perf_counter() - started) * 1000)]
+        return call
+
+    make_request = routes[name]
+    clients = threading.local()
+
+    def call(i):
+        client = getattr(clients, 'client', None)
+        if client is None:
+            client = clients.client = flask_app.test_client()
+        path, body = make_request(i)
+        response = client.post(path, data=body, content_type='application/json')
+        response.get_data()
+        if response.status_code != 200:
+            raise RuntimeError(f"{path} returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+        return [(stage, ms) for stage, ms in parse_server_timing(response.headers.get('Server-Timing')) if stage != 'total']
+    return call
+
+def run_scenario(call, args):
+    """Timed pass, then a shorter pass under tracemalloc for peak memory (tracing skews latency)"""
+    if args.warmup:
+        drive(call, args.warmup, args.concurrency)
+    latencies, stages, errors, seconds = drive(call, args.requests, args.concurrency)
+    tracemalloc.start()
+    drive(call, args.memory_requests, args.concurrency)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    result = {
+        "requests": len(latencies), "errors": len(errors), "seconds": round(seconds, 3),
+        "throughput": round(len(latencies) / seconds, 2) if seconds else None,
+        **percentiles(latencies), "peak_mb": round(peak / 2 ** 20, 2),
+        "stages": {stage: {"count": len(values), **percentiles(values)} for stage, values in sorted(stages.items())},
+    }
+    if errors:
+        result["first_error"] = errors[0]
+    return result
+
+
+def print_report(results):
+    print(f"\n{'scenario':<16}{'reqs':>6}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'peak MB':>10}")
+    for name, result in results["scenarios"].items():
+        print(f"{name:<16}{result['requests']:>6}{result['errors']:>8}{result['throughput']:>10}"
+              f"{result['p50_ms']:>10}{result['p95_ms']:>10}{result['p99_ms']:>10}{result['peak_mb']:>10}")
+    print(f"\n{'scenario':<16}{'stage':<22}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, result in results["scenarios"].items():
+        for stage, timing in result["stages"].items():
+            print(f"{name:<16}{stage:<22}{timing['count']:>7}{timing['p50_ms']:>10}{timing['p95_ms']:>10}{timing['p99_ms']:>10}")
+    for name, result in results["scenarios"].items():
+        if result.get("first_error"):
+            print(f"\n{name}: {result['errors']} errors, first: {result['first_error']}")
+    print(f"\nProcess max RSS: {results['max_rss_mb']} MB")
+
+def compare(results, baseline, tolerance):
+    """Regressions beyond tolerance against a previous --json report"""
+    regressions = []
+    for name, result in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous:
+            continue
+        for metric, higher_is_better in COMPARED.items():
+            old, new = previous.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (change < -tolerance) if higher_is_better else (change > tolerance):
+                regressions.append(f"{name} {metric}: {old} -> {new} ({change:+.0%})")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"comma-separated subset of: {', '.join(SCENARIOS)}")
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=50, help="timed requests per scenario")
+    parser.add_argument('--warmup', type=int, default=5, help="untimed requests per scenario")
+    parser.add_argument('--memory-requests', type=int, default=10, help="requests in the tracemalloc pass")
+    parser.add_argument('--max-results', type=int, default=50, help="max_results per source for search")
+    parser.add_argument('--rank-papers', type=int, default=1000, help="papers per BM25 request")
+    parser.add_argument('--engine', default='sparse', help="BM25 engine for the rank scenario")
+    parser.add_argument('--semantic', action='store_true', help="add embedding rerank to the rank scenario")
+    parser.add_argument('--summary-batch', type=int, default=10, help="abstracts per summarize request")
+    parser.add_argument('--upstream-latency', type=float, default=0.05, help="seconds the stand-in adds to each upstream response")
+    parser.add_argument('--ollama-latency', type=float, default=0.1, help="seconds the stand-in adds to each Ollama response")
+    parser.add_argument('--keep-rate-limits', action='store_true', help="keep the per-source upstream rate limits")
+    parser.add_argument('--json', help="write the report to this file")
+    parser.add_argument('--baseline', help="previous --json report to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed relative regression before failing")
+    parser.add_argument('--verbose', action='store_true', help="keep the app's INFO logging")
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(unknown)}")
+
+    standin, netloc = start_standin(args.upstream_latency, args.ollama_latency)
+    try:
+        with tempfile.TemporaryDirectory(prefix='scholar-bench-') as workdir:
+            app = load_app(netloc, workdir, args.keep_rate_limits)
+            if not args.verbose:
+                logging.getLogger().setLevel(logging.WARNING)
+            flask_app = app.create_app(start_background=False)
+            parsers, routes = parse_scenarios(app), route_scenarios(app, args)
+            results = {"config": {key: value for key, value in vars(args).items() if key not in ('json', 'baseline')},
+                       "scenarios": {}}
+            for name in names:
+                print(f"Running {name}...", file=sys.stderr)
+                results["scenarios"][name] = run_scenario(scenario_call(flask_app, name, parsers, routes), args)
+            results["max_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+            app.index_executor.shutdown(wait=True)
+    finally:
+        standin.terminate()
+        standin.wait()
+
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print(f"\nNo regressions beyond {args.tolerance:.0%} of {args.baseline}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+"""Local stand-in for the upstream APIs and Ollama, replaying recorded fixtures.
+
+Upstream requests arrive with the original host as the first path segment
+(http://127.0.0.1:PORT/api.crossref.org/works?...), which is how run.py's
+ReplayAdapter rewrites them. Paging parameters are honoured, so max_results,
+offsets and cursors behave as they do against the real services. run.py
+starts this server in a subprocess so it shares neither the GIL nor the
+traced heap with the app being measured.
+
+/api/chat and /api/embed answer like an Ollama host, so the app can reach it
+through OLLAMA_HOST without a model installed.
+
+Run on its own with: python benchmarks/standin.py --port 8765
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+EMBEDDING_DIMENSIONS = 256
+
+
+class XMLFixture:
+    """An XML response split into header, records and footer so slices can be served verbatim"""
+
+    def __init__(self, path, record_tag, id_pattern=None):
+        with open(path, encoding='utf-8') as f:
+            text = f.read()
+        pattern = re.compile(rf'[ \t]*<{record_tag}>.*?</{record_tag}>\s*', re.DOTALL)
+        matches = list(pattern.finditer(text))
+        self.records = [match.group(0) for match in matches]
+        self.header = text[:matches[0].start()]
+        self.footer = text[matches[-1].end():]
+        self.ids = [re.search(id_pattern, record).group(1) for record in self.records] if id_pattern else []
+
+    def render(self, records):
+        return (self.header + ''.join(records) + self.footer).encode('utf-8')
+
+
+class Fixtures:
+    def __init__(self, directory=FIXTURE_DIR):
+        def load_json(name):
+            with open(os.path.join(directory, name), encoding='utf-8') as f:
+                return json.load(f)
+        self.pubmed_esearch = load_json('pubmed_esearch.json')
+        self.pubmed_efetch = XMLFixture(os.path.join(directory, 'pubmed_efetch.xml'), 'PubmedArticle', r'<PMID[^>]*>(\d+)</PMID>')
+        self.arxiv = XMLFixture(os.path.join(directory, 'arxiv_query.xml'), 'entry')
+        self.semantic = load_json('semantic_search.json')
+        self.crossref = load_json('crossref_works.json')
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch()
+
+    def do_POST(self):
+        self.dispatch()
+
+    def dispatch(self):
+        url = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.headers.get('Content-Type', '').startswith('application/x-www-form-urlencoded'):
+            params.update({key: values[-1] for key, values in parse_qs(body.decode('utf-8')).items()})
+        route = ROUTES.get((self.command, url.path))
+        if route is None:
+            self.reply(404, b'{"error": "no fixture for this route"}', 'application/json')
+            return
+        status, payload, content_type = route(self.server, params, body)
+        self.reply(status, payload, content_type)
+
+    def reply(self, status, payload, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def page(params, start_key, size_key, default_size, total):
+    start = int(params.get(start_key) or 0)
+    return start, min(start + int(params.get(size_key) or default_size), total)
+
+def pubmed_esearch(server, params, body):
+    server.upstream_delay()
+    result = dict(server.fixtures.pubmed_esearch)
+    ids = server.fixtures.pubmed_efetch.ids
+    result['esearchresult'] = dict(result['esearchresult'], idlist=ids[:int(params.get('retmax') or 20)])
+    return 200, json.dumps(result).encode('utf-8'), 'application/json'
+
+def pubmed_efetch(server, params, body):
+    server.upstream_delay()
+    fixture = server.fixtures.pubmed_efetch
+    if params.get('id'):
+        wanted = set(params['id'].split(','))
+        records = [record for record, pmid in zip(fixture.records, fixture.ids) if pmid in wanted]
+    else:
+        start, end = page(params, 'retstart', 'retmax', 20, len(fixture.records))
+        records = fixture.records[start:end]
+    return 200, fixture.render(records), 'text/xml'
+
+def arxiv_query(server, params, body):
+    server.upstream_delay()
+    fixture = server.fixtures.arxiv
+    start, end = page(params, 'start', 'max_results', 10, len(fixture.records))
+    return 200, fixture.render(fixture.records[start:end]), 'application/atom+xml'
+
+def semantic_search(server, params, body):
+    server.upstream_delay()
+    data = server.fixtures.semantic['data']
+    start, end = page(params, 'offset', 'limit', 10, len(data))
+    result = dict(server.fixtures.semantic, offset=start, data=data[start:end])
+    if end < len(data):
+        result['next'] = end
+    else:
+        result.pop('next', None)
+    return 200, json.dumps(result).encode('utf-8'), 'application/json'
+
+def crossref_works(server, params, body):
+    server.upstream_delay()
+    message = server.fixtures.crossref['message']
+    items = message['items']
+    # The cursor is the offset of the next page, as opaque to the app as CrossRef's own.
+    cursor = params.get('cursor')
+    start = int(cursor) if cursor and cursor.isdigit() else 0
+    end = min(start + int(params.get('rows') or 20), len(items))
+    result = dict(server.fixtures.crossref, message=dict(message, items=items[start:end], **{'next-cursor': str(end)}))
+    return 200, json.dumps(result).encode('utf-8'), 'application/json'
+
+def ollama_chat(server, params, body):
+    server.ollama_delay()
+    request = json.loads(body or b'{}')
+    prompt = request.get('messages', [{}])[-1].get('content', '')
+    if request.get('format') == 'json':
+        words = re.findall(r'[a-z]{4,}', prompt.lower())[:40]
+        content = json.dumps({"queries": [' '.join(words[:3]), ' '.join(words[3:6])], "verbose_query": ' '.join(words)})
+    else:
+        # Echo the opening of the quoted abstract, roughly the length of a real summary.
+        quoted = prompt.split('"')[1] if prompt.count('"') >= 2 else prompt
+        content = ' '.join(quoted.split()[:40])
+    result = {"model": request.get('model'), "created_at": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+              "message": {"role": "assistant", "content": content}, "done": True, "done_reason": "stop"}
+    return 200, json.dumps(result).encode('utf-8'), 'application/json'
+
+def ollama_embed(server, params, body):
+    server.ollama_delay()
+    request = json.loads(body or b'{}')
+    texts = request.get('input') or []
+    if isinstance(texts, str):
+        texts = [texts]
+    # Seed from the text so a paper embeds to the same vector on every call.
+    vectors = [np.random.default_rng(int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'big'))
+               .standard_normal(EMBEDDING_DIMENSIONS).round(5).tolist() for text in texts]
+    return 200, json.dumps({"model": request.get('model'), "embeddings": vectors}).encode('utf-8'), 'application/json'
+
+ROUTES = {
+    ('GET', '/eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi'): pubmed_esearch,
+    ('POST', '/eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi'): pubmed_efetch,
+    ('GET', '/export.arxiv.org/api/query'): arxiv_query,
+    ('GET', '/api.semanticscholar.org/graph/v1/paper/search'): semantic_search,
+    ('GET', '/api.crossref.org/works'): crossref_works,
+    ('POST', '/api/chat'): ollama_chat,
+    ('POST', '/api/embed'): ollama_embed,
+}
+
+
+class StandinServer(ThreadingHTTPServer):
+    """Threaded fixture server with fixed per-response latency for the upstreams and for Ollama"""
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, upstream_latency=0.0, ollama_latency=0.0, fixtures=None):
+        super().__init__((host, port), StandinHandler)
+        self.fixtures = fixtures or Fixtures()
+        self.upstream_latency = upstream_latency
+        self.ollama_latency = ollama_latency
+
+    @property
+    def netloc(self):
+        host, port = self.server_address[:2]
+        return f"{host}:{port}"
+
+    def upstream_delay(self):
+        if self.upstream_latency:
+            time.sleep(self.upstream_latency)
+
+    def ollama_delay(self):
+        if self.ollama_latency:
+            time.sleep(self.ollama_latency)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765, help="0 picks a free port")
+    parser.add_argument('--upstream-latency', type=float, default=0.0, help="seconds added to every upstream response")
+    parser.add_argument('--ollama-latency', type=float, default=0.0, help="seconds added to every Ollama response")
+    args = parser.parse_args()
+    server = StandinServer(args.host, args.port, args.upstream_latency, args.ollama_latency)
+    # run.py reads the address from this line.
+    print(f"Serving fixtures from {FIXTURE_DIR} on http://{server.netloc}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,22 @@
+"""Gunicorn settings for serving the API in production: gunicorn -c gunicorn.conf.py wsgi:app"""
+import os
+
+bind = os.environ.get('BIND', f"0.0.0.0:{os.environ.get('PORT', 5001)}")
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+# Handlers mostly wait on upstream APIs and Ollama, so each worker serves many
+# requests on threads; slow Scholar or deep-retrieval streams only occupy a thread.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+# gthread workers heartbeat independently of requests, so long SSE streams are not killed by this.
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+# Each worker imports the app itself so start-up work and background threads
+# (proxy checks, snapshot scheduler) run once per worker, after the fork.
+preload_app = False
+accesslog = '-'
+errorlog = '-'
+
+def worker_exit(server, worker):
+    from app import shutdown_runtime
+    shutdown_runtime()
@@ -0,0 +1,38 @@
+"""Text extraction run in the ingest process pool.
+
+Pool workers are spawned, so each one imports the module its tasks live in.
+Keeping the tasks here means a worker loads only pypdf, Pillow and pytesseract
+instead of the whole app with its caches, indexes and background threads.
+"""
+import io
+
+import pypdf
+import pytesseract
+from PIL import Image
+
+# Pages with less text than this are treated as scanned and OCR'd from their embedded images.
+SCANNED_PAGE_MIN_CHARS = 20
+
+def ocr_image_bytes(data):
+    with Image.open(io.BytesIO(data)) as image:
+        return pytesseract.image_to_string(image)
+
+def extract_pdf_pages(path, start, count):
+    """Extract text from pages [start, start + count) of a PDF"""
+    reader = pypdf.PdfReader(path)
+    texts = []
+    for page in reader.pages[start:start + count]:
+        text = page.extract_text() or ''
+        if len(text.strip()) < SCANNED_PAGE_MIN_CHARS:
+            try:
+                ocr_text = '\n'.join(ocr_image_bytes(image.data) for image in page.images)
+            except Exception:
+                ocr_text = ''
+            text = ocr_text if ocr_text.strip() else text
+        texts.append(text)
+    return texts
+
+def extract_image_text(path):
+    """OCR one image file"""
+    with open(path, 'rb') as f:
+        return ocr_image_bytes(f.read())
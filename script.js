@@ -24,9 +24,11 @@
         };
 
         const BACKEND_URL = ''; // Empty string for relative URLs (same origin as frontend)
+        const RESULT_SET_PAGE_LIMIT = 500; // Papers rendered from one search's result set
 
         let uploadedFilesData = []; // Stores { name: string, text: string }
         let currentSearchResults = [];
+        let currentResultSetId = null; // Server-side result set behind currentSearchResults, used for export
         let currentSortCriteria = 'relevance';
         let tesseractWorker = null;
 
@@ -70,6 +72,7 @@
             exportJsonBtn: document.getElementById('exportJsonBtn'),
             exportCsvBtn: document.getElementById('exportCsvBtn'),
             exportBibtexBtn: document.getElementById('exportBibtexBtn'),
+            exportRisBtn: document.getElementById('exportRisBtn'),
             exportPdfBtn: document.getElementById('exportPdfBtn'),
 
             themeToggleBtn: document.getElementById('themeToggle'),
@@ -154,6 +157,7 @@
             DOMElements.exportJsonBtn.addEventListener('click', () => exportResults('json'));
             DOMElements.exportCsvBtn.addEventListener('click', () => exportResults('csv'));
             DOMElements.exportBibtexBtn.addEventListener('click', () => exportResults('bibtex'));
+            DOMElements.exportRisBtn.addEventListener('click', () => exportResults('ris'));
             DOMElements.exportPdfBtn.addEventListener('click', () => exportResults('pdf'));
 
             DOMElements.themeToggleBtn.addEventListener('click', toggleTheme);
@@ -195,11 +199,33 @@
             if (!files.length) return;
             setLoading(true, "Processing files...");
 
+            const newFiles = [];
             for (const file of files) {
                 if (uploadedFilesData.find(f => f.name === file.name)) {
                     showMessage('info', `File ${file.name} already uploaded.`);
                     continue;
                 }
+                newFiles.push(file);
+            }
+
+            // Extract on the server (parallel pages, cached by file hash); fall back to the browser if it is unreachable.
+            let serverDocuments = null;
+            if (newFiles.length) {
+                try {
+                    serverDocuments = await ingestFilesOnServer(newFiles);
+                } catch (error) {
+                    console.warn("Server-side ingestion failed, extracting in the browser:", error);
+                }
+            }
+
+            for (const [index, file] of newFiles.entries()) {
+                const ingested = serverDocuments ? serverDocuments[index] : null;
+                if (ingested && !ingested.error) {
+                    uploadedFilesData.push({ name: file.name, text: ingested.text });
+                    renderUploadedFiles();
+                    showMessage('success', `Processed: ${file.name}${ingested.cached ? ' (cached)' : ''}`);
+                    continue;
+                }
                 let text = '';
                 try {
                     if (file.type === "application/pdf") {
@@ -228,6 +254,52 @@
             setLoading(false);
         }
 
+        async function ingestFilesOnServer(files) {
+            const formData = new FormData();
+            files.forEach(file => formData.append('files', file));
+            const response = await fetch(`${BACKEND_URL}/api/ingest`, { method: 'POST', body: formData });
+            if (!response.ok) {
+                throw new Error(`Ingest API Error (${response.status})`);
+            }
+            const data = await response.json();
+            return data.documents;
+        }
+
+        // Exports are formatted by the server (/api/export) and downloaded as a file.
+        async function exportResults(format) {
+            if (!currentSearchResults.length || !currentResultSetId) {
+                showMessage('info', 'There are no results to export yet.');
+                return;
+            }
+            if (format === 'pdf') {
+                window.print();
+                return;
+            }
+            const serverFormat = format === 'json' ? 'jsonl' : format;
+            try {
+                const response = await fetch(`${BACKEND_URL}/api/export`, {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ result_set_id: currentResultSetId, format: serverFormat })
+                });
+                if (!response.ok) {
+                    throw new Error(`Export API Error (${response.status})`);
+                }
+                const blob = await response.blob();
+                const filename = /filename="([^"]+)"/.exec(response.headers.get('Content-Disposition') || '');
+                const link = document.createElement('a');
+                link.href = URL.createObjectURL(blob);
+                link.download = filename ? filename[1] : `papers.${serverFormat}`;
+                document.body.appendChild(link);
+                link.click();
+                link.remove();
+                URL.revokeObjectURL(link.href);
+            } catch (error) {
+                console.error('Export failed:', error);
+                showMessage('error', `Export failed: ${error.message}`);
+            }
+        }
+
         async function extractTextFromPdf(file) {
             const arrayBuffer = await file.arrayBuffer();
             const pdf = await pdfjsLib.getDocument({ data: arrayBuffer }).promise;
@@ -265,216 +337,281 @@
             });
         }
 
-// --- LLM Query Generation (Modified to use Ollama backend) ---
-async function generateLLMQueries(mainTopic, notes, fileTextContent) {
-    const model = 'gemma:3b'; // User specified model
-    // No API Key needed for local Ollama via backend
-
-    let context = `User's main topic/question: "${mainTopic}"\n`;
-    if (notes) context += `Additional notes/context from user: "${notes}"\n`;
-    if (fileTextContent) context += `Key content extracted from uploaded documents (e.g., lecture notes, paper excerpts, book pages):\n---\n${fileTextContent.substring(0, 4000)}\n---\n`;
 
-    const subject = DOMElements.subjectSelect.value;
-    const paperType = DOMElements.paperTypeSelect.value;
-    
-    let subjectHint = "";
-    if (subject && subject !== 'all') {
-        subjectHint = `The user is particularly interested in the academic subject area of: ${subject}. `;
-        if (subject.toLowerCase().includes('math')) {
-            subjectHint += `For ArXiv, relevant categories might be 'math.XX' (e.g., 'math.NT' for Number Theory, 'math.CO' for Combinatorics), 'stat.TH' (Statistics Theory), etc. Queries can use 'cat:math.XX AND (term OR term)'. `;
-        } else if (subject.toLowerCase().includes('cs') || subject.toLowerCase().includes('computer science')) {
-             subjectHint += `For ArXiv, relevant categories might be 'cs.XX' (e.g., 'cs.AI' for AI, 'cs.LG' for Machine Learning). `;
+// --- Local Keyphrase Query Builder (no LLM round trip) ---
+// Returns { queries, verbose_query, source_queries, keyphrases } or null on failure.
+async function buildLocalQueryPlan(mainTopic, notes, fileTextContent) {
+    try {
+        const response = await fetch(`${BACKEND_URL}/api/build-query`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ topic: mainTopic, notes: notes, file_text: fileTextContent })
+        });
+        if (!response.ok) {
+            const errorData = await response.json();
+            throw new Error(`Query Builder API Error (${response.status}): ${errorData.error || response.statusText}`);
         }
+        return await response.json();
+    } catch (error) {
+        console.error("Error building local queries:", error);
+        return null;
     }
-    let paperTypeHint = "";
-    if (paperType && paperType !== 'all') {
-        paperTypeHint = `The user is looking for papers that are primarily of type: ${paperType}. `;
-    }
+}
+
 
-    const prompt = `
-You are an expert research assistant. Your task is to generate highly effective search queries for academic databases like ArXiv and Google Scholar, based on the user's input.
-The user's input might include a main topic, additional notes, and text extracted from documents (like lecture notes, research papers, or book pages).
-
-User-provided information:
-${context}
-
-Specific interests:
-${subjectHint}
-${paperTypeHint}
-
-Instructions:
-1.  Analyze all the provided information to understand the core research area, key concepts, specific problems, relevant mathematical formalisms or algorithms (if any), and potentially important authors or seminal works mentioned.
-2.  Generate 3-5 DIVERSE and PRECISE search queries. These queries should be what an expert researcher would type into a search bar.
-3.  For ArXiv:
-    *   Utilize field codes where appropriate (e.g., 'ti:(title terms)', 'au:(author name)', 'abs:(abstract terms)', 'cat:(category e.g., math.NT or cs.AI)').
-    *   Combine terms using boolean operators (AND, OR, NOT). Example: "cat:math.PR AND ti:(stochastic processes) AND (markov chains OR random walks)"
-4.  For Google Scholar (and general academic search):
-    *   Use boolean operators (AND, OR, NOT).
-    *   Use exact phrases with double quotes (e.g., "deep learning for theorem proving").
-    *   Consider using operators like 'author:"J Doe"' or 'source:"Nature"'.
-5.  If the input text is complex (e.g., from a research paper), try to extract specific terminology, method names, or unique phrases that would be good search terms.
-6.  Focus on precision. Avoid overly broad queries.
-7.  The queries should be optimized for mathematical papers if the context or subject strongly suggests it.
-
-Output Format:
-Return ONLY a JSON array of strings, where each string is a distinct search query. Do not include any other text or explanations.
-Example: ["ti:(quantum field theory) AND cat:hep-th", "gravitational waves ligo virgo", "author:\\"Witten E\\" string theory"]
-`;
+
+// --- Combined Query Plan (one Ollama round trip for both query kinds) ---
+// Returns { queries: [...], verboseQuery: "...", sourceQueries: {...} } or null on failure, and sets
+// currentVerboseBM25Query.
+async function generateQueryPlan(mainTopic, notes, fileTextContent) {
+    const model = 'gemma:3b'; // User specified model
 
     setLoading(true, "Generating AI search queries...");
     try {
-        const response = await fetch(`${BACKEND_URL}/api/ollama-refine-query`, {
+        const response = await fetch(`${BACKEND_URL}/api/ollama-query-plan`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({
-                query: prompt, // Send the full prompt to the backend
+                topic: mainTopic,
+                notes: notes,
+                file_text: fileTextContent,
+                subject: DOMElements.subjectSelect.value,
+                paper_type: DOMElements.paperTypeSelect.value,
                 model: model
             })
         });
 
         if (!response.ok) {
             const errorData = await response.json();
-            throw new Error(`Ollama Query Refinement API Error (${response.status}): ${errorData.error || response.statusText}`);
+            throw new Error(`Ollama Query Plan API Error (${response.status}): ${errorData.error || response.statusText}`);
         }
 
         const data = await response.json();
-        const refinedQuery = data.refined_query; // This is expected to be the JSON string of queries
-
-        if (refinedQuery) {
-            try {
-                let queries = JSON.parse(refinedQuery);
-                if (Array.isArray(queries) && queries.every(q => typeof q === 'string')) {
-                    showMessage('success', 'AI search queries generated.');
-                    return queries;
-                }
-            } catch (e) {
-                console.warn("Ollama response was not perfect JSON, attempting regex extraction:", e);
-                const queryRegex = /"([^"]+)"/g;
-                let matches;
-                const extractedQueries = [];
-                while ((matches = queryRegex.exec(refinedQuery)) !== null) {
-                    if (matches[1].trim().length > 3) {
-                       extractedQueries.push(matches[1].trim());
-                    }
-                }
-                if (extractedQueries.length > 0) {
-                    showMessage('success', `AI queries generated (extracted ${extractedQueries.length}).`);
-                    return extractedQueries;
-                }
-            }
+        if (data.generator === 'local') {
+            showMessage('info', 'AI unavailable; search queries built from keyphrases instead.');
+        } else {
+            showMessage('success', `AI search queries generated${data.cached ? ' (cached)' : ''}.`);
         }
-        throw new Error("Ollama did not return valid queries.");
-
+        currentVerboseBM25Query = data.verbose_query;
+        // source_queries is only present when the backend fell back to the keyphrase planner.
+        return { queries: data.queries, verboseQuery: data.verbose_query, sourceQueries: data.source_queries };
     } catch (error) {
-        console.error("Error generating LLM queries:", error);
+        console.error("Error generating query plan:", error);
         showMessage('error', `Failed to generate AI queries: ${error.message}`);
-        return [];
+        currentVerboseBM25Query = "";
+        return null;
     } finally {
         setLoading(false);
     }
 }
 
 
-// --- LLM Verbose Query Generation for BM25 (Modified to use Ollama backend) ---
-async function generateBM25VerboseQuery(mainTopic, notes, fileTextContent) {
-    const model = 'gemma:3b'; // User specified model
-    // No API Key needed for local Ollama via backend
-
-    let context = `User's main topic/question: "${mainTopic}"\n`;
-    if (notes) context += `Additional notes/context from user: "${notes}"\n`;
-    if (fileTextContent) context += `Key content extracted from uploaded documents:\n---\n${fileTextContent.substring(0, 5000)}\n---\n`;
-
-    const subject = DOMElements.subjectSelect.value;
-    let subjectHint = subject && subject !== 'all' ? `The user's primary subject focus is: ${subject}. ` : "";
-
-    const prompt = `
-You are an expert research analyst. Your task is to generate a **single, detailed, verbose paragraph**. This paragraph should synthesize all the provided user input (topic, notes, document excerpts) into a rich description of the ideal research paper or information the user is seeking.
 
-User-provided information:
-${context}
-${subjectHint}
-
-Instructions:
-1.  Read and understand all the provided context.
-2.  DO NOT generate search queries.
-3.  Instead, write a coherent paragraph (around 100-250 words) that elaborates on the key concepts, research questions, methodologies, specific terminology, and desired outcomes or information.
-4.  This paragraph will be used by a BM25 relevance scoring algorithm to compare against the abstracts of retrieved papers. Therefore, it should be rich in relevant keywords, phrases, and conceptual descriptions.
-5.  If the input mentions mathematical concepts, try to incorporate them descriptively.
-6.  The paragraph should sound like a human describing their precise research interest in detail.
-
-Output:
-Return ONLY the single descriptive paragraph as a plain text string. Do not include any other text, titles, or formatting.
-`;
+// --- Batch Abstract Summarization ---
+// Returns a map of paper id -> summary. Papers whose summary failed are left out
+// so callers fall back to the original abstract.
+async function summarizeAbstractsBatch(papers) {
+    const model = 'gemma:3b'; // User specified model
+    if (!papers.length) return {};
 
-    setLoading(true, "Generating AI verbose query for BM25...");
+    setLoading(true, `Summarizing ${papers.length} abstracts with AI...`);
     try {
-        const response = await fetch(`${BACKEND_URL}/api/ollama-refine-query`, { // Reusing refine-query endpoint for simplicity, but prompt is different
+        const response = await fetch(`${BACKEND_URL}/api/ollama-summarize-batch`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({
-                query: prompt, // Send the full prompt
+                papers: papers.map(paper => ({ id: paper.id, abstract: paper.abstract })),
                 model: model
             })
         });
 
         if (!response.ok) {
             const errorData = await response.json();
-            throw new Error(`Ollama BM25 Query Generation API Error (${response.status}): ${errorData.error || response.statusText}`);
+            throw new Error(`Ollama Batch Summarization API Error (${response.status}): ${errorData.error || response.statusText}`);
         }
+
         const data = await response.json();
-        const verboseQuery = data.refined_query; // Expecting the paragraph here
-        if (verboseQuery) {
-            showMessage('success', 'AI verbose query for BM25 generated.');
-            currentVerboseBM25Query = verboseQuery;
-            return verboseQuery;
+        const failed = Object.keys(data.errors || {}).length;
+        if (failed) {
+            showMessage('error', `Failed to summarize ${failed} abstract(s); showing originals.`);
+        } else {
+            showMessage('success', 'Abstracts summarized by AI.');
         }
-        throw new Error("Ollama did not return a valid verbose query.");
+        return data.summaries || {};
     } catch (error) {
-        console.error("Error generating BM25 verbose query:", error);
-        showMessage('error', `Failed to generate AI verbose query for BM25: ${error.message}`);
-        currentVerboseBM25Query = "";
-        return null;
+        console.error("Error summarizing abstracts:", error);
+        showMessage('error', `Failed to summarize abstracts: ${error.message}`);
+        return {};
     } finally {
         setLoading(false);
     }
 }
 
 
-// --- Abstract Summarization (New Function) ---
-async function summarizeAbstractWithOllama(abstract) {
-    const model = 'gemma:3b'; // User specified model
-    if (!abstract) return "No abstract to summarize.";
+// --- Streaming Search (Server-Sent Events from /api/search-stream) ---
+// Calls onSource(event) as each database finishes so results can be shown
+// incrementally, and resolves with the final BM25-ranked merge.
+async function streamSearch({ query, sources, maxResults, filters, verboseQuery, sourceQueries }, onSource) {
+    const response = await fetch(`${BACKEND_URL}/api/search-stream`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+            query: query,
+            sources: sources,
+            max_results: maxResults,
+            filters: filters,
+            verbose_query: verboseQuery,
+            source_queries: sourceQueries
+        })
+    });
 
-    setLoading(true, "Summarizing abstract with AI...");
-    try {
-        const response = await fetch(`${BACKEND_URL}/api/ollama-summarize-abstract`, {
+    if (!response.ok) {
+        const errorData = await response.json();
+        throw new Error(`Streaming Search API Error (${response.status}): ${errorData.error || response.statusText}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let finalResult = null;
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const rawEvent = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            let eventName = 'message';
+            let dataLines = [];
+            rawEvent.split('\n').forEach(line => {
+                if (line.startsWith('event: ')) eventName = line.slice(7);
+                else if (line.startsWith('data: ')) dataLines.push(line.slice(6));
+            });
+            const payload = JSON.parse(dataLines.join('\n'));
+            if (eventName === 'source') {
+                if (onSource) onSource(payload);
+            } else if (eventName === 'done') {
+                finalResult = payload;
+            }
+        }
+    }
+    return finalResult;
+}
+
+
+// --- Search Orchestration ---
+// Builds the search queries (one AI query plan when enabled, the local keyphrase
+// plan otherwise), streams each one through /api/search-stream so databases
+// report as they finish, and renders the merged, BM25-ranked results.
+function collectSearchFilters() {
+    const yearRange = DOMElements.yearRangeSelect.value;
+    const [yearStart, yearEnd = yearStart] = yearRange === 'all' ? [] : yearRange.split('-');
+    return {
+        yearStart: yearStart || '',
+        yearEnd: yearEnd || '',
+        subject: DOMElements.subjectSelect.value,
+        paperType: DOMElements.paperTypeSelect.value
+    };
+}
+
+function renderQueryTags(queries) {
+    DOMElements.queryTagsContainer.innerHTML = '';
+    queries.forEach(query => {
+        const tag = document.createElement('span');
+        tag.className = 'query-tag';
+        tag.textContent = query;
+        DOMElements.queryTagsContainer.appendChild(tag);
+    });
+    DOMElements.generatedQueriesContainer.style.display = queries.length ? 'block' : 'none';
+}
+
+// Each streamed query leaves a ranked result set on the server. Several are
+// merged there (every query is ranked against the same verbose query, so their
+// scores are comparable) and the ranked papers are fetched once by id.
+async function loadRankedResultSet(resultSetIds, query) {
+    let resultSetId = resultSetIds[0];
+    if (resultSetIds.length > 1) {
+        const response = await fetch(`${BACKEND_URL}/api/result-sets`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({
-                abstract: abstract,
-                model: model
-            })
+            body: JSON.stringify({ result_set_ids: resultSetIds, query: query })
         });
-
         if (!response.ok) {
             const errorData = await response.json();
-            throw new Error(`Ollama Abstract Summarization API Error (${response.status}): ${errorData.error || response.statusText}`);
+            throw new Error(`Result Set API Error (${response.status}): ${errorData.error || response.statusText}`);
         }
+        resultSetId = (await response.json()).result_set_id;
+    }
+    if (!resultSetId) return { result_set_id: null, papers: [] };
+    const response = await fetch(`${BACKEND_URL}/api/result-sets/${resultSetId}?limit=${RESULT_SET_PAGE_LIMIT}`);
+    if (!response.ok) {
+        const errorData = await response.json();
+        throw new Error(`Result Set API Error (${response.status}): ${errorData.error || response.statusText}`);
+    }
+    return await response.json();
+}
 
-        const data = await response.json();
-        const summary = data.summary;
-        if (summary) {
-            showMessage('success', 'Abstract summarized by AI.');
-            return summary;
-        }
-        throw new Error("Ollama did not return a valid summary.");
+async function handleSearch() {
+    const mainTopic = DOMElements.searchInput.value.trim();
+    if (!mainTopic) {
+        showMessage('info', 'Enter a research topic to search.');
+        return;
+    }
+    const sources = Array.from(DOMElements.databaseCheckboxes).filter(checkbox => checkbox.checked).map(checkbox => checkbox.value);
+    if (!sources.length) {
+        showMessage('info', 'Select at least one database.');
+        return;
+    }
+    const notes = DOMElements.notesTextarea.value.trim();
+    const fileTextContent = uploadedFilesData.map(file => file.text).join('\n\n');
+
+    let queries = [mainTopic];
+    let verboseQuery = mainTopic;
+    let sourceQueries = null;
+    let plan = null;
+    if (DOMElements.aiSearchToggle.checked) {
+        // One Ollama call returns both the database queries and the BM25 verbose query.
+        plan = await generateQueryPlan(mainTopic, notes, fileTextContent);
+    } else if (notes || fileTextContent) {
+        const localPlan = await buildLocalQueryPlan(mainTopic, notes, fileTextContent);
+        if (localPlan) plan = { queries: localPlan.queries, verboseQuery: localPlan.verbose_query, sourceQueries: localPlan.source_queries };
+    }
+    if (plan && plan.queries && plan.queries.length) queries = plan.queries;
+    if (plan && plan.verboseQuery) verboseQuery = plan.verboseQuery;
+    if (plan && plan.sourceQueries && Object.keys(plan.sourceQueries).length) sourceQueries = plan.sourceQueries;
+    renderQueryTags(queries);
+
+    const filters = collectSearchFilters();
+    const maxResults = parseInt(DOMElements.maxResultsSelect.value, 10);
+    const finished = [];
+    setLoading(true, 'Searching databases...');
+    try {
+        // The topic query goes out in each database's own syntax (PubMed field tags,
+        // arXiv all: terms) when the plan has one; the broader queries stay plain.
+        const results = await Promise.all(queries.map((query, i) => streamSearch(
+            { query, sources, maxResults, filters, verboseQuery, sourceQueries: i === 0 ? sourceQueries : null },
+            event => {
+                finished.push(`${event.source} (${event.status})`);
+                DOMElements.loadingText.textContent = `Searching databases... done: ${finished.join(', ')}`;
+            }
+        )));
+        const resultSet = await loadRankedResultSet(results.filter(Boolean).map(result => result.result_set_id), mainTopic);
+        currentResultSetId = resultSet.result_set_id;
+        currentSearchResults = resultSet.papers;
     } catch (error) {
-        console.error("Error summarizing abstract:", error);
-        showMessage('error', `Failed to summarize abstract: ${error.message}`);
-        return abstract.substring(0, 300) + (abstract.length > 300 ? '...' : ''); // Fallback to truncated original
+        console.error('Search failed:', error);
+        showMessage('error', `Search failed: ${error.message}`);
+        return;
     } finally {
         setLoading(false);
     }
+
+    showMessage('success', `Found ${currentSearchResults.length} papers.`);
+    DOMElements.resultsHeaderContainer.style.display = '';
+    DOMElements.exportSectionContainer.style.display = '';
+    await renderResults(currentSearchResults);
 }
 
 
@@ -487,14 +624,9 @@ async function renderResults(results) {
          return;
     }
 
-    // Process abstracts with Ollama for summarization
-    const papersWithSummaries = await Promise.all(results.map(async paper => {
-        if (paper.abstract && paper.abstract.length > 50) { // Only summarize if abstract exists and is reasonably long
-            const summary = await summarizeAbstractWithOllama(paper.abstract);
-            return { ...paper, aiSummary: summary };
-        }
-        return { ...paper, aiSummary: paper.abstract }; // Use original abstract if no summary generated
-    }));
+    // Summarize all abstracts in one batch request; the backend caches and bounds Ollama calls
+    const summaries = await summarizeAbstractsBatch(results.filter(paper => paper.abstract && paper.abstract.length > 50)); // Only summarize reasonably long abstracts
+    const papersWithSummaries = results.map(paper => ({ ...paper, aiSummary: summaries[paper.id] || paper.abstract })); // Use original abstract if no summary generated
 
     DOMElements.resultsContainer.innerHTML = papersWithSummaries.map(paper => `
         <div class="paper-card">
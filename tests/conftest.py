@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+# app opens its caches at import time; keep them out of the working tree.
+CACHE_DIR = tempfile.mkdtemp(prefix='paper-search-tests-')
+for name, filename in (('SEARCH_CACHE_PATH', 'search_cache.sqlite3'), ('LLM_CACHE_PATH', 'llm_cache.sqlite3'),
+                       ('PAPER_INDEX_PATH', 'paper_index.sqlite3'), ('CITATION_GRAPH_PATH', 'citation_graph.sqlite3'),
+                       ('INGEST_CACHE_PATH', 'ingest_cache.sqlite3'), ('SNAPSHOT_DB_PATH', 'snapshots.sqlite3'),
+                       ('RESULT_SET_CACHE_PATH', 'result_sets.sqlite3'), ('RATE_LIMIT_DB_PATH', 'rate_limits.sqlite3'), ('VECTOR_STORE_DIR', 'vectors')):
+    os.environ.setdefault(name, os.path.join(CACHE_DIR, filename))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
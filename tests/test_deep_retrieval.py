@@ -0,0 +1,24 @@
+import threading
+import time
+
+import app
+
+
+def test_pages_in_flight_are_capped_and_stop_at_a_short_page():
+    lock = threading.Lock()
+    running, peak, fetched = [0], [0], []
+
+    def fetch_page(offset, size):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+            fetched.append(offset)
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+        return [{"id": offset}] * (size if offset < 200 else 1)
+
+    pages = list(app.iter_pages_parallel(fetch_page, app.page_windows(1000, 100), max_in_flight=1))
+    assert [offset for offset, _ in pages] == [0, 100, 200]
+    assert peak[0] == 1
+    assert fetched == [0, 100, 200]
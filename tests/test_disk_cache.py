@@ -0,0 +1,37 @@
+import sqlite3
+
+import app
+
+
+def stored_bytes(cache):
+    return cache.conn.execute("SELECT bytes FROM cache_size").fetchone()[0]
+
+
+def test_size_total_follows_replace_delete_and_eviction(tmp_path):
+    cache = app.DiskCache(str(tmp_path / 'cache.sqlite3'), 1000)
+    cache.put('n', 'a', 'x' * 300)
+    cache.put('n', 'a', 'x' * 100)
+    cache.put('n', 'b', 'y' * 400)
+    assert stored_bytes(cache) == 504
+    cache.put('n', 'c', 'z' * 700)
+    assert cache.get('n', 'a', 60) is None
+    assert stored_bytes(cache) == 702
+    cache.delete('c')
+    assert stored_bytes(cache) == 0
+
+
+def test_size_total_is_shared_by_connections_to_one_file(tmp_path):
+    path = str(tmp_path / 'cache.sqlite3')
+    first, second = app.DiskCache(path, 1000), app.DiskCache(path, 1000)
+    first.put('n', 'a', 'x' * 10)
+    second.put('n', 'b', 'y' * 20)
+    assert stored_bytes(first) == stored_bytes(second) == 34
+
+
+def test_search_survives_cache_write_failure(monkeypatch):
+    def fail(*args):
+        raise sqlite3.OperationalError("database is locked")
+    monkeypatch.setitem(app.SEARCH_SOURCES, 'crossref', lambda query, max_results, filters: [{"id": "c1"}])
+    monkeypatch.setattr(app.search_cache, 'put', fail)
+    monkeypatch.setattr(app, 'index_papers_async', lambda papers: None)
+    assert app.cached_source_search('crossref', 'protein folding', 5, {}, True) == [{"id": "c1"}]
@@ -0,0 +1,26 @@
+import app
+
+
+def test_seed_alias_restores_doi_from_crossref_id():
+    paper = app.parse_crossref_item({"DOI": "10.1038/s41586-021-03819-2", "title": ["Highly accurate protein structure prediction with AlphaFold"]})
+    assert paper["id"] == "crossref_10.1038_s41586-021-03819-2"
+    assert app.seed_alias(paper["id"]) == "DOI:10.1038/s41586-021-03819-2"
+
+
+def test_seed_alias_keeps_underscores_in_doi_suffix():
+    assert app.seed_alias("crossref_10.1109_cvpr.2016.90") == "DOI:10.1109/cvpr.2016.90"
+    assert app.seed_alias("crossref_10.1000_abc_def") == "DOI:10.1000/abc_def"
+
+
+def test_seed_alias_passes_through_other_ids():
+    assert app.seed_alias("semantic_649def34f8be52c8b66281af98ae884c09aef38b") == "649def34f8be52c8b66281af98ae884c09aef38b"
+    assert app.seed_alias("10.1038/nature14539") == "DOI:10.1038/nature14539"
+
+
+def test_seed_alias_maps_arxiv_id_without_version():
+    assert app.seed_alias("arxiv_2106.15928v2") == "ARXIV:2106.15928"
+    assert app.seed_alias("arxiv_hep-th/9901001v1") == "ARXIV:hep-th/9901001"
+
+
+def test_seed_alias_maps_pubmed_id():
+    assert app.seed_alias("pubmed_34265844") == "PMID:34265844"
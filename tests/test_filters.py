@@ -0,0 +1,21 @@
+import pytest
+
+import app
+
+
+@pytest.fixture
+def scholar_calls(monkeypatch):
+    calls = []
+    monkeypatch.setattr(app.scholar_pool, 'search', lambda *args: calls.append(args) or [])
+    return calls
+
+
+@pytest.mark.parametrize("filters", [None, {}, {"yearStart": "", "yearEnd": ""}, {"yearStart": "all", "yearEnd": "all"}])
+def test_scholar_search_treats_empty_years_as_unfiltered(scholar_calls, filters):
+    app.search_google_scholar_filtered('protein folding', 1, filters)
+    assert scholar_calls == [('protein folding', 1, None, None)]
+
+
+def test_scholar_search_passes_year_range_as_ints(scholar_calls):
+    app.search_google_scholar_filtered('protein folding', 5, {"yearStart": "2020", "yearEnd": 2024})
+    assert scholar_calls == [('protein folding', 5, 2020, 2024)]
@@ -0,0 +1,27 @@
+import pytest
+
+import app
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    # Keeps the test independent of the NLTK punkt download.
+    monkeypatch.setattr(app, 'tokenize', lambda text: text.lower().replace('.', ' ').split())
+    index = app.PaperIndex(str(tmp_path / 'index.sqlite3'))
+    index.add_papers([
+        {"id": "pubmed_1", "title": "The folding of proteins", "abstract": "No abstract available."},
+        {"id": "arxiv_2", "title": "Graph networks for the molecules", "abstract": "We study the protein graphs."},
+    ])
+    return index
+
+
+def test_stopwords_and_missing_abstracts_are_not_indexed(index):
+    terms = {row[0] for row in index.conn.execute("SELECT term FROM terms WHERE df > 0")}
+    assert not terms & app.STOPWORDS
+    assert not terms & {"abstract", "available"}
+    assert index.search("the abstract") == []
+
+
+def test_search_ignores_stopwords_in_the_query(index):
+    assert [paper["id"] for paper in index.search("the folding of the proteins")] == ["pubmed_1"]
+    assert [paper["id"] for paper in index.search("graphs", sources={"pubmed"})] == []
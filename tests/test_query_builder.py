@@ -0,0 +1,22 @@
+import app
+
+
+def plan_with(monkeypatch, topic, phrases):
+    # Keeps the test independent of the NLTK punkt download.
+    monkeypatch.setattr(app, 'tokenize', lambda text: text.lower().split())
+    monkeypatch.setattr(app, 'extract_keyphrases', lambda text, limit: [{"phrase": p, "score": 1.0} for p in phrases])
+    return app.build_local_query_plan(topic, notes='notes')
+
+
+def test_local_plan_does_not_repeat_overlapping_words(monkeypatch):
+    plan = plan_with(monkeypatch, 'message passing neural networks', ['neural networks', 'graph neural', 'molecule graph'])
+    assert plan["queries"] == ['message passing neural networks', 'message passing neural networks graph molecule']
+    assert plan["verbose_query"] == 'message passing neural networks graph molecule'
+    assert plan["source_queries"]["semantic"] == 'message passing neural networks graph molecule'
+
+
+def test_fan_out_search_sends_each_source_its_own_query(monkeypatch):
+    calls = {}
+    monkeypatch.setattr(app, 'run_source_search', lambda name, query, *args: calls.setdefault(name, query) and [])
+    app.fan_out_search('protein folding', ['pubmed', 'crossref'], source_queries={'pubmed': 'protein[Title/Abstract]'})
+    assert calls == {'pubmed': 'protein[Title/Abstract]', 'crossref': 'protein folding'}
@@ -0,0 +1,94 @@
+import pytest
+
+import app
+
+PAPERS = [
+    {"id": "p1", "title": "Protein folding with transformers", "year": 2019, "source": "PubMed", "venue": "Nature", "citations": 120, "pdfUrl": "https://example.org/p1.pdf"},
+    {"id": "p2", "title": "Graph networks for molecules", "year": 2021, "source": "arXiv", "citations": 4},
+    {"id": "p3", "title": "A survey of structure prediction", "source": "CrossRef", "venue": "Science", "citations": 0},
+    {"id": "p4", "title": "Contact maps revisited", "year": 2016, "source": "PubMed", "venue": "Nature"},
+]
+
+
+@pytest.fixture
+def client():
+    return app.create_app(start_background=False).test_client()
+
+
+@pytest.fixture
+def result_set_id(client):
+    return client.post('/api/result-sets', json={"papers": PAPERS}).json["result_set_id"]
+
+
+def test_export_accepts_source_list(client, result_set_id):
+    response = client.post('/api/export', json={"result_set_id": result_set_id, "format": "jsonl", "source": ["PubMed"]})
+    assert response.status_code == 200
+    assert response.get_data(as_text=True).count('\n') == 2
+
+
+@pytest.mark.parametrize("args", [{"year_start": "x"}, {"min_citations": ["10"]}])
+def test_export_rejects_invalid_filters(client, result_set_id, args):
+    response = client.post('/api/export', json={"result_set_id": result_set_id, "format": "csv", **args})
+    assert response.status_code == 400
+    assert "must be an integer" in response.json["error"]
+
+
+@pytest.mark.parametrize("args, expected", [
+    ({"year_end": "2019"}, ["p1", "p4"]),
+    ({"year_start": "2019"}, ["p1", "p2"]),
+    ({"year_start": "2017", "year_end": "2020"}, ["p1"]),
+])
+def test_year_range_excludes_unknown_years_for_either_bound(client, result_set_id, args, expected):
+    response = client.get(f'/api/result-sets/{result_set_id}', query_string={**args, "fields": "id"})
+    assert [paper["id"] for paper in response.json["papers"]] == expected
+
+
+def test_facet_counts_follow_end_only_year_range(client, result_set_id):
+    facets = client.get(f'/api/result-sets/{result_set_id}/facets', query_string={"year_end": "2019"}).json
+    assert facets["matched"] == 2
+    assert facets["facets"]["year"] == {"2016": 1, "2019": 1}
+    assert facets["facets"]["source"] == {"PubMed": 2, "arXiv": 0, "CrossRef": 0}
+
+
+def test_merging_result_sets_keeps_each_paper_at_its_best_score(client):
+    first = client.post('/api/result-sets', json={"papers": [{**PAPERS[0], "relevanceScore": 0.2}, {**PAPERS[1], "relevanceScore": 0.9}]})
+    second = client.post('/api/result-sets', json={"papers": [{**PAPERS[0], "relevanceScore": 0.7}, {**PAPERS[2], "relevanceScore": 0.1}]})
+    merged = client.post('/api/result-sets', json={"result_set_ids": [first.json["result_set_id"], second.json["result_set_id"]]})
+    assert merged.status_code == 201
+    page = client.get(f'/api/result-sets/{merged.json["result_set_id"]}', query_string={"fields": "id,relevanceScore"}).json
+    assert page["papers"] == [{"id": "p2", "relevanceScore": 0.9}, {"id": "p1", "relevanceScore": 0.7}, {"id": "p3", "relevanceScore": 0.1}]
+
+
+def test_merging_unknown_result_set_is_404(client, result_set_id):
+    response = client.post('/api/result-sets', json={"result_set_ids": [result_set_id, "missing"]})
+    assert response.status_code == 404
+
+
+def test_facets_read_string_years_and_citations(client):
+    papers = [{"id": "s1", "title": "A", "year": "2020", "citations": "7", "source": "Google Scholar"},
+              {"id": "s2", "title": "B", "year": "n.d.", "source": "Google Scholar"}]
+    result_set_id = client.post('/api/result-sets', json={"papers": papers}).json["result_set_id"]
+    response = client.get(f'/api/result-sets/{result_set_id}', query_string={"year_start": "2019", "min_citations": "5", "fields": "id"})
+    assert [paper["id"] for paper in response.json["papers"]] == ["s1"]
+
+
+@pytest.mark.parametrize("year", ["2020a", "n.d.", "", None])
+def test_deduplicate_treats_unparseable_years_as_unknown(client, year):
+    papers = [{"id": "a1", "title": "Highly accurate protein structure prediction with AlphaFold", "year": 2021, "source": "PubMed"},
+              {"id": "b1", "title": "Highly accurate protein structure prediction with AlphaFold", "year": year, "source": "Google Scholar"}]
+    response = client.post('/api/deduplicate', json={"papers": papers})
+    assert response.status_code == 200
+    assert len(response.json) == 1
+
+
+@pytest.mark.parametrize("field_weights", [{"venue": 1}, {"title": -1}, {"title": "heavy"}, {"title": True}, {"title": 0, "abstract": 0}, [2, 1], {}])
+def test_rank_rejects_invalid_field_weights(client, field_weights):
+    response = client.post('/api/rank-bm25', json={"papers": PAPERS, "verbose_query": "protein folding", "field_weights": field_weights})
+    assert response.status_code == 400
+    assert "Invalid field_weights" in response.json["error"]
+
+
+def test_parse_field_weights_accepts_known_fields():
+    assert app.parse_field_weights({"title": 3, "abstract": "0.5"}) == {"title": 3.0, "abstract": 0.5}
+    assert app.parse_field_weights({"abstract": 1}) == {"abstract": 1.0}
+    assert app.parse_field_weights(None) is None